@@ -0,0 +1,433 @@
+"""
+admission.py
+
+Admission control for the upstream providers (the HF image-to-text API and
+the OpenAI chat completions API), so a traffic spike queues briefly or is
+turned away instead of firing unbounded concurrent calls that come back as
+429s.
+
+Each provider has a ProviderLimiter with:
+1) Token buckets for requests per minute and (for the LLM) tokens per
+   minute. A bucket holds up to ADMISSION_BURST_SECONDS worth of its rate,
+   so short bursts go straight through.
+2) A bounded wait queue ordered by priority, then arrival. Interactive
+   requests (a user is waiting on the response) always go ahead of
+   background work (upload analysis, speculative drafts); background work
+   also gets a smaller share of the queue.
+3) Early rejection: a call is refused with Overloaded (a 503 with
+   Retry-After in the app) as soon as its queue is full or its projected
+   wait exceeds ADMISSION_MAX_WAIT, instead of every caller timing out
+   together later.
+4) Retry-After: when a provider answers 429 (or 503) with Retry-After, the
+   whole provider is paused for that long, not just the call that saw it.
+
+The buckets live in each process. With several web or worker processes
+calling the same provider, set ADMISSION_PROCESSES to how many there are; each
+process then gets that share of the configured rates, so together they stay
+within them.
+
+The limiter is thread-safe and has a blocking acquire (HF calls run in the
+threadpool) and an async acquire_async (the LLM client). Priority is taken
+from a context variable, set with `with background():` around background
+work; tasks and threadpool calls started inside inherit it.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from bisect import insort
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from typing import Optional
+
+from metrics import Counter, Histogram, registry
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# HF_REQUESTS_PER_MINUTE      - image-to-text calls per minute (0 = unlimited).
+# LLM_REQUESTS_PER_MINUTE     - chat completion calls per minute (0 = unlimited).
+# LLM_TOKENS_PER_MINUTE       - estimated prompt + completion tokens per minute
+#                               (0 = unlimited).
+# ADMISSION_BURST_SECONDS     - seconds of each rate a bucket can hold.
+# ADMISSION_MAX_QUEUE         - calls allowed to wait per provider.
+# ADMISSION_BACKGROUND_QUEUE  - of those, how many may be background work.
+# ADMISSION_MAX_WAIT          - longest a call may wait before it is refused (s).
+# ADMISSION_PROCESSES         - processes sharing the rates above (default:
+#                               WEB_CONCURRENCY, or 1).
+# ------------------------------------------------------------------------------
+HF_REQUESTS_PER_MINUTE = float(os.getenv("HF_REQUESTS_PER_MINUTE", "300"))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "150000"))
+ADMISSION_BURST_SECONDS = float(os.getenv("ADMISSION_BURST_SECONDS", "5"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_BACKGROUND_QUEUE = int(os.getenv("ADMISSION_BACKGROUND_QUEUE", "16"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "10"))
+ADMISSION_PROCESSES = max(int(os.getenv("ADMISSION_PROCESSES", os.getenv("WEB_CONCURRENCY", "1"))), 1)
+
+# Priorities, lowest value served first.
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Priority of the work running in the current context.
+_priority: ContextVar[int] = ContextVar("admission_priority", default=INTERACTIVE)
+
+rejections = registry.register(Counter(
+    "caption_admission_rejections_total", "Upstream calls refused by admission control.",
+    ("provider", "priority")))
+throttles = registry.register(Counter(
+    "caption_admission_throttles_total", "Provider responses that asked us to back off (Retry-After).",
+    ("provider",)))
+wait_seconds = registry.register(Histogram(
+    "caption_admission_wait_seconds", "Time upstream calls spent queued for admission.",
+    ("provider", "priority")))
+
+
+class Overloaded(Exception):
+    """
+    Raised when a call is refused because the provider's queue is full or
+    the wait would be too long.
+
+    Args:
+        provider (str): The provider that refused the call.
+        retry_after (float): Seconds after which a retry is likely to be admitted.
+    """
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} is overloaded; retry in {retry_after:.0f}s.")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+@contextmanager
+def background():
+    """
+    Runs the block (and the tasks and threadpool calls it starts) at
+    background priority.
+    """
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    """
+    Returns the priority of the work running in the current context.
+    """
+    return _priority.get()
+
+
+class TokenBucket:
+    """
+    Refills at per_minute / 60 units per second, up to burst_seconds worth.
+    A rate of 0 or less never limits.
+
+    Not thread-safe on its own; ProviderLimiter calls it under its lock.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = ADMISSION_BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self, now: float) -> float:
+        """
+        Returns the units in the bucket at now.
+        """
+        self._refill(now)
+        return self.level
+
+    def time_for(self, amount: float, now: float) -> float:
+        """
+        Returns the seconds until amount units will have accrued, which may be
+        more than the bucket holds (to project how long a queue takes to drain).
+        """
+        if self.unlimited:
+            return 0.0
+        missing = amount - self.available(now)
+        return missing / self.rate if missing > 0 else 0.0
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """
+        Returns the seconds until cost units are available (0 if they are now).
+        A cost above the capacity waits for a full bucket.
+        """
+        return self.time_for(min(cost, self.capacity), now)
+
+    def take(self, cost: float, now: float):
+        if not self.unlimited:
+            self._refill(now)
+            self.level -= min(cost, self.capacity)
+
+    def adjust(self, amount: float):
+        """
+        Credits (positive) or debits (negative) units, e.g. once a call's
+        real token usage is known. The level may go negative (debt).
+        """
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "deadline", "_event", "_loop")
+
+    def __init__(self, priority: int, seq: int, tokens: float, deadline: float, loop=None):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.deadline = deadline
+        self._loop = loop
+        self._event = asyncio.Event() if loop is not None else threading.Event()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def notify(self):
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+
+class ProviderLimiter:
+    """
+    Rate limits and queues the calls to one upstream provider.
+
+    Args:
+        name (str): Provider name used in errors, metrics and stats.
+        requests_per_minute (float): Request rate (0 = unlimited).
+        tokens_per_minute (float): Token rate (0 = unlimited).
+        max_queue (int): Calls allowed to wait at once.
+        background_queue (int): Of those, background calls allowed to wait.
+        max_wait (float): Longest a call may wait before it is refused (s).
+        burst_seconds (float): Seconds of each rate a bucket can hold.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_queue: int = ADMISSION_MAX_QUEUE, background_queue: int = ADMISSION_BACKGROUND_QUEUE,
+                 max_wait: float = ADMISSION_MAX_WAIT, burst_seconds: float = ADMISSION_BURST_SECONDS):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, burst_seconds)
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds)
+        self.max_queue = max_queue
+        self.background_queue = min(background_queue, max_queue)
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        # Waiting calls, in the order they will be admitted.
+        self._queue = []
+        self._seq = count()
+        self._paused_until = 0.0
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    def acquire(self, tokens: float = 0, priority: Optional[int] = None):
+        """
+        Blocks until the call may go ahead.
+
+        Args:
+            tokens (float): Estimated tokens the call will use.
+            priority (int): INTERACTIVE or BACKGROUND; defaults to the
+                current context's priority.
+
+        Raises:
+            Overloaded: If the queue is full or the wait would exceed max_wait.
+        """
+        waiter = self._enqueue(tokens, priority, None)
+        if waiter is None:
+            return
+        start = time.monotonic()
+        try:
+            while True:
+                waiter._event.clear()
+                delay = self._poll(waiter)
+                if delay == 0:
+                    return
+                waiter._event.wait(delay)
+        finally:
+            self._leave(waiter, start)
+
+    async def acquire_async(self, tokens: float = 0, priority: Optional[int] = None):
+        """
+        Async version of acquire; waits without holding a thread.
+        """
+        waiter = self._enqueue(tokens, priority, asyncio.get_running_loop())
+        if waiter is None:
+            return
+        start = time.monotonic()
+        try:
+            while True:
+                waiter._event.clear()
+                delay = self._poll(waiter)
+                if delay == 0:
+                    return
+                try:
+                    await asyncio.wait_for(waiter._event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._leave(waiter, start)
+
+    def check(self, priority: Optional[int] = None):
+        """
+        Refuses early, before any work is done for a request, if a call at
+        this priority would be refused right now.
+
+        Raises:
+            Overloaded: If the queue is full or the wait would exceed max_wait.
+        """
+        priority = current_priority() if priority is None else priority
+        with self._lock:
+            self._check(priority, 0, time.monotonic())
+
+    def pause(self, seconds: float):
+        """
+        Holds back every call to this provider for seconds, e.g. after a 429
+        with Retry-After.
+        """
+        throttles.inc(self.name)
+        with self._lock:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def settle(self, estimated: float, actual: float):
+        """
+        Corrects the token bucket once a call's real usage is known.
+        """
+        with self._lock:
+            self.tokens.adjust(estimated - actual)
+
+    def stats(self) -> dict:
+        """
+        Returns the queue length, bucket levels and admission counters.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "queued_now": len(self._queue),
+                "queued_background": sum(w.priority == BACKGROUND for w in self._queue),
+                "request_budget": None if self.requests.unlimited else self.requests.available(now),
+                "token_budget": None if self.tokens.unlimited else self.tokens.available(now),
+                "paused_seconds": max(self._paused_until - now, 0.0),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "throttled": self.throttled,
+            }
+
+    def _enqueue(self, tokens: float, priority: Optional[int], loop) -> Optional[_Waiter]:
+        # Admits the call straight away (returns None) or queues it.
+        priority = current_priority() if priority is None else priority
+        now = time.monotonic()
+        with self._lock:
+            if not self._queue and self._delay(tokens, now) == 0:
+                self._take(tokens, now)
+                return None
+            self._check(priority, tokens, now)
+            waiter = _Waiter(priority, next(self._seq), tokens, now + self.max_wait, loop)
+            insort(self._queue, waiter)
+            self.queued += 1
+            if self._queue[0] is waiter:
+                self._notify_head()
+            return waiter
+
+    def _check(self, priority: int, tokens: float, now: float):
+        # Raises Overloaded if a new call at priority would not get through.
+        full = len(self._queue) >= self.max_queue
+        if priority == BACKGROUND:
+            full = full or sum(w.priority == BACKGROUND for w in self._queue) >= self.background_queue
+        projected = self._projected_wait(priority, tokens, now)
+        if full or projected > self.max_wait:
+            self.rejected += 1
+            rejections.inc(self.name, PRIORITY_NAMES[priority])
+            raise Overloaded(self.name, max(projected, 1.0))
+
+    def _projected_wait(self, priority: int, tokens: float, now: float) -> float:
+        # Time until the buckets have refilled for every call ahead of this one.
+        ahead = [w for w in self._queue if w.priority <= priority]
+        return max(self._paused_until - now,
+                   self.requests.time_for(len(ahead) + 1, now),
+                   self.tokens.time_for(sum(w.tokens for w in ahead) + tokens, now), 0.0)
+
+    def _delay(self, tokens: float, now: float) -> float:
+        return max(self._paused_until - now, self.requests.wait_time(1, now),
+                   self.tokens.wait_time(tokens, now), 0.0)
+
+    def _take(self, tokens: float, now: float):
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+        self.admitted += 1
+
+    def _poll(self, waiter: _Waiter) -> float:
+        # Admits waiter if it is at the head and the buckets allow it (returns
+        # 0); otherwise returns how long to sleep before polling again.
+        # Raises Overloaded once its deadline has passed.
+        now = time.monotonic()
+        with self._lock:
+            if self._queue[0] is waiter:
+                delay = self._delay(waiter.tokens, now)
+                if delay == 0:
+                    self._take(waiter.tokens, now)
+                    self._queue.pop(0)
+                    self._notify_head()
+                    return 0
+            else:
+                delay = waiter.deadline - now
+            remaining = waiter.deadline - now
+            if remaining <= 0:
+                self.rejected += 1
+                rejections.inc(self.name, PRIORITY_NAMES[waiter.priority])
+                raise Overloaded(self.name, max(self._projected_wait(waiter.priority, waiter.tokens, now), 1.0))
+            return min(delay, remaining)
+
+    def _leave(self, waiter: _Waiter, start: float):
+        # Drops a waiter that gave up (deadline, cancellation) and records the wait.
+        wait_seconds.observe(time.monotonic() - start, self.name, PRIORITY_NAMES[waiter.priority])
+        with self._lock:
+            if waiter in self._queue:
+                was_head = self._queue[0] is waiter
+                self._queue.remove(waiter)
+                if was_head:
+                    self._notify_head()
+
+    def _notify_head(self):
+        if self._queue:
+            self._queue[0].notify()
+
+
+def retry_after_from(error: Exception) -> Optional[float]:
+    """
+    Returns the Retry-After seconds of a provider error carrying an HTTP
+    response (httpx, requests or huggingface_hub errors) with status 429 or
+    503, or None.
+    """
+    response = getattr(error, "response", None)
+    if response is None or getattr(response, "status_code", None) not in (429, 503):
+        return None
+    try:
+        return max(float(response.headers.get("retry-after")), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+# Shared limiters for the two upstream providers, each with this process's
+# share of the rates.
+hf_limiter = ProviderLimiter("hf", HF_REQUESTS_PER_MINUTE / ADMISSION_PROCESSES)
+llm_limiter = ProviderLimiter("llm", LLM_REQUESTS_PER_MINUTE / ADMISSION_PROCESSES,
+                              LLM_TOKENS_PER_MINUTE / ADMISSION_PROCESSES)
@@ -0,0 +1,121 @@
+"""
+analysis.py
+
+Turns uploaded image bytes into the description used as caption context.
+Shared by the web app (in-process analysis, /generate, /batch_captions) and
+the queue workers (worker.py).
+
+A description comes from, in order:
+1) The description cache, for byte-identical repeat uploads.
+2) The near-duplicate index, for re-encoded or resized copies of an earlier
+   upload.
+3) The description router (downscaling the image first), which calls the
+   configured backends.
+With SCENE_TAGS=1 the top CLIP scene tags are appended as an extra line. The
+tags are cached under the same image key, so repeat uploads skip the CLIP pass
+as well.
+"""
+
+import logging
+import os
+import time
+from typing import Optional
+
+from description_cache import CACHE_DIR, DescriptionCache, description_cache, image_key
+from description_router import describe_image, router
+from image_preprocessing import PREPROCESS_ENABLED, preprocess_image
+from metrics import timed
+from near_duplicates import NEAR_DUPLICATES_ENABLED, dhash, informative, near_duplicates
+
+logger = logging.getLogger(__name__)
+
+# Optional CLIP scene tagging (needs numpy, torch and clip): the top tags from
+# the precomputed tag index are added to each description as caption context.
+SCENE_TAGS = os.getenv("SCENE_TAGS", "0") == "1"
+if SCENE_TAGS:
+    from scene_tags import scene_context, tag_image, warmup as warmup_scene_tags
+
+    # Scene-tag context lines keyed by image key, next to the descriptions.
+    scene_tag_cache = DescriptionCache(cache_dir=os.path.join(CACHE_DIR, "scene_tags") if CACHE_DIR else None)
+
+
+def describe_bytes(data: bytes) -> str:
+    """
+    Describes an image, answering repeat uploads of the same image from the
+    description cache without calling the inference backend. Re-encoded or
+    resized copies of an earlier upload are matched by perceptual hash and
+    reuse its description. On a miss the image is downscaled before it is
+    sent to the backend. With SCENE_TAGS=1 the top CLIP scene tags are
+    appended as an extra line.
+    """
+    image = data
+    key = image_key(data)
+    # A miss is only counted once the near-duplicate index has missed too.
+    result = description_cache.get(key, count_miss=False)
+    fingerprint = None
+    match_key = None
+    if result is None and NEAR_DUPLICATES_ENABLED:
+        fingerprint = dhash(data)
+        if fingerprint is not None and not informative(fingerprint):
+            # Featureless images all hash alike; never reuse their descriptions.
+            fingerprint = None
+        while result is None and fingerprint is not None:
+            match = near_duplicates.lookup(fingerprint)
+            if match is None:
+                break
+            match_key, match_hash, _ = match
+            result = description_cache.get_near_duplicate(match_key)
+            if result is None:
+                # The matched description has been evicted; forget its hash
+                # and look for the next closest one.
+                near_duplicates.remove(match_hash)
+                match_key = None
+            else:
+                description_cache.put(key, result)
+    if result is None:
+        description_cache.count_miss()
+        start = time.perf_counter()
+        if PREPROCESS_ENABLED:
+            with timed("preprocess"):
+                data, _ = preprocess_image(data)
+        with timed("inference"):
+            result = describe_image(data)
+        description_cache.put(key, result, time.perf_counter() - start)
+        if fingerprint is not None:
+            near_duplicates.add(fingerprint, key)
+    if SCENE_TAGS:
+        result = add_scene_tags(result, image, key, match_key)
+    return result
+
+
+def add_scene_tags(description: str, image: bytes, key: Optional[str] = None,
+                   match_key: Optional[str] = None) -> str:
+    """
+    Appends the image's top scene tags to its description. The tags are
+    cached under key; a near-duplicate reuses those of match_key, the upload
+    it matched. Tagging is best effort; on failure the description is
+    returned unchanged (and nothing is cached).
+    """
+    context = scene_tag_cache.get(key) if key else None
+    if context is None:
+        if match_key:
+            context = scene_tag_cache.get(match_key)
+        if context is None:
+            try:
+                context = scene_context(tag_image(image)) or ""
+            except Exception as e:
+                logger.warning("Scene tagging failed: %s", e)
+                return description
+        if key:
+            scene_tag_cache.put(key, context)
+    return f"{description}\n{context}" if context else description
+
+
+def warmup():
+    """
+    Builds the description backends' clients and models, and the scene-tag
+    model and index when enabled, so the first request does not pay for them.
+    """
+    router.warmup()
+    if SCENE_TAGS:
+        warmup_scene_tags()
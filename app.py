@@ -6,41 +6,357 @@ A FastAPI app that:
 2) Describes the image via BLIP in the background.
 3) Allows the user to provide additional context.
 4) Generates a final caption.
-5) Records user feedback and generates three alternative caption prompts.
+5) Records user feedback (feedback_log.py) and generates three alternative
+   caption prompts.
+6) Captions whole photo sets in one request (/batch_captions).
+7) Serves a single-request JSON API (/generate).
+
+With JOB_QUEUE=1 step 2 runs in separate worker processes (worker.py) fed by a
+durable queue (job_queue.py) instead of as a background task in this process.
+
+Upstream calls go through admission control (admission.py): when a
+provider's queue is full the request is refused with 503 and Retry-After,
+and upload analysis runs at a lower priority than interactive requests.
 """
 
 import os
 import uuid
 import time
-from fastapi import FastAPI, File, UploadFile, Form, Request, BackgroundTasks
-from fastapi.responses import HTMLResponse, RedirectResponse
+import asyncio
+import gc
+import io
+import json
+import logging
+from typing import AsyncIterator, List, Optional
+import jinja2
+from fastapi import FastAPI, File, UploadFile, Form, Request, BackgroundTasks, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from image_analysis import describe_image
-from caption_generator import generate_caption, generate_alternative_prompts
+from admission import BACKGROUND, Overloaded, background, hf_limiter, llm_limiter
+from analysis import describe_bytes, warmup
+from description_router import router
+from description_cache import description_cache
+from near_duplicates import near_duplicates
+from image_preprocessing import preprocessing_stats
+from result_store import PENDING, RESULT_STORE, create_result_store
+from job_queue import JOB_QUEUE, JOB_QUEUE_MAX_DEPTH, JobQueue
+from caption_generator import (CAPTION_CANDIDATES, cached_caption, cached_caption_candidates, generate_caption_async,
+                               generate_caption_candidates_async, generate_alternative_prompts_async,
+                               stream_caption, stream_alternative_prompts)
+from caption_cache import caption_cache
+from speculation import speculator
+from llm_client import llm_client
+from feedback_log import feedback_log
+from metrics import (CONTENT_TYPE, Gauge, TimingMiddleware, process_uptime, record, registry, request_timings,
+                     timed, timeout)
+from schemas import GenerateRequest, GenerateResponse
 import uvicorn
 
 app = FastAPI()
 
+# Server lifecycle messages go through uvicorn's logger (also set up by
+# gunicorn's uvicorn workers), next to its own startup lines.
+logger = logging.getLogger("uvicorn.error")
+
 # Mount static files (CSS, etc.)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Set up the templates directory
 templates = Jinja2Templates(directory="templates")
 
-# Global dictionary to store image analysis results keyed by uid
-analysis_results = {}
+# Async environment over the same templates, for progressively rendered pages
+streaming_templates = jinja2.Environment(
+    loader=jinja2.FileSystemLoader("templates"), autoescape=True, enable_async=True)
+
+# Image analysis results keyed by uid (bounded and TTL-evicting; set
+# RESULT_STORE=sqlite to share results between uvicorn worker processes)
+analysis_results = create_result_store()
+
+# Durable analysis queue drained by worker.py processes (JOB_QUEUE=1). The
+# workers hand results back through the result store, so it must be shared.
+if JOB_QUEUE and RESULT_STORE != "sqlite":
+    raise ValueError("JOB_QUEUE=1 needs RESULT_STORE=sqlite so worker results reach the web processes.")
+analysis_jobs = JobQueue() if JOB_QUEUE else None
+if JOB_QUEUE and speculator.enabled:
+    logger.warning("SPECULATIVE_CAPTIONS has no effect with JOB_QUEUE=1: drafts start in the process "
+                   "that ran the analysis, and the workers run it.")
+
+# Completion events keyed by uid for analyses running in this process; set and
+# removed once analysis has finished (successfully or not) so local waiters
+# wake up immediately instead of polling.
+analysis_events = {}
+
+# Longest time /generate_caption waits for a pending analysis (seconds).
+ANALYSIS_TIMEOUT = float(os.getenv("ANALYSIS_TIMEOUT", "10"))
+
+# How often to re-check the result store for analyses running in another
+# worker process (seconds).
+STORE_POLL_INTERVAL = float(os.getenv("STORE_POLL_INTERVAL", "0.2"))
+
+# Longest time a single /analysis_status long-poll is held open (seconds).
+STATUS_POLL_TIMEOUT = float(os.getenv("STATUS_POLL_TIMEOUT", "25"))
+
+# Largest accepted upload (bytes) and the chunk size used to stream it in.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(64 * 1024)))
+
+# Largest whole /batch_captions request body (bytes).
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Room for the multipart boundaries, headers and text fields around an upload.
+FORM_OVERHEAD_BYTES = 64 * 1024
 
+# Batch captioning limits: images per request, and how many images of one
+# request may be in the describe and caption stages at the same time.
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "500"))
+BATCH_DESCRIBE_CONCURRENCY = int(os.getenv("BATCH_DESCRIBE_CONCURRENCY", "4"))
+BATCH_CAPTION_CONCURRENCY = int(os.getenv("BATCH_CAPTION_CONCURRENCY", "8"))
 
-def process_image(uid: str, filename: str):
+# Startup: WARMUP=1 builds the backend clients and loads models in the startup
+# hook, before the first request. PRELOAD_MODELS=1 does it at import instead, so
+# a `gunicorn --preload` master loads the weights once and its forked workers
+# share those pages copy-on-write (see gunicorn_conf.py).
+WARMUP = os.getenv("WARMUP", "0") == "1"
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "0") == "1"
+
+# Seconds from process start until the app was ready to serve.
+ready_seconds = None
+
+
+class BodyLimitMiddleware:
+    """
+    ASGI middleware that answers 413 to upload requests whose body is larger
+    than their route allows, before the multipart form is parsed (which would
+    spool the whole body to the temp directory first). A Content-Length over
+    the limit is refused without reading the body; a chunked body is counted
+    as it arrives and cut off as soon as it crosses the limit.
+
+    Args:
+        app: The ASGI app to wrap.
+        limits (dict): Largest body in bytes, by request path.
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        rejected = False
+
+        async def receive_limited():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit and not rejected:
+                    rejected = True
+                    await self._reject(send, limit)
+            if rejected:
+                # Stops the form parser; the app's own response is discarded.
+                return {"type": "http.disconnect"}
+            return message
+
+        async def send_unless_rejected(message):
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, receive_limited, send_unless_rejected)
+        except Exception:
+            if not rejected:
+                raise
+
+    @staticmethod
+    async def _reject(send, limit: int):
+        body = json.dumps({"detail": f"Request body is larger than {limit} bytes."}).encode()
+        await send({"type": "http.response.start", "status": 413, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+            (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
+
+
+# Refuse oversized uploads before they are spooled.
+app.add_middleware(BodyLimitMiddleware, limits={
+    "/upload_image": MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES,
+    "/generate": MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES,
+    "/batch_captions": BATCH_MAX_BYTES,
+})
+
+# Per-request latency histogram and optional Server-Timing headers.
+app.add_middleware(TimingMiddleware)
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES,
+                      chunk_size: int = UPLOAD_CHUNK_BYTES) -> bytes:
+    """
+    Reads an upload into a single in-memory buffer without touching the CWD.
+
+    BodyLimitMiddleware has already refused request bodies well over
+    max_bytes. Starlette has streamed the multipart body into a spooled file
+    (in memory up to 1 MB, then in the system temp directory) and recorded its
+    size. When the size is known it is checked against max_bytes before
+    anything is read, and the image is read in one call straight into its
+    final bytes object, so peak RSS per upload is about 1x the image size
+    plus the 1 MB spool. When the size is unknown the spool is streamed in
+    chunk_size pieces and rejected as soon as it crosses max_bytes; peak RSS
+    is then about 2x the image size while the chunks are joined.
+
+    Args:
+        file (UploadFile): The uploaded file.
+        max_bytes (int): Largest accepted upload; larger uploads get a 413.
+        chunk_size (int): Bytes read per chunk when the size is unknown.
+
+    Returns:
+        bytes: The uploaded image bytes.
+    """
+    too_large = HTTPException(
+        status_code=413, detail=f"Image is larger than {max_bytes} bytes.")
+
+    if file.size is not None:
+        if file.size > max_bytes:
+            raise too_large
+        data = await file.read(file.size)
+    else:
+        chunks = []
+        size = 0
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise too_large
+            chunks.append(chunk)
+        data = b"".join(chunks)
+
+    if not data:
+        raise HTTPException(status_code=400, detail="Uploaded image is empty.")
+    return data
+
+
+async def process_image(uid: str, data: bytes, queued_at: Optional[float] = None):
     """
     Performs image analysis in the background and stores the result.
+    The blocking inference call runs in the threadpool; the uid's completion
+    event is set when it finishes. queued_at (a time.perf_counter() value) is
+    when the upload was accepted, to measure how long the analysis queued.
+    """
+    if queued_at is not None:
+        record("analysis_queue", time.perf_counter() - queued_at)
+    try:
+        # Nobody is waiting on this response yet; let interactive calls go first.
+        with background():
+            description = await run_in_threadpool(describe_bytes, data)
+        analysis_results.put(uid, description)
+        # Draft a caption while the user fills in the context form.
+        speculator.start(uid, description)
+    except Exception:
+        # Drop the pending marker so waiters fall back to the default description.
+        analysis_results.pop(uid)
+        raise
+    finally:
+        event = analysis_events.pop(uid, None)
+        if event is not None:
+            event.set()
+
+
+async def wait_for_analysis(uid: str, timeout: float) -> bool:
+    """
+    Waits until the analysis for uid has finished, without holding a thread.
+
+    Args:
+        uid (str): The upload id.
+        timeout (float): Maximum number of seconds to wait.
+
+    Returns:
+        bool: True if the analysis has finished, False on timeout or unknown uid.
+    """
+    event = analysis_events.get(uid)
+    if event is not None:
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    # The analysis is not running in this process; it may be running in
+    # another worker, so poll the shared store until it leaves "pending".
+    deadline = time.monotonic() + timeout
+    while analysis_results.status(uid) == PENDING:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(STORE_POLL_INTERVAL, remaining))
+    return uid in analysis_results
+
+
+registry.register(Gauge(
+    "caption_analysis_results", "Entries (pending or ready) in the analysis result store.",
+    lambda: len(analysis_results)))
+registry.register(Gauge(
+    "caption_analyses_in_flight", "Image analyses running in this process.",
+    lambda: len(analysis_events)))
+registry.register(Gauge(
+    "caption_analysis_jobs_queued", "Analysis jobs waiting for a worker (JOB_QUEUE=1).",
+    lambda: analysis_jobs.depth() if analysis_jobs is not None else None))
+registry.register(Gauge(
+    "caption_analysis_oldest_job_seconds", "Age of the oldest analysis job waiting for a worker (JOB_QUEUE=1).",
+    lambda: analysis_jobs.stats()["oldest_queued_seconds"] if analysis_jobs is not None else None))
+registry.register(Gauge(
+    "caption_ready_seconds", "Seconds from process start until the app was ready to serve.",
+    lambda: ready_seconds))
+
+
+def render_template(name: str, context: dict) -> HTMLResponse:
+    """
+    Renders a template into a complete response, timing the render.
+    """
+    with timed("render"):
+        return templates.TemplateResponse(name, context)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, exc: Overloaded):
+    """
+    Answers requests refused by admission control with 503 and Retry-After.
     """
-    result = describe_image(filename)
-    analysis_results[uid] = result
-    # Clean up the temporary file
-    if os.path.exists(filename):
-        os.remove(filename)
+    return JSONResponse({"detail": str(exc)}, status_code=503,
+                        headers={"Retry-After": str(max(int(exc.retry_after + 0.999), 1))})
+
+
+@app.on_event("startup")
+async def startup():
+    """
+    Runs the warmup hook if enabled, and records how long startup took.
+    """
+    global ready_seconds
+    if WARMUP and not PRELOAD_MODELS:
+        await run_in_threadpool(warmup)
+    ready_seconds = process_uptime()
+    logger.info("Ready %.2fs after process start.", ready_seconds)
+
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    """
+    Closes the pooled LLM connections when the server stops, and writes the
+    feedback records still queued.
+    """
+    await llm_client.aclose()
+    await run_in_threadpool(feedback_log.close)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -48,25 +364,50 @@ def index(request: Request):
     """
     Serves the initial image upload page.
     """
-    return templates.TemplateResponse("index.html", {"request": request})
+    return render_template("index.html", {"request": request})
 
 
 @app.post("/upload_image")
 async def upload_image(request: Request, background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """
-    Saves the uploaded image, starts the background image analysis, and
-    returns a processing page that will redirect to the context page after 5 seconds.
+    Reads the uploaded image into memory, starts the background image analysis
+    (or enqueues it for the workers with JOB_QUEUE=1), and returns a processing
+    page that redirects to the context page as soon as /analysis_status reports
+    the description is ready. Refused with 503 up front if the description
+    queue has no room for more background work.
     """
+    if analysis_jobs is not None:
+        if await run_in_threadpool(analysis_jobs.depth) >= JOB_QUEUE_MAX_DEPTH:
+            raise Overloaded("analysis queue", 5.0)
+    else:
+        hf_limiter.check(BACKGROUND)
+    with timed("upload"):
+        data = await read_upload(file)
     uid = str(uuid.uuid4())
-    temp_filename = f"temp_{uid}.jpg"
-    with open(temp_filename, "wb") as f:
-        f.write(await file.read())
+    analysis_results.mark_pending(uid)
+
+    if analysis_jobs is not None:
+        # Durable: a worker process picks it up, even across restarts of this one.
+        await run_in_threadpool(analysis_jobs.enqueue, uid, data)
+    else:
+        analysis_events[uid] = asyncio.Event()
+        # Launch image analysis in the background.
+        background_tasks.add_task(process_image, uid, data, time.perf_counter())
 
-    # Launch image analysis in the background.
-    background_tasks.add_task(process_image, uid, temp_filename)
+    # Render a processing page that long-polls /analysis_status then redirects to /context.
+    return render_template("processing.html", {"request": request, "uid": uid})
 
-    # Render a processing page that waits 5 seconds then redirects to /context.
-    return templates.TemplateResponse("processing.html", {"request": request, "uid": uid})
+
+@app.get("/analysis_status")
+async def analysis_status(uid: str, wait: float = 0):
+    """
+    Reports whether the description for uid is ready. With wait > 0 the
+    request is held open (long-poll) until the analysis finishes or the wait
+    elapses, so the processing page can move on the moment it is done.
+    """
+    ready = await wait_for_analysis(uid, min(max(wait, 0), STATUS_POLL_TIMEOUT))
+    known = ready or analysis_results.status(uid) is not None
+    return {"uid": uid, "ready": ready, "known": known}
 
 
 @app.get("/context", response_class=HTMLResponse)
@@ -75,53 +416,490 @@ def get_context(request: Request, uid: str):
     Renders the additional context page.
     The raw description is not displayed; only the uid is passed along.
     """
-    return templates.TemplateResponse("context.html", {"request": request, "uid": uid})
+    return render_template("context.html", {"request": request, "uid": uid})
 
 
 @app.post("/generate_caption", response_class=HTMLResponse)
-def generate_caption_route(
+async def generate_caption_route(
     request: Request,
     uid: str = Form(...),
     location: str = Form(""),
     tone: str = Form(""),
-    additional_context: str = Form("")
+    additional_context: str = Form(""),
+    fresh: bool = Form(False)
 ):
     """
-    Retrieves the image analysis result using the uid (waiting briefly if needed),
-    then generates and displays the final caption without showing the raw description.
+    Retrieves the image analysis result using the uid (waiting on its completion
+    event if needed), then generates and displays the final caption without
+    showing the raw description. A speculative draft is used when it matches
+    the submitted context. Set fresh to bypass drafts and the caption cache.
+    With CAPTION_CANDIDATES > 1 the runner-up candidates are listed as well.
+    """
+    llm_limiter.check()
+    start = time.perf_counter()
+    raw_description, final_caption = await take_description(
+        uid, location, tone, additional_context, fresh)
+    alternatives = []
+    if final_caption is None and CAPTION_CANDIDATES > 1:
+        # n-best mode: one upstream call, reranked locally.
+        final_caption, *alternatives = await generate_caption_candidates_async(
+            image_description=raw_description,
+            location=location,
+            tone=tone,
+            additional_context=additional_context,
+            fresh=fresh
+        )
+    elif final_caption is None:
+        final_caption = await generate_caption_async(
+            image_description=raw_description,
+            location=location,
+            tone=tone,
+            additional_context=additional_context,
+            fresh=fresh
+        )
+    return render_template("final.html", {
+        "request": request, "caption": final_caption, "alternatives": alternatives, "tone": tone,
+        "location": location, "caption_ms": round((time.perf_counter() - start) * 1000, 1)})
+
+
+@app.post("/generate_caption_stream", response_class=HTMLResponse)
+async def generate_caption_stream_route(
+    request: Request,
+    uid: str = Form(...),
+    location: str = Form(""),
+    tone: str = Form(""),
+    additional_context: str = Form(""),
+    fresh: bool = Form(False)
+):
+    """
+    Same as /generate_caption, but the page is sent as a chunked response and
+    the caption is streamed into it token by token as the model produces it.
+    With CAPTION_CANDIDATES > 1 the candidates are generated and reranked
+    first (ranking needs them all), then the best is sent as one chunk and
+    the runner-ups are listed as other options.
+    """
+    llm_limiter.check()
+    start = time.perf_counter()
+    raw_description, draft = await take_description(
+        uid, location, tone, additional_context, fresh)
+    alternatives = []
+    if draft is not None:
+        tokens = single_token(draft)
+    elif CAPTION_CANDIDATES > 1:
+        caption, *alternatives = await generate_caption_candidates_async(
+            image_description=raw_description,
+            location=location,
+            tone=tone,
+            additional_context=additional_context,
+            fresh=fresh
+        )
+        tokens = single_token(caption)
+    else:
+        tokens = stream_caption(
+            image_description=raw_description,
+            location=location,
+            tone=tone,
+            additional_context=additional_context,
+            fresh=fresh
+        )
+    return stream_template("final.html", {
+        "request": request, "caption_stream": TokenStream(tokens, start), "alternatives": alternatives,
+        "tone": tone, "location": location})
+
+
+async def take_description(uid: str, location: str, tone: str, additional_context: str, fresh: bool):
+    """
+    Waits for and removes uid's description, and claims a matching
+    speculative draft unless a fresh caption was requested.
+
+    Returns:
+        tuple: (description, draft caption or None)
     """
-    # Wait up to 10 seconds for the image analysis result if it is not ready.
-    wait_time = 0
-    while uid not in analysis_results and wait_time < 10:
-        time.sleep(1)
-        wait_time += 1
+    with timed("analysis_wait"):
+        if not await wait_for_analysis(uid, ANALYSIS_TIMEOUT) and analysis_results.status(uid) == PENDING:
+            timeout("analysis_wait")
+
+    # Remove the entry after usage.
+    raw_description = analysis_results.pop(uid) or "No description available."
+
+    if fresh:
+        speculator.discard(uid)
+        return raw_description, None
+    draft = await speculator.claim(
+        uid, raw_description, location, tone, additional_context)
+    return raw_description, draft
+
+
+class TokenStream:
+    """
+    Async iterator over caption tokens that also collects the full text, so a
+    streaming template can render the tokens and then reuse the caption.
+    Once the tokens are exhausted, milliseconds holds the time since start
+    (a time.perf_counter() value).
+    """
+
+    def __init__(self, tokens: AsyncIterator[str], start: Optional[float] = None):
+        self._tokens = tokens
+        self._start = time.perf_counter() if start is None else start
+        self.text = ""
+        self.milliseconds = None
 
-    raw_description = analysis_results.get(uid, "No description available.")
-    # Optionally, remove the entry after usage.
-    analysis_results.pop(uid, None)
+    def __aiter__(self):
+        return self._iterate()
 
-    final_caption = generate_caption(
-        image_description=raw_description,
-        location=location,
-        tone=tone,
-        additional_context=additional_context
-    )
-    return templates.TemplateResponse("final.html", {"request": request, "caption": final_caption})
+    async def _iterate(self):
+        async for token in self._tokens:
+            self.text += token
+            yield token
+        self.milliseconds = round((time.perf_counter() - self._start) * 1000, 1)
+
+
+async def single_token(text: str) -> AsyncIterator[str]:
+    """
+    Yields an already-known caption as a one-token stream.
+    """
+    yield text
+
+
+def stream_template(name: str, context: dict) -> StreamingResponse:
+    """
+    Renders a template as a chunked response, sending each piece of output as
+    soon as it is produced (async iterables in the context are consumed lazily).
+    """
+    template = streaming_templates.get_template(name)
+    return StreamingResponse(template.generate_async(context), media_type="text/html")
+
+
+def detach_upload(file: UploadFile) -> UploadFile:
+    """
+    Takes ownership of an upload's spooled file so it can be read after the
+    request form is closed (for example from a streaming response body). The
+    caller must close the returned UploadFile.
+    """
+    detached = UploadFile(file.file, size=file.size,
+                          filename=file.filename, headers=file.headers)
+    file.file = io.BytesIO()
+    return detached
+
+
+def parse_batch_contexts(contexts: str, count: int) -> list:
+    """
+    Parses the optional per-image context JSON of a batch request.
+
+    Args:
+        contexts (str): A JSON list of objects with any of location, tone and
+            additional_context, aligned with the uploaded files. May be empty.
+        count (int): The number of uploaded files.
+
+    Returns:
+        list: One dict per file (empty where no per-image context was given).
+    """
+    if not contexts:
+        return [{}] * count
+    try:
+        parsed = json.loads(contexts)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="contexts must be valid JSON.")
+    if not isinstance(parsed, list) or len(parsed) > count or \
+            not all(isinstance(item, dict) for item in parsed):
+        raise HTTPException(
+            status_code=400, detail="contexts must be a JSON list of objects, at most one per file.")
+    return parsed + [{}] * (count - len(parsed))
+
+
+@app.post("/generate", response_model=GenerateResponse)
+async def generate(image: UploadFile = File(...), params: GenerateRequest = Depends(GenerateRequest.as_form)):
+    """
+    Describes and captions an image in one request, awaiting each stage in
+    turn (no background task, result store or polling), and returns JSON with
+    per-stage timings. Upstream failures are reported as 502, and requests
+    admission control refuses as 503.
+    """
+    start = time.perf_counter()
+    hf_limiter.check()
+    llm_limiter.check()
+    with timed("upload"):
+        data = await read_upload(image)
+    try:
+        description = await run_in_threadpool(describe_bytes, data)
+    except Overloaded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Image description failed: {e}")
+    del data
+
+    alternatives = []
+    try:
+        if CAPTION_CANDIDATES > 1:
+            candidates = await cached_caption_candidates(
+                description, params.location, params.tone, params.additional_context, fresh=params.fresh)
+            if not candidates:
+                raise ValueError("no usable candidates")
+            caption, *alternatives = candidates
+        else:
+            caption = await cached_caption(
+                description, params.location, params.tone, params.additional_context, fresh=params.fresh)
+    except Overloaded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Caption generation failed: {e}")
+
+    timings = {stage: seconds * 1000 for stage, seconds in request_timings().items()}
+    timings["total"] = (time.perf_counter() - start) * 1000
+    return GenerateResponse(description=description, caption=caption,
+                            alternatives=alternatives, timings_ms=timings)
+
+
+@app.post("/batch_captions")
+async def batch_captions(
+    files: List[UploadFile] = File(...),
+    location: str = Form(""),
+    tone: str = Form(""),
+    additional_context: str = Form(""),
+    contexts: str = Form("")
+):
+    """
+    Captions a set of images in one request.
+
+    location, tone and additional_context apply to every image unless the
+    image's entry in contexts (a JSON list aligned with files) overrides them.
+    Images flow through a two-stage pipeline (describe, then caption), each
+    stage with its own concurrency limit, and results are streamed back as
+    newline-delimited JSON in completion order, one line per image. If either
+    provider is overloaded the whole batch is refused with 503 up front;
+    refusals later in the batch are reported per image.
+    """
+    hf_limiter.check()
+    llm_limiter.check()
+    if len(files) > BATCH_MAX_IMAGES:
+        raise HTTPException(
+            status_code=413, detail=f"At most {BATCH_MAX_IMAGES} images per batch.")
+    per_image = parse_batch_contexts(contexts, len(files))
+    uploads = [detach_upload(file) for file in files]
+    describe_slots = asyncio.Semaphore(BATCH_DESCRIBE_CONCURRENCY)
+    caption_slots = asyncio.Semaphore(BATCH_CAPTION_CONCURRENCY)
+
+    async def run_one(index: int) -> dict:
+        upload = uploads[index]
+        result = {"index": index, "filename": upload.filename,
+                  "description": None, "caption": None, "error": None}
+        try:
+            async with describe_slots:
+                with timed("upload"):
+                    data = await read_upload(upload)
+                await upload.close()
+                result["description"] = await run_in_threadpool(describe_bytes, data)
+                del data
+            fields = {
+                "location": location,
+                "tone": tone,
+                "additional_context": additional_context,
+            }
+            # A JSON null means "not given", not the text "None".
+            fields.update({k: str(v) for k, v in per_image[index].items() if k in fields and v is not None})
+            async with caption_slots:
+                try:
+                    result["caption"] = await cached_caption(result["description"], **fields)
+                except Overloaded as e:
+                    result["error"] = str(e)
+                except Exception as e:
+                    result["error"] = f"Error generating caption: {e}"
+        except HTTPException as e:
+            result["error"] = e.detail
+        except Overloaded as e:
+            result["error"] = str(e)
+        except Exception as e:
+            result["error"] = f"Error processing image: {e}"
+        finally:
+            await upload.close()
+        return result
+
+    async def stream():
+        tasks = [asyncio.ensure_future(run_one(i)) for i in range(len(uploads))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # The client went away: stop the remaining work and release files.
+            for task in tasks:
+                task.cancel()
+            for upload in uploads:
+                await upload.close()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Serves stage latencies, error/timeout counters and gauges in the
+    Prometheus text format.
+    """
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/cache_stats")
+def cache_stats():
+    """
+    Returns hit/miss counters for the image description and caption caches,
+    the near-duplicate index and speculative caption drafts.
+    """
+    return {
+        "descriptions": description_cache.stats(),
+        "near_duplicates": near_duplicates.stats(),
+        "captions": caption_cache.stats(),
+        "speculation": speculator.stats(),
+    }
+
+
+@app.get("/backend_stats")
+def backend_stats():
+    """
+    Returns per-backend latency, failure and circuit breaker stats.
+    """
+    return router.stats()
+
+
+@app.get("/admission_stats")
+def admission_stats():
+    """
+    Returns queue lengths, remaining rate budgets and admission counters per
+    upstream provider.
+    """
+    return {"hf": hf_limiter.stats(), "llm": llm_limiter.stats()}
+
+
+@app.get("/queue_stats")
+def queue_stats():
+    """
+    Returns analysis job counts by status with JOB_QUEUE=1.
+    """
+    if analysis_jobs is None:
+        return {"enabled": False}
+    return dict(analysis_jobs.stats(), enabled=True)
+
+
+@app.get("/preprocess_stats")
+def preprocess_stats():
+    """
+    Returns how many bytes image preprocessing has saved on backend uploads.
+    """
+    return preprocessing_stats()
 
 
 @app.post("/feedback", response_class=HTMLResponse)
-def feedback_route(
+async def feedback_route(
+    request: Request,
+    final_caption: str = Form(...),
+    feedback: str = Form(...),
+    direction: str = Form(""),
+    chosen: str = Form(""),
+    accepted: bool = Form(False),
+    tone: str = Form(""),
+    location: str = Form(""),
+    caption_ms: Optional[float] = Form(None)
+):
+    """
+    Records user feedback in the feedback log and generates three alternative
+    caption prompts. The feedback is recorded even when admission control
+    refuses the alternatives.
+    """
+    record = feedback_record(final_caption, feedback, direction, chosen, accepted, tone, location, caption_ms)
+    try:
+        llm_limiter.check()
+        alt_prompts = await generate_alternative_prompts_async(
+            final_caption, feedback, direction)
+    except Overloaded:
+        log_feedback(record, [])
+        raise
+    log_feedback(record, alt_prompts)
+    return render_template("feedback_result.html", {"request": request, "alt_prompts": alt_prompts})
+
+
+@app.post("/feedback_stream", response_class=HTMLResponse)
+async def feedback_stream_route(
     request: Request,
     final_caption: str = Form(...),
     feedback: str = Form(...),
-    direction: str = Form("")
+    direction: str = Form(""),
+    chosen: str = Form(""),
+    accepted: bool = Form(False),
+    tone: str = Form(""),
+    location: str = Form(""),
+    caption_ms: Optional[float] = Form(None)
 ):
     """
-    Records user feedback and generates three alternative caption prompts.
+    Same as /feedback, but each alternative prompt is streamed into the page
+    as soon as the model has finished writing it. The feedback is recorded
+    once the stream ends, or straight away if the alternatives are refused.
+    """
+    record = feedback_record(final_caption, feedback, direction, chosen, accepted, tone, location, caption_ms)
+    try:
+        llm_limiter.check()
+    except Overloaded:
+        log_feedback(record, [])
+        raise
+    alt_prompts = logged_prompts(stream_alternative_prompts(
+        final_caption, feedback, direction), record)
+    return stream_template("feedback_result.html", {"request": request, "alt_prompts": alt_prompts})
+
+
+def feedback_record(final_caption: str, feedback: str, direction: str, chosen: str, accepted: bool,
+                    tone: str, location: str, caption_ms: Optional[float]) -> dict:
+    """
+    Builds a feedback log record; the alternatives and the feedback
+    request's own stage timings are added by log_feedback().
+    """
+    return {
+        "caption": final_caption,
+        "chosen": chosen or final_caption,
+        "accepted": accepted,
+        "feedback": feedback,
+        "direction": direction,
+        "tone": tone,
+        "location": location,
+        "timings_ms": {"caption": caption_ms},
+    }
+
+
+def log_feedback(record: dict, alternatives: List[str]):
+    """
+    Queues a feedback record for the background writer (never blocks).
+    """
+    record["alternatives"] = list(alternatives)
+    for stage, seconds in request_timings().items():
+        record["timings_ms"][stage] = round(seconds * 1000, 1)
+    feedback_log.append(record)
+
+
+async def logged_prompts(prompts: AsyncIterator[str], record: dict) -> AsyncIterator[str]:
+    """
+    Passes streamed alternative prompts through and logs the feedback record
+    with them once the stream ends (or the client goes away).
     """
-    alt_prompts = generate_alternative_prompts(
-        final_caption, feedback, direction)
-    return templates.TemplateResponse("feedback_result.html", {"request": request, "alt_prompts": alt_prompts})
+    alternatives = []
+    try:
+        async for prompt in prompts:
+            alternatives.append(prompt)
+            yield prompt
+    finally:
+        log_feedback(record, alternatives)
+
+
+@app.get("/feedback_log_stats")
+def feedback_log_stats():
+    """
+    Returns the feedback log's write, drop and batching counters for this
+    process.
+    """
+    return feedback_log.stats()
+
+
+if PRELOAD_MODELS:
+    warmup()
+    # Keep the garbage collector from writing to (and so un-sharing) the
+    # preloaded objects' pages in forked workers.
+    gc.freeze()
 
 
 if __name__ == "__main__":
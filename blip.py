@@ -1,13 +1,22 @@
-from transformers import BlipProcessor, BlipForConditionalGeneration
 from PIL import Image
-import torch
 import time
 
-# Load the processor and BLIP model for image captioning
-processor = BlipProcessor.from_pretrained(
-    "Salesforce/blip-image-captioning-large")
-model = BlipForConditionalGeneration.from_pretrained(
-    "Salesforce/blip-image-captioning-large")
+processor = None
+model = None
+
+
+def load_model():
+    """
+    Loads the processor and BLIP model for image captioning on first use.
+    """
+    global processor, model
+    if model is None:
+        from transformers import BlipProcessor, BlipForConditionalGeneration
+        processor = BlipProcessor.from_pretrained(
+            "Salesforce/blip-image-captioning-large")
+        model = BlipForConditionalGeneration.from_pretrained(
+            "Salesforce/blip-image-captioning-large")
+    return processor, model
 
 
 def describe_image(image_path, prompt="Describe the image in detail."):
@@ -21,6 +30,8 @@ def describe_image(image_path, prompt="Describe the image in detail."):
     Returns:
         str: A detailed description of the image.
     """
+    processor, model = load_model()
+
     # Open and convert the image to RGB format
     image = Image.open(image_path).convert('RGB')
 
@@ -0,0 +1,129 @@
+"""
+caption_cache.py
+
+Memoizes caption generation for identical inputs.
+
+Double-submits, back-button resubmits and popular scenes with no extra
+context all produce the same (description, location, tone, context) tuple.
+CaptionCache keeps finished captions in an LRU with a TTL, and coalesces
+identical requests that arrive while the first one is still in flight onto a
+single upstream call (single-flight).
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# CAPTION_CACHE_MAX_ENTRIES - captions kept in memory.
+# CAPTION_CACHE_TTL         - seconds before a cached caption expires.
+# ------------------------------------------------------------------------------
+CAPTION_CACHE_MAX_ENTRIES = int(os.getenv("CAPTION_CACHE_MAX_ENTRIES", "2048"))
+CAPTION_CACHE_TTL = float(os.getenv("CAPTION_CACHE_TTL", "3600"))
+
+
+class CaptionCache:
+    """
+    LRU/TTL cache with in-flight request coalescing. Must be used from a
+    single event loop.
+    """
+
+    def __init__(self, max_entries: int = CAPTION_CACHE_MAX_ENTRIES, ttl: float = CAPTION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (value, stored_at), least recently used first
+        self._entries = OrderedDict()
+        # key -> asyncio.Task for calls that have not finished yet
+        self._in_flight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_create(self, key: Hashable, factory: Callable[[], Awaitable[str]], fresh: bool = False) -> str:
+        """
+        Returns the cached value for key, joining an in-flight call for the
+        same key if there is one, and otherwise awaiting factory().
+
+        Args:
+            key (Hashable): The cache key.
+            factory (Callable): Zero-argument coroutine function producing the value.
+            fresh (bool): Skip the cache and in-flight calls and always call the
+                factory; the new value replaces the cached one.
+
+        Returns:
+            str: The value. Exceptions raised by the factory propagate to every
+            waiter and are not cached.
+        """
+        if not fresh:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if time.monotonic() - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            task = self._in_flight.get(key)
+            if task is not None:
+                self.coalesced += 1
+                # Shield so one waiter disconnecting does not cancel the call
+                # for everyone else.
+                return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.ensure_future(factory())
+        if not fresh:
+            self._in_flight[key] = task
+        # Store the result when the call finishes, even if this caller has gone.
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss/coalesced counters.
+        """
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "in_flight": len(self._in_flight),
+        }
+
+    def peek(self, key: Hashable):
+        """
+        Returns the cached value for key (counted as a hit), or None without
+        counting a miss. Does not join in-flight calls.
+        """
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: Hashable, value: str):
+        """
+        Stores a value produced outside get_or_create (e.g. speculatively).
+        """
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+
+# Shared instance used by caption_generator.
+caption_cache = CaptionCache()
@@ -1,18 +1,51 @@
 import os
-import openai
+from typing import AsyncIterator
 from dotenv import load_dotenv
+from admission import Overloaded
+from llm_client import llm_client
+from caption_cache import caption_cache
+from caption_ranking import clean_candidate, is_preamble, rank_captions
 
 load_dotenv()  # This will load the variables from the .env file
 
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
-# Set your OpenAI API key from the environment
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
+def openai_module():
+    """
+    Imports the openai SDK on first use (only the synchronous helpers below
+    need it; the app uses llm_client) and sets the API key from the environment.
+    """
+    import openai
+    openai.api_key = openai_api_key
+    return openai
 
-def generate_caption(image_description: str, location: str = "", tone: str = "", additional_context: str = "") -> str:
+CAPTION_PARAMS = dict(
+    model="gpt-3.5-turbo",
+    temperature=0.7,
+    max_tokens=25,
+    top_p=1.0,
+    frequency_penalty=0.0,
+    presence_penalty=0.0,
+)
+
+# Candidates requested per caption call; above 1, /generate_caption asks for
+# this many in one upstream call and shows the best one plus the others.
+CAPTION_CANDIDATES = int(os.getenv("CAPTION_CANDIDATES", "1"))
+
+ALTERNATIVE_PARAMS = dict(
+    model="gpt-3.5-turbo",
+    temperature=0.8,
+    max_tokens=150,
+    top_p=1.0,
+    frequency_penalty=0.0,
+    presence_penalty=0.0,
+)
+
+
+def caption_messages(image_description: str, location: str = "", tone: str = "", additional_context: str = "") -> list:
     """
-    Generate a short, modern, and succinct Instagram caption using OpenAI's gpt-3.5-turbo model.
+    Build the chat messages for a caption request.
     """
     prompt = (
         f"Create a modern and engaging Instagram caption based on the details below. "
@@ -27,7 +60,7 @@ def generate_caption(image_description: str, location: str = "", tone: str = "",
         prompt += f"Additional context: {additional_context}\n"
     prompt += "Caption:"
 
-    messages = [
+    return [
         {"role": "system", "content": (
             "You are an expert social media content creator who specializes in generating modern, "
             "succinct Instagram captions. Your captions are always brief (5-8 words), and they do not include emojis or hashtags."
@@ -35,25 +68,10 @@ def generate_caption(image_description: str, location: str = "", tone: str = "",
         {"role": "user", "content": prompt}
     ]
 
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=25,
-            top_p=1.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-        )
-        caption = response["choices"][0]["message"]["content"].strip()
-        return caption
-    except Exception as e:
-        return f"Error generating caption: {e}"
-
 
-def generate_alternative_prompts(final_caption: str, feedback: str, direction: str) -> list:
+def alternative_messages(final_caption: str, feedback: str, direction: str) -> list:
     """
-    Generate three alternative Instagram caption prompts based on the user's final caption, feedback, and direction.
+    Build the chat messages for an alternative prompts request.
     """
     prompt = (
         "You are an expert social media content creator who specializes in generating captions. "
@@ -63,28 +81,217 @@ def generate_alternative_prompts(final_caption: str, feedback: str, direction: s
         "Each prompt should be distinct and provide a new angle for the caption."
     )
 
-    messages = [
+    return [
         {"role": "system", "content": "You are a creative social media strategist."},
         {"role": "user", "content": prompt}
     ]
+
+
+def parse_alternatives(text: str) -> list:
+    """
+    Split the model's reply into one prompt per line, dropping list markers,
+    quotes, blank lines and preamble lines such as "Here are three prompts:".
+    """
+    prompts = []
+    for line in text.split("\n"):
+        if is_preamble(line):
+            continue
+        prompt = clean_candidate(line)
+        if prompt:
+            prompts.append(prompt)
+    return prompts
+
+
+def caption_key(image_description: str, location: str = "", tone: str = "", additional_context: str = "") -> tuple:
+    """
+    Build the caption cache key, ignoring surrounding whitespace and the case
+    of the short form fields.
+    """
+    return (
+        image_description.strip(),
+        location.strip().lower(),
+        tone.strip().lower(),
+        additional_context.strip(),
+    )
+
+
+def generate_caption(image_description: str, location: str = "", tone: str = "", additional_context: str = "") -> str:
+    """
+    Generate a short, modern, and succinct Instagram caption using OpenAI's gpt-3.5-turbo model.
+    """
+    messages = caption_messages(
+        image_description, location, tone, additional_context)
+
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0.8,
-            max_tokens=150,
-            top_p=1.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-        )
+        response = openai_module().ChatCompletion.create(
+            messages=messages, **CAPTION_PARAMS)
+        caption = response["choices"][0]["message"]["content"].strip()
+        return caption
+    except Exception as e:
+        return f"Error generating caption: {e}"
+
+
+async def generate_caption_async(image_description: str, location: str = "", tone: str = "", additional_context: str = "",
+                                 fresh: bool = False) -> str:
+    """
+    Async version of generate_caption that uses the pooled LLM client, so the
+    caller does not hold a threadpool worker for the duration of the call.
+    Identical inputs are answered from the caption cache, and identical
+    requests already in flight share one upstream call; pass fresh=True to
+    always ask the model for a new variant. Overloaded (admission control
+    refused the call) is raised rather than returned as the caption.
+    """
+    try:
+        return await cached_caption(image_description, location, tone, additional_context, fresh)
+    except Overloaded:
+        raise
+    except Exception as e:
+        return f"Error generating caption: {e}"
+
+
+async def cached_caption(image_description: str, location: str = "", tone: str = "", additional_context: str = "",
+                         fresh: bool = False) -> str:
+    """
+    Same as generate_caption_async, but raises on failure instead of
+    returning an error message as the caption.
+    """
+    key = caption_key(image_description, location, tone, additional_context)
+
+    async def request_caption() -> str:
+        return await fetch_caption(image_description, location, tone, additional_context)
+
+    return await caption_cache.get_or_create(key, request_caption, fresh=fresh)
+
+
+async def fetch_caption(image_description: str, location: str = "", tone: str = "", additional_context: str = "") -> str:
+    """
+    Ask the model for a caption, bypassing the caption cache. Raises on failure.
+    """
+    messages = caption_messages(
+        image_description, location, tone, additional_context)
+    response = await llm_client.chat_completion(messages, **CAPTION_PARAMS)
+    return response["choices"][0]["message"]["content"].strip()
+
+
+async def generate_caption_candidates_async(image_description: str, location: str = "", tone: str = "",
+                                            additional_context: str = "", n: int = CAPTION_CANDIDATES,
+                                            fresh: bool = False) -> list:
+    """
+    Ask for n candidate captions in a single upstream call (the API's n
+    parameter) and return them cleaned, deduplicated and reranked locally,
+    best first. Results are cached like single captions.
+    """
+    try:
+        candidates = await cached_caption_candidates(
+            image_description, location, tone, additional_context, n, fresh)
+    except Overloaded:
+        raise
+    except Exception as e:
+        return [f"Error generating caption: {e}"]
+    return candidates or ["Error generating caption: no usable candidates"]
+
+
+async def cached_caption_candidates(image_description: str, location: str = "", tone: str = "",
+                                    additional_context: str = "", n: int = CAPTION_CANDIDATES,
+                                    fresh: bool = False) -> list:
+    """
+    Same as generate_caption_candidates_async, but raises on failure and may
+    return an empty list if no candidate survived cleaning.
+    """
+    key = caption_key(image_description, location, tone, additional_context) + ("n-best", n)
+    messages = caption_messages(
+        image_description, location, tone, additional_context)
+
+    async def request_candidates() -> list:
+        response = await llm_client.chat_completion(messages, n=n, **CAPTION_PARAMS)
+        candidates = [choice["message"]["content"] for choice in response["choices"]]
+        return rank_captions(candidates)
+
+    return list(await caption_cache.get_or_create(key, request_candidates, fresh=fresh))
+
+
+async def stream_caption(image_description: str, location: str = "", tone: str = "", additional_context: str = "",
+                         fresh: bool = False) -> AsyncIterator[str]:
+    """
+    Streaming version of generate_caption_async: yields caption tokens as the
+    model produces them. A cached caption is yielded in one piece, and a
+    completed stream is stored in the caption cache.
+    """
+    key = caption_key(image_description, location, tone, additional_context)
+    if not fresh:
+        cached = caption_cache.peek(key)
+        if cached is not None:
+            yield cached
+            return
+
+    messages = caption_messages(
+        image_description, location, tone, additional_context)
+    tokens = []
+    try:
+        async for token in llm_client.stream_chat_completion(messages, **CAPTION_PARAMS):
+            # Drop leading whitespace the model often emits before the caption.
+            if not tokens:
+                token = token.lstrip()
+                if not token:
+                    continue
+            tokens.append(token)
+            yield token
+    except Exception as e:
+        yield f"Error generating caption: {e}"
+        return
+    caption_cache.put(key, "".join(tokens).strip())
+
+
+def generate_alternative_prompts(final_caption: str, feedback: str, direction: str) -> list:
+    """
+    Generate three alternative Instagram caption prompts based on the user's final caption, feedback, and direction.
+    """
+    messages = alternative_messages(final_caption, feedback, direction)
+    try:
+        response = openai_module().ChatCompletion.create(
+            messages=messages, **ALTERNATIVE_PARAMS)
         text = response["choices"][0]["message"]["content"].strip()
-        # Assume that the response contains three separate prompts (e.g., each on its own line)
-        prompts = [line.strip() for line in text.split("\n") if line.strip()]
-        return prompts
+        return rank_captions(parse_alternatives(text))
     except Exception as e:
         return [f"Error generating alternative prompts: {e}"]
 
 
+async def generate_alternative_prompts_async(final_caption: str, feedback: str, direction: str) -> list:
+    """
+    Async version of generate_alternative_prompts that uses the pooled LLM
+    client. Raises Overloaded if admission control refused the call.
+    """
+    messages = alternative_messages(final_caption, feedback, direction)
+    try:
+        response = await llm_client.chat_completion(messages, **ALTERNATIVE_PARAMS)
+        text = response["choices"][0]["message"]["content"].strip()
+        return rank_captions(parse_alternatives(text))
+    except Overloaded:
+        raise
+    except Exception as e:
+        return [f"Error generating alternative prompts: {e}"]
+
+
+async def stream_alternative_prompts(final_caption: str, feedback: str, direction: str) -> AsyncIterator[str]:
+    """
+    Streaming version of generate_alternative_prompts_async: yields each
+    prompt as soon as its line is complete, instead of after the whole reply.
+    """
+    messages = alternative_messages(final_caption, feedback, direction)
+    buffer = ""
+    try:
+        async for token in llm_client.stream_chat_completion(messages, **ALTERNATIVE_PARAMS):
+            buffer += token
+            *lines, buffer = buffer.split("\n")
+            for prompt in parse_alternatives("\n".join(lines)):
+                yield prompt
+    except Exception as e:
+        yield f"Error generating alternative prompts: {e}"
+        return
+    for prompt in parse_alternatives(buffer):
+        yield prompt
+
+
 if __name__ == "__main__":
     # Example usage
     image_desc = "a group of young men sitting on a rock in a park"
@@ -0,0 +1,111 @@
+"""
+caption_ranking.py
+
+Cleans and reranks candidate captions locally, using cheap signals:
+1) Length: captions should be 5-8 words.
+2) Style: no emojis and no hashtags.
+3) Dedup: candidates that only differ in case/punctuation count once.
+4) Diversity: among similar candidates, prefer ones that add new words.
+"""
+
+import re
+from typing import List, Optional
+
+MIN_WORDS = 5
+MAX_WORDS = 8
+
+# Weight of the similarity penalty when picking each next candidate.
+DIVERSITY_WEIGHT = 0.5
+
+EMOJI_RE = re.compile(
+    "[\U0001F000-\U0001FAFF\U00002600-\U000027BF\uFE0F\u200D]")
+HASHTAG_RE = re.compile(r"(?<!\w)#\w+")
+# List markers and labels models put in front of each option: "1.", "2)", "-",
+# "*", "Caption 2:", "Option 1 -". Each must be followed by whitespace, so a
+# caption that starts with a number ("2.5 miles of coastline") keeps it.
+PREFIX_RE = re.compile(
+    r"^\s*(?:[-*•]\s+|\d+[.)]\s+|(?:caption|option|prompt)\s*\d*\s*[:.)-]\s+)+", re.IGNORECASE)
+QUOTES = "\"'“”‘’`"
+
+
+def clean_candidate(text: str) -> str:
+    """
+    Strips list markers, labels, surrounding quotes and whitespace from one
+    candidate line.
+    """
+    text = PREFIX_RE.sub("", text.strip())
+    return text.strip().strip(QUOTES).strip()
+
+
+def is_preamble(line: str) -> bool:
+    """
+    Returns True for lines that introduce a list rather than being an option
+    (e.g. "Here are three new prompts:").
+    """
+    return line.rstrip().endswith(":")
+
+
+def quality_score(caption: str) -> float:
+    """
+    Scores a caption on the length and style constraints; 1.0 is perfect.
+    """
+    words = _words(caption)
+    if not words:
+        return 0.0
+    score = 1.0
+    if len(words) < MIN_WORDS:
+        score -= 0.15 * (MIN_WORDS - len(words))
+    elif len(words) > MAX_WORDS:
+        score -= 0.1 * (len(words) - MAX_WORDS)
+    if EMOJI_RE.search(caption):
+        score -= 0.5
+    if HASHTAG_RE.search(caption):
+        score -= 0.5
+    return score
+
+
+def rank_captions(candidates: List[str], k: Optional[int] = None,
+                  diversity: float = DIVERSITY_WEIGHT) -> List[str]:
+    """
+    Cleans, deduplicates and orders candidate captions, best first.
+
+    Args:
+        candidates (List[str]): Raw candidates from the model.
+        k (int): Keep at most this many (default: all unique candidates).
+        diversity (float): How strongly to penalize similarity to candidates
+            already picked.
+
+    Returns:
+        List[str]: The ranked captions.
+    """
+    unique = {}
+    for candidate in candidates:
+        caption = clean_candidate(candidate)
+        key = " ".join(_words(caption))
+        if key and key not in unique:
+            unique[key] = caption
+
+    pool = [(caption, quality_score(caption), set(_words(caption)))
+            for caption in unique.values()]
+    ranked = []
+    picked_words = []
+    while pool and (k is None or len(ranked) < k):
+        # Greedy maximal marginal relevance.
+        best = max(
+            range(len(pool)),
+            key=lambda i: pool[i][1] - diversity * max(
+                (_jaccard(pool[i][2], seen) for seen in picked_words), default=0.0))
+        caption, _, words = pool.pop(best)
+        ranked.append(caption)
+        picked_words.append(words)
+    return ranked
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9']+", HASHTAG_RE.sub("", text).lower())
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
@@ -0,0 +1,300 @@
+"""
+description_cache.py
+
+Content-addressed cache for image descriptions.
+
+Descriptions are keyed by the SHA-256 of the uploaded image bytes, so a repeat
+upload of the same photo skips the Hugging Face round trip entirely. There are
+two tiers:
+1) An in-process LRU dictionary (always on).
+2) An optional on-disk directory, bounded in total size and evicted oldest
+   first. It is enabled by setting DESCRIPTION_CACHE_DIR.
+Both tiers honour the same TTL.
+
+The disk tier can be shared by several worker processes. Files are named by
+key, so a key missing from this process's index is still looked up on disk
+(another worker may have written it). The index and its byte count are
+rebuilt from the directory at least every DESCRIPTION_CACHE_DISK_SCAN_INTERVAL
+seconds, so the size bound applies to the directory as a whole rather than to
+each process's own writes; between scans it can be exceeded by what the other
+workers wrote in the meantime.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# DESCRIPTION_CACHE_MAX_ENTRIES   - entries kept in memory.
+# DESCRIPTION_CACHE_DIR           - directory for the disk tier (unset = off).
+# DESCRIPTION_CACHE_DISK_MAX_BYTES - total size budget of the disk tier.
+# DESCRIPTION_CACHE_TTL           - seconds before an entry is considered stale.
+# DESCRIPTION_CACHE_DISK_SCAN_INTERVAL - longest time between re-reading the disk
+#                                   tier's real size from the directory (s).
+# ------------------------------------------------------------------------------
+CACHE_MAX_ENTRIES = int(os.getenv("DESCRIPTION_CACHE_MAX_ENTRIES", "1024"))
+CACHE_DIR = os.getenv("DESCRIPTION_CACHE_DIR")
+CACHE_DISK_MAX_BYTES = int(
+    os.getenv("DESCRIPTION_CACHE_DISK_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL = float(os.getenv("DESCRIPTION_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_DISK_SCAN_INTERVAL = float(os.getenv("DESCRIPTION_CACHE_DISK_SCAN_INTERVAL", "60"))
+
+
+def image_key(data: bytes) -> str:
+    """
+    Returns the cache key for a blob of image bytes.
+
+    Args:
+        data (bytes): The raw image bytes.
+
+    Returns:
+        str: The hex SHA-256 digest of the bytes.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class DescriptionCache:
+    """
+    Two-tier (memory + optional disk) LRU cache mapping image keys to descriptions.
+    Safe to use from the threadpool that runs background tasks.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, cache_dir: Optional[str] = CACHE_DIR,
+                 disk_max_bytes: int = CACHE_DISK_MAX_BYTES, ttl: float = CACHE_TTL,
+                 disk_scan_interval: float = CACHE_DISK_SCAN_INTERVAL):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl = ttl
+        self.disk_scan_interval = disk_scan_interval
+
+        self._lock = threading.Lock()
+        # key -> (description, stored_at)
+        self._memory = OrderedDict()
+        # key -> size in bytes, ordered from least to most recently used
+        self._disk_index = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_scanned_at = 0.0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.near_duplicate_hits = 0
+        self.misses = 0
+        self._inference_seconds = 0.0
+        self._inference_calls = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._scan_disk()
+
+    # --------------------------------------------------------------------------
+    # Public API
+    # --------------------------------------------------------------------------
+    def get(self, key: str, count_miss: bool = True) -> Optional[str]:
+        """
+        Looks up a description, checking memory first and then disk.
+
+        Args:
+            key (str): The image key from image_key().
+            count_miss (bool): Whether a miss is counted; pass False when the
+                caller may still find the description another way and will
+                call count_miss() itself if it does not.
+
+        Returns:
+            Optional[str]: The cached description, or None on a miss.
+        """
+        with self._lock:
+            description, tier = self._lookup(key)
+            if tier == "memory":
+                self.memory_hits += 1
+            elif tier == "disk":
+                self.disk_hits += 1
+            elif count_miss:
+                self.misses += 1
+            return description
+
+    def get_near_duplicate(self, key: str) -> Optional[str]:
+        """
+        Looks up the description of the upload a near-duplicate matched,
+        counting a hit as a near-duplicate hit and a miss not at all.
+        """
+        with self._lock:
+            description, _ = self._lookup(key)
+            if description is not None:
+                self.near_duplicate_hits += 1
+            return description
+
+    def count_miss(self):
+        """
+        Counts a miss for a lookup made with get(key, count_miss=False).
+        """
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key: str, description: str, inference_seconds: Optional[float] = None):
+        """
+        Stores a description in both tiers.
+
+        Args:
+            key (str): The image key from image_key().
+            description (str): The description returned by the model.
+            inference_seconds (float): Optional time the model call took, used to
+                estimate how much latency the cache saves.
+        """
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, description, now)
+            if self.cache_dir:
+                self._disk_put(key, description)
+            if inference_seconds is not None:
+                self._inference_seconds += inference_seconds
+                self._inference_calls += 1
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counters and an estimate of the inference time saved.
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits + self.near_duplicate_hits
+            lookups = hits + self.misses
+            avg_inference = (
+                self._inference_seconds / self._inference_calls
+                if self._inference_calls else 0.0
+            )
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "near_duplicate_hits": self.near_duplicate_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+                "avg_inference_seconds": avg_inference,
+                "inference_seconds_saved": hits * avg_inference,
+            }
+
+    def clear(self):
+        """
+        Drops every entry from both tiers and resets the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            for key in list(self._disk_index):
+                self._disk_remove(key)
+            self.memory_hits = self.disk_hits = self.near_duplicate_hits = self.misses = 0
+            self._inference_seconds = 0.0
+            self._inference_calls = 0
+
+    # --------------------------------------------------------------------------
+    # Both tiers (callers hold self._lock)
+    # --------------------------------------------------------------------------
+    def _lookup(self, key: str):
+        # Returns (description, "memory" | "disk"), or (None, None) on a miss.
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            description, stored_at = entry
+            if now - stored_at <= self.ttl:
+                self._memory.move_to_end(key)
+                return description, "memory"
+            del self._memory[key]
+
+        if self.cache_dir:
+            description, stored_at = self._disk_get(key, now)
+            if description is not None:
+                self._memory_put(key, description, stored_at)
+                return description, "disk"
+        return None, None
+
+    # --------------------------------------------------------------------------
+    # Memory tier (callers hold self._lock)
+    # --------------------------------------------------------------------------
+    def _memory_put(self, key: str, description: str, stored_at: float):
+        self._memory[key] = (description, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    # --------------------------------------------------------------------------
+    # Disk tier (callers hold self._lock)
+    # --------------------------------------------------------------------------
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def _scan_disk(self):
+        # Rebuilds the index from the directory, oldest first, picking up the
+        # files other workers wrote and dropping those they evicted.
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".txt"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, entry.name[:-4], st.st_size))
+        self._disk_index.clear()
+        self._disk_bytes = 0
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+        self._disk_scanned_at = time.monotonic()
+
+    def _disk_get(self, key: str, now: float):
+        # Not checked against the index: another worker may have written it.
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            if now - st.st_mtime > self.ttl:
+                self._disk_remove(key)
+                return None, 0.0
+            with open(path, "r", encoding="utf-8") as f:
+                description = f.read()
+        except OSError:
+            # Not on disk, or another worker evicted the file underneath us.
+            self._disk_forget(key)
+            return None, 0.0
+        if key not in self._disk_index:
+            self._disk_index[key] = st.st_size
+            self._disk_bytes += st.st_size
+        self._disk_index.move_to_end(key)
+        return description, st.st_mtime
+
+    def _disk_put(self, key: str, description: str):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        data = description.encode("utf-8")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        self._disk_forget(key)
+        self._disk_index[key] = len(data)
+        self._disk_bytes += len(data)
+        if time.monotonic() - self._disk_scanned_at >= self.disk_scan_interval:
+            self._scan_disk()
+        while self._disk_bytes > self.disk_max_bytes and self._disk_index:
+            oldest = next(iter(self._disk_index))
+            self._disk_remove(oldest)
+
+    def _disk_remove(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+        self._disk_forget(key)
+
+    def _disk_forget(self, key: str):
+        size = self._disk_index.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+
+# Shared instance used by the app.
+description_cache = DescriptionCache()
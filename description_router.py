@@ -0,0 +1,347 @@
+"""
+description_router.py
+
+Routes describe_image calls across several description backends to bound
+tail latency.
+
+For every call the router:
+1) Picks the healthy backend with the lowest EWMA latency as the primary
+   (backends without latency samples yet come after those with them, in
+   their configured order).
+2) If the primary has not answered within its p95 latency, sends a hedged
+   request to the next-best backend and returns whichever answers first.
+3) Falls through to the next backend immediately if a call fails.
+Each backend has a circuit breaker: after BREAKER_FAILURES consecutive
+failures it is taken out of rotation for BREAKER_COOLDOWN seconds, then let
+back in for a single trial call. Every result goes through the shared
+normalize_output.
+
+Backends that call a rate-limited API (hf) pass the shared admission limiter
+first, at the caller's priority. A call refused there is not a backend
+failure; if every backend refused, describe raises Overloaded.
+
+Backends are listed in DESCRIPTION_BACKENDS (comma-separated, in order of
+preference until latency data exists): "hf", "local" or "stub".
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Union
+
+from admission import Overloaded, ProviderLimiter, hf_limiter, retry_after_from
+from image_analysis import normalize_output
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# DESCRIPTION_BACKENDS  - comma-separated backend names, e.g. "hf,local".
+# HEDGE_DEFAULT_DELAY   - hedge delay (s) before a backend has latency samples.
+# HEDGE_MIN_DELAY       - lower bound on the hedge delay (s).
+# BREAKER_FAILURES      - consecutive failures that open a backend's breaker.
+# BREAKER_COOLDOWN      - seconds a tripped backend stays out of rotation.
+# STUB_LATENCY          - latency (s) of the "stub" backend.
+# ------------------------------------------------------------------------------
+DESCRIPTION_BACKENDS = os.getenv("DESCRIPTION_BACKENDS", "hf")
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "3.0"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.2"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+STUB_LATENCY = float(os.getenv("STUB_LATENCY", "0.05"))
+
+# Latency samples needed before p95 is trusted for the hedge delay.
+MIN_SAMPLES = 20
+
+
+class NoBackendAvailable(Exception):
+    """
+    Raised when every backend failed or is out of rotation.
+    """
+
+
+class Backend:
+    """
+    A description provider with latency tracking and a circuit breaker.
+
+    Args:
+        name (str): Name used in stats.
+        describe (Callable): Takes an image (path or bytes) and returns the
+            backend's raw output.
+        warmup (Callable): Optional; builds the backend's client or loads its
+            model ahead of the first call.
+        limiter (ProviderLimiter): Optional; admission limiter every call
+            must pass first.
+        ewma_alpha (float): Weight of the newest sample in the latency EWMA.
+        window (int): Number of recent latencies kept for the p95.
+    """
+
+    def __init__(self, name: str, describe: Callable, ewma_alpha: float = 0.2, window: int = 200,
+                 breaker_failures: int = BREAKER_FAILURES, breaker_cooldown: float = BREAKER_COOLDOWN,
+                 warmup: Optional[Callable] = None, limiter: Optional[ProviderLimiter] = None):
+        self.name = name
+        self.describe = describe
+        self.warmup = warmup
+        self.limiter = limiter
+        self.ewma_alpha = ewma_alpha
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.ewma = None
+        self.calls = 0
+        self.failures = 0
+        self.hedges_won = 0
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+
+    def available(self) -> bool:
+        """
+        Returns True if the breaker lets a call through. When the cooldown has
+        passed, exactly one trial call is let through (half-open).
+        """
+        with self._lock:
+            if self._consecutive_failures < self.breaker_failures:
+                return True
+            if time.monotonic() < self._open_until or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self._latencies.append(seconds)
+            self.ewma = seconds if self.ewma is None else (
+                self.ewma_alpha * seconds + (1 - self.ewma_alpha) * self.ewma)
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.calls += 1
+            self.failures += 1
+            self._consecutive_failures += 1
+            self._trial_in_flight = False
+            if self._consecutive_failures >= self.breaker_failures:
+                self._open_until = time.monotonic() + self.breaker_cooldown
+
+    def record_hedge_won(self):
+        """
+        Counts a call this backend answered first as the hedge or hedged request.
+        """
+        with self._lock:
+            self.hedges_won += 1
+
+    def release_trial(self):
+        """
+        Lets another trial call through after one that never reached the
+        backend (refused by its limiter).
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def p95(self) -> Optional[float]:
+        """
+        Returns the 95th percentile of recent latencies, or None with too few samples.
+        """
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def stats(self) -> dict:
+        p95 = self.p95()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "hedges_won": self.hedges_won,
+                "ewma_seconds": self.ewma,
+                "p95_seconds": p95,
+                "breaker_open": self._consecutive_failures >= self.breaker_failures,
+            }
+
+
+class DescriptionRouter:
+    """
+    Sends each describe call to the best backend, hedging and failing over
+    to the others. Blocking; meant to be called from the threadpool.
+    """
+
+    def __init__(self, backends: List[Backend], hedge_default_delay: float = HEDGE_DEFAULT_DELAY,
+                 hedge_min_delay: float = HEDGE_MIN_DELAY):
+        if not backends:
+            raise ValueError("DescriptionRouter needs at least one backend.")
+        self.backends = backends
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_delay = hedge_min_delay
+        self._lock = threading.Lock()
+        self.hedges = 0
+        # A call that lost a hedge keeps running (and holding its thread) until
+        # the backend returns, so the pool is sized generously.
+        self._executor = ThreadPoolExecutor(
+            max_workers=32 * len(backends), thread_name_prefix="describe")
+
+    def describe(self, image: Union[str, bytes]) -> str:
+        """
+        Describes an image using the fastest healthy backend(s).
+
+        Raises:
+            NoBackendAvailable: If every backend failed or is out of rotation.
+            Overloaded: If every backend tried was refused by its limiter.
+        """
+        candidates = self._ranked()
+        pending = {}
+        errors = []
+        refusals = []
+
+        def launch():
+            while candidates:
+                backend = candidates.pop(0)
+                if backend.available():
+                    # Run in a copy of this context so the call keeps the caller's priority.
+                    context = contextvars.copy_context()
+                    pending[self._executor.submit(context.run, self._call, backend, image)] = backend
+                    return True
+            return False
+
+        launch()
+        while pending:
+            primary = next(iter(pending.values()))
+            timeout = self._hedge_delay(primary) if candidates else None
+            done, _ = wait(list(pending), timeout=timeout,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                # Primary is slower than its p95: hedge with the next backend.
+                if launch():
+                    with self._lock:
+                        self.hedges += 1
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    text = future.result()
+                except Overloaded as e:
+                    refusals.append(e)
+                    errors.append(f"{backend.name}: {e}")
+                    continue
+                except Exception as e:
+                    errors.append(f"{backend.name}: {e}")
+                    continue
+                if pending:
+                    backend.record_hedge_won()
+                return text
+            # Everything that finished failed; fail over right away.
+            if not pending:
+                launch()
+
+        if refusals and len(refusals) == len(errors):
+            raise min(refusals, key=lambda e: e.retry_after)
+        raise NoBackendAvailable(
+            "All description backends failed: " + ("; ".join(errors) or "none available"))
+
+    def warmup(self):
+        """
+        Builds every backend's client or model now instead of on first use.
+        """
+        for backend in self.backends:
+            if backend.warmup is not None:
+                backend.warmup()
+
+    def stats(self) -> dict:
+        """
+        Returns per-backend latency/breaker stats and the number of hedges sent.
+        """
+        return {
+            "hedges": self.hedges,
+            "backends": {backend.name: backend.stats() for backend in self.backends},
+        }
+
+    def _ranked(self) -> List[Backend]:
+        # Fastest measured backends first; backends without samples yet (new or
+        # restarted) follow in their configured order, so they do not jump
+        # ahead of proven fast ones. They get samples from hedges and failover.
+        order = {backend: i for i, backend in enumerate(self.backends)}
+        return sorted(self.backends, key=lambda b: (b.ewma is None, b.ewma or 0.0, order[b]))
+
+    def _hedge_delay(self, backend: Backend) -> float:
+        p95 = backend.p95()
+        if p95 is None:
+            return self.hedge_default_delay
+        return max(p95, self.hedge_min_delay)
+
+    @staticmethod
+    def _call(backend: Backend, image) -> str:
+        if backend.limiter is not None:
+            try:
+                backend.limiter.acquire()
+            except Overloaded:
+                backend.release_trial()
+                raise
+        start = time.perf_counter()
+        try:
+            text = normalize_output(backend.describe(image))
+        except Exception as e:
+            backend.record_failure()
+            retry_after = retry_after_from(e)
+            if retry_after is not None and backend.limiter is not None:
+                backend.limiter.pause(retry_after)
+            raise
+        backend.record_success(time.perf_counter() - start)
+        return text
+
+
+def stub_describe(image: Union[str, bytes]) -> str:
+    """
+    Stand-in backend for testing and benchmarks: sleeps STUB_LATENCY seconds
+    and returns a fixed description.
+    """
+    time.sleep(STUB_LATENCY)
+    return "a photo of a scene"
+
+
+def build_backend(name: str) -> Backend:
+    """
+    Builds a backend by name. Heavy dependencies (huggingface_hub, torch,
+    transformers) are imported on the backend's first call or warmup.
+    """
+    if name == "hf":
+        from image_analysis import describe_image, get_client
+        return Backend(name, describe_image, warmup=get_client, limiter=hf_limiter)
+    if name == "local":
+        from local_blip import describe_image, load_model
+        return Backend(name, describe_image, warmup=load_model)
+    if name == "stub":
+        return Backend(name, stub_describe)
+    raise ValueError(f"Unknown description backend: {name!r}")
+
+
+def build_router(names: str = DESCRIPTION_BACKENDS) -> DescriptionRouter:
+    """
+    Builds a router from a comma-separated list of backend names.
+    """
+    return DescriptionRouter([build_backend(name.strip()) for name in names.split(",") if name.strip()])
+
+
+# Shared router used by the app.
+router = build_router()
+
+
+def describe_image(image: Union[str, bytes], prompt: str = "Describe the image in detail.") -> str:
+    """
+    Describes an image through the shared router. Same interface as
+    image_analysis.describe_image.
+
+    Args:
+        image (str | bytes): The path to the image file, or the raw image bytes.
+        prompt (str): Unused; kept for interface compatibility.
+
+    Returns:
+        str: A detailed description of the image.
+    """
+    return router.describe(image)
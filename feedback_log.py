@@ -0,0 +1,328 @@
+"""
+feedback_log.py
+
+Append-only log of caption feedback (caption, feedback, direction, chosen
+option, tone, timings, ...), for offline analysis with feedback_stats.py.
+
+Recording never touches the disk on the request path: append() puts the
+record on an in-memory queue and returns (a deque append: under a microsecond
+while the writer is idle, a few while it is encoding a batch and holding the
+GIL). A background writer thread takes everything queued, encodes it
+as JSON lines and writes it with a single write() call (group commit). It
+does this as soon as FEEDBACK_FLUSH_RECORDS records are waiting, or after
+FEEDBACK_FLUSH_INTERVAL seconds otherwise. With FEEDBACK_FSYNC=1 each group
+is also fsynced, so one sync covers the whole batch.
+
+Records go to segment files in FEEDBACK_LOG_DIR named
+feedback-<start time>-<pid>-<n>.jsonl. Each process writes its own segments,
+so uvicorn/gunicorn workers never interleave lines. A new segment is started
+once the current one reaches FEEDBACK_SEGMENT_BYTES. If the writer falls
+FEEDBACK_MAX_PENDING records behind, new records are dropped and counted
+rather than blocking requests or growing memory without bound.
+
+Usage:
+    python feedback_log.py bench [--records 1000000] [--dir /tmp/feedback_bench]
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import Counter, registry
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# FEEDBACK_LOG              - set to 0 to stop recording feedback.
+# FEEDBACK_LOG_DIR          - directory of the log segments.
+# FEEDBACK_FLUSH_RECORDS    - queued records that trigger a write right away.
+# FEEDBACK_FLUSH_INTERVAL   - longest a record waits before it is written (s).
+# FEEDBACK_SEGMENT_BYTES    - segment size at which a new segment is started.
+# FEEDBACK_MAX_PENDING      - queued records beyond which new ones are dropped.
+# FEEDBACK_FSYNC            - set to 1 to fsync after every group write.
+# ------------------------------------------------------------------------------
+FEEDBACK_LOG = os.getenv("FEEDBACK_LOG", "1") != "0"
+FEEDBACK_LOG_DIR = os.getenv("FEEDBACK_LOG_DIR", "feedback_log")
+FEEDBACK_FLUSH_RECORDS = int(os.getenv("FEEDBACK_FLUSH_RECORDS", "256"))
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "1.0"))
+FEEDBACK_SEGMENT_BYTES = int(os.getenv("FEEDBACK_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+FEEDBACK_MAX_PENDING = int(os.getenv("FEEDBACK_MAX_PENDING", "100000"))
+FEEDBACK_FSYNC = os.getenv("FEEDBACK_FSYNC", "0") == "1"
+
+# Most records encoded and written in one write() call.
+WRITE_BATCH_RECORDS = 8192
+
+# One shared encoder: json.dumps with non-default options builds a new one per call.
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+SEGMENT_PREFIX = "feedback-"
+SEGMENT_SUFFIX = ".jsonl"
+
+records_written = registry.register(Counter(
+    "caption_feedback_records_total", "Feedback records written to the log."))
+records_dropped = registry.register(Counter(
+    "caption_feedback_dropped_total", "Feedback records dropped because the writer fell behind."))
+
+logger = logging.getLogger(__name__)
+
+
+class FeedbackLog:
+    """
+    Batches records in memory and appends them to rotating JSON-lines
+    segments from a background thread.
+
+    Args:
+        directory (str): Where segments are written.
+        flush_records (int): Queued records that wake the writer at once.
+        flush_interval (float): Longest a record waits to be written (s).
+        segment_bytes (int): Segment size that triggers rotation.
+        max_pending (int): Queue bound; records beyond it are dropped.
+        fsync (bool): Whether to fsync after every group write.
+        enabled (bool): If False, append() does nothing.
+    """
+
+    def __init__(self, directory: str = FEEDBACK_LOG_DIR, flush_records: int = FEEDBACK_FLUSH_RECORDS,
+                 flush_interval: float = FEEDBACK_FLUSH_INTERVAL, segment_bytes: int = FEEDBACK_SEGMENT_BYTES,
+                 max_pending: int = FEEDBACK_MAX_PENDING, fsync: bool = FEEDBACK_FSYNC,
+                 enabled: bool = FEEDBACK_LOG):
+        self.directory = directory
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.enabled = enabled
+
+        # deque.append/popleft are atomic, so the request path takes no lock.
+        self._pending = deque()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._writer = None
+        self._pid = None
+        self._closing = False
+        self._file = None
+        self._segment_size = 0
+        self._segment_count = 0
+
+        self.written = 0
+        self.flushes = 0
+        self.bytes_written = 0
+        self.segments = 0
+
+    def append(self, record: dict):
+        """
+        Queues a record for the writer. Never blocks and never raises; a
+        record that does not fit in the queue is dropped and counted. A
+        "ts" field is added if missing.
+        """
+        if not self.enabled:
+            return
+        if len(self._pending) >= self.max_pending:
+            # Counted under the counter's lock: drops happen on many request
+            # threads at once.
+            records_dropped.inc()
+            return
+        record.setdefault("ts", time.time())
+        self._pending.append(record)
+        if self._writer is None or self._pid != os.getpid():
+            self._start()
+        if len(self._pending) >= self.flush_records:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Writes everything queued so far, from the calling thread.
+        """
+        with self._lock:
+            self._write_pending()
+
+    def close(self):
+        """
+        Stops the writer after it has written everything queued, and closes
+        the current segment. Later appends start a new writer.
+        """
+        writer = self._writer
+        if writer is not None and self._pid == os.getpid():
+            self._closing = True
+            self._wake.set()
+            writer.join()
+            self._closing = False
+        self._writer = None
+        with self._lock:
+            self._write_pending()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> dict:
+        """
+        Returns write, drop and batching counters. "dropped" is the process's
+        caption_feedback_dropped_total.
+        """
+        return {
+            "pending": len(self._pending),
+            "written": self.written,
+            "dropped": int(records_dropped.value()),
+            "flushes": self.flushes,
+            "records_per_flush": self.written / self.flushes if self.flushes else 0.0,
+            "bytes_written": self.bytes_written,
+            "segments": self.segments,
+        }
+
+    def _start(self):
+        with self._lock:
+            if self._writer is not None and self._pid == os.getpid():
+                return
+            # After a fork the parent's writer thread and open segment are not
+            # ours: start a fresh thread and segment in this process.
+            self._pid = os.getpid()
+            self._file = None
+            self._writer = threading.Thread(target=self._run, name="feedback-log", daemon=True)
+            self._writer.start()
+
+    def _run(self):
+        while not self._closing:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                with self._lock:
+                    self._write_pending()
+            except OSError as e:
+                # Keep the records queued and try again on the next round.
+                logger.warning("Feedback log write failed: %s", e)
+
+    def _write_pending(self):
+        # Takes the queued records and appends them in as few writes as
+        # possible, at most WRITE_BATCH_RECORDS per write to bound memory.
+        while self._pending:
+            popleft = self._pending.popleft
+            records = [popleft() for _ in range(min(len(self._pending), WRITE_BATCH_RECORDS))]
+            data = "".join([_encode(record) + "\n" for record in records]).encode("utf-8")
+            try:
+                segment = self._segment()
+                segment.write(data)
+                if self.fsync:
+                    os.fsync(segment.fileno())
+            except OSError:
+                self._pending.extendleft(reversed(records))
+                raise
+            self._segment_size += len(data)
+            self.written += len(records)
+            self.flushes += 1
+            self.bytes_written += len(data)
+            records_written.inc(amount=len(records))
+
+    def _segment(self):
+        if self._file is not None and self._segment_size >= self.segment_bytes:
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._segment_count += 1
+            name = (f"{SEGMENT_PREFIX}{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+                    f"-{self._segment_count:04d}{SEGMENT_SUFFIX}")
+            self._file = open(os.path.join(self.directory, name), "ab", buffering=0)
+            self._segment_size = 0
+            self.segments += 1
+        return self._file
+
+
+def segment_paths(directory: str = FEEDBACK_LOG_DIR) -> list:
+    """
+    Returns the paths of every segment in directory, oldest first.
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, name) for name in names
+                  if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+
+def synthetic_record(i: int) -> dict:
+    """
+    Returns a plausible feedback record for benchmarks.
+    """
+    tones = ["", "playful", "chill", "funny", "romantic", "bold"]
+    tone = tones[i % len(tones)]
+    return {
+        "caption": "Golden hour with the best crew",
+        "chosen": "Golden hour with the best crew" if i % 3 else "Sunset chases and sandy paws",
+        "accepted": (i * 7919) % 100 < 40 + 5 * (i % len(tones)),
+        "feedback": "Too plain." if i % 2 else "",
+        "direction": "Make it more energetic" if i % 4 == 0 else "",
+        "tone": tone,
+        "location": "Paris" if i % 5 == 0 else "",
+        "alternatives": ["Chasing light with my favorite people", "Sun-kissed and carefree"],
+        "timings_ms": {"caption": 300.0 + i % 500, "llm": 420.0 + i % 300},
+    }
+
+
+def benchmark(records: int = 1_000_000, directory: str = "/tmp/feedback_bench") -> dict:
+    """
+    Measures the feedback log with synthetic records:
+    - append_ns: cost of append() on the request path while the writer is idle.
+    - writer_records_per_sec: how fast the writer drains a backlog.
+    - append_ns_under_load and ingest_records_per_sec: appending as fast as
+      possible while the writer runs with the default flush settings.
+    """
+    for path in segment_paths(directory):
+        os.remove(path)
+    batch = [synthetic_record(i) for i in range(records)]
+
+    # Request-path cost, with the writer held back until close().
+    log = FeedbackLog(directory, flush_records=records + 1, flush_interval=3600,
+                      max_pending=records + 1, enabled=True)
+    start = time.perf_counter()
+    for record in batch:
+        log.append(record)
+    append = time.perf_counter() - start
+    start = time.perf_counter()
+    log.close()
+    drain = time.perf_counter() - start
+
+    # Sustained ingest, appending and writing at the same time.
+    batch = [synthetic_record(i) for i in range(records)]
+    log = FeedbackLog(directory, max_pending=records + 1, enabled=True)
+    start = time.perf_counter()
+    for record in batch:
+        log.append(record)
+    append_under_load = time.perf_counter() - start
+    log.close()
+    total = time.perf_counter() - start
+    stats = log.stats()
+    return {
+        "records": records,
+        "append_ns": append / records * 1e9,
+        "writer_records_per_sec": records / drain,
+        "append_ns_under_load": append_under_load / records * 1e9,
+        "ingest_records_per_sec": records / total,
+        "ingest_mb_per_sec": stats["bytes_written"] / total / 1e6,
+        "records_per_flush": stats["records_per_flush"],
+        "segments": stats["segments"],
+    }
+
+
+# Shared log used by the app.
+feedback_log = FeedbackLog()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the feedback log.")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--dir", default="/tmp/feedback_bench")
+    args = parser.parse_args()
+
+    result = benchmark(args.records, args.dir)
+    print(f"{result['records']:,} records")
+    print(f"  append (request path, writer idle): {result['append_ns']:.0f} ns")
+    print(f"  writer draining a backlog:          {result['writer_records_per_sec']:,.0f} records/sec")
+    print(f"  append while the writer runs:       {result['append_ns_under_load']:.0f} ns")
+    print(f"  sustained ingest:                   {result['ingest_records_per_sec']:,.0f} records/sec "
+          f"({result['ingest_mb_per_sec']:.0f} MB/s, {result['records_per_flush']:.0f} records per write, "
+          f"{result['segments']} segments per run)")
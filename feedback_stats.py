@@ -0,0 +1,202 @@
+"""
+feedback_stats.py
+
+Offline aggregation of the feedback log (feedback_log.py), e.g. acceptance
+rate per tone.
+
+The segments are split into byte ranges of about CHUNK_BYTES (aligned to line
+boundaries), and the ranges are aggregated in parallel across processes, so
+one large segment is spread over every core as well. Each process returns
+small per-group partial counts that are merged at the end. A truncated last
+line (a segment still being written, or cut off by a crash) is counted as
+malformed and skipped. Lines are parsed with orjson when it is installed
+(about twice as fast as json), otherwise with json.
+
+For each group it reports the records, the acceptance rate, how often an
+alternative was chosen over the first caption, how often written feedback
+was left, and the mean caption latency.
+
+Usage:
+    python feedback_stats.py [feedback_log] --by tone
+    python feedback_stats.py feedback_log --by tone,location --since 7 --json
+"""
+
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+
+from feedback_log import FEEDBACK_LOG_DIR, segment_paths
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+# Bytes of log aggregated per task.
+CHUNK_BYTES = 16 * 1024 * 1024
+
+# Per-group partial counts: records, accepted, chose an alternative, left
+# feedback, caption latency samples, caption latency sum (ms).
+FIELDS = 6
+
+
+def chunks(paths: List[str], chunk_bytes: int = CHUNK_BYTES) -> List[Tuple[str, int, int]]:
+    """
+    Splits segments into (path, start, end) byte ranges.
+    """
+    ranges = []
+    for path in paths:
+        size = os.path.getsize(path)
+        for start in range(0, size, chunk_bytes):
+            ranges.append((path, start, min(start + chunk_bytes, size)))
+    return ranges
+
+
+def group_value(record: dict, field: str) -> str:
+    value = record.get(field)
+    if isinstance(value, str):
+        value = value.strip().lower()
+    return str(value) if value not in (None, "") else "(none)"
+
+
+def aggregate_chunk(task: Tuple[str, int, int, Tuple[str, ...], Optional[float]]) -> Tuple[Dict[tuple, list], int]:
+    """
+    Aggregates the lines that start inside one byte range.
+
+    Returns:
+        tuple: ({group key: partial counts}, malformed lines)
+    """
+    path, start, end, by, since = task
+    groups = {}
+    malformed = 0
+    with open(path, "rb") as f:
+        if start:
+            # Skip the rest of a line that began before start: it belongs to
+            # the previous range. A line starting exactly at start is ours.
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        for line in f:
+            if position >= end:
+                break
+            position += len(line)
+            try:
+                record = loads(line)
+            except ValueError:
+                malformed += 1
+                continue
+            if since is not None and record.get("ts", 0) < since:
+                continue
+            key = tuple(group_value(record, field) for field in by)
+            counts = groups.get(key)
+            if counts is None:
+                counts = groups[key] = [0] * FIELDS
+            counts[0] += 1
+            if record.get("accepted"):
+                counts[1] += 1
+            chosen = record.get("chosen")
+            if chosen and chosen != record.get("caption"):
+                counts[2] += 1
+            if record.get("feedback"):
+                counts[3] += 1
+            caption_ms = (record.get("timings_ms") or {}).get("caption")
+            if caption_ms is not None:
+                counts[4] += 1
+                counts[5] += caption_ms
+    return groups, malformed
+
+
+def aggregate(directory: str = FEEDBACK_LOG_DIR, by: Tuple[str, ...] = ("tone",), since: Optional[float] = None,
+              processes: Optional[int] = None) -> dict:
+    """
+    Aggregates every segment in directory.
+
+    Args:
+        directory (str): The feedback log directory.
+        by (Tuple[str, ...]): Record fields to group by.
+        since (float): Only count records with ts >= since (epoch seconds).
+        processes (int): Worker processes (default: one per CPU).
+
+    Returns:
+        dict: {"groups": [per-group rows, most records first], "records": ...,
+        "malformed": ..., "bytes": ...}
+    """
+    paths = segment_paths(directory)
+    tasks = [(path, start, end, tuple(by), since) for path, start, end in chunks(paths)]
+    merged = {}
+    malformed = 0
+    if len(tasks) > 1 and processes != 1:
+        with Pool(processes) as pool:
+            results = pool.imap_unordered(aggregate_chunk, tasks)
+            merged, malformed = _merge(results)
+    else:
+        merged, malformed = _merge(map(aggregate_chunk, tasks))
+
+    rows = []
+    for key, (records, accepted, alternative, feedback, timed, caption_ms) in merged.items():
+        rows.append(dict(
+            zip(by, key),
+            records=records,
+            acceptance_rate=accepted / records,
+            alternative_rate=alternative / records,
+            feedback_rate=feedback / records,
+            mean_caption_ms=caption_ms / timed if timed else None,
+        ))
+    rows.sort(key=lambda row: -row["records"])
+    return {
+        "groups": rows,
+        "records": sum(row["records"] for row in rows),
+        "malformed": malformed,
+        "bytes": sum(os.path.getsize(path) for path in paths),
+    }
+
+
+def _merge(results) -> Tuple[Dict[tuple, list], int]:
+    merged = {}
+    malformed = 0
+    for groups, bad in results:
+        malformed += bad
+        for key, counts in groups.items():
+            total = merged.get(key)
+            if total is None:
+                merged[key] = counts
+            else:
+                for i in range(FIELDS):
+                    total[i] += counts[i]
+    return merged, malformed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate the feedback log.")
+    parser.add_argument("directory", nargs="?", default=FEEDBACK_LOG_DIR)
+    parser.add_argument("--by", default="tone", help="comma-separated record fields to group by")
+    parser.add_argument("--since", type=float, help="only records from the last N days")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    by = tuple(field.strip() for field in args.by.split(",") if field.strip())
+    since = time.time() - args.since * 86400 if args.since is not None else None
+    start = time.perf_counter()
+    result = aggregate(args.directory, by, since, args.processes)
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps(dict(result, seconds=elapsed), indent=2))
+        return
+    header = " / ".join(by)
+    print(f"{header:>24}  {'records':>10}  {'accepted':>8}  {'alt':>6}  {'feedback':>8}  {'caption ms':>10}")
+    for row in result["groups"]:
+        label = " / ".join(row[field] for field in by)
+        mean = f"{row['mean_caption_ms']:.0f}" if row["mean_caption_ms"] is not None else "n/a"
+        print(f"{label[:24]:>24}  {row['records']:>10,}  {row['acceptance_rate']:>8.1%}  "
+              f"{row['alternative_rate']:>6.1%}  {row['feedback_rate']:>8.1%}  {mean:>10}")
+    print(f"{result['records']:,} records ({result['bytes'] / 1e6:.0f} MB, {result['malformed']} malformed) "
+          f"in {elapsed:.2f}s: {result['records'] / elapsed:,.0f} records/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+"""
+gunicorn_conf.py
+
+Preload mode: the gunicorn master imports the app once (loading the model
+weights when PRELOAD_MODELS=1) and forks uvicorn workers that share those
+pages copy-on-write, instead of every worker loading its own copy.
+
+Usage:
+    PRELOAD_MODELS=1 gunicorn -c gunicorn_conf.py app:app
+
+Requires the optional gunicorn package.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
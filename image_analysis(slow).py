@@ -5,32 +5,45 @@ Uses the BLIP model from Salesforce to generate a detailed description of an ima
 Optimized for speed while maintaining comprehensive output.
 """
 
-import torch
 from PIL import Image
-from transformers import BlipProcessor, BlipForConditionalGeneration
 import time
 
 # ------------------------------------------------------------------------------
 # Global setup for speed:
-# 1. Load the BLIP model and processor once.
+# 1. Import torch/transformers and load the BLIP model and processor once, on
+#    first use.
 # 2. Use GPU if available and convert model to half precision.
 # ------------------------------------------------------------------------------
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+device = None
 
-processor = BlipProcessor.from_pretrained(
-    "Salesforce/blip-image-captioning-large")
-model = BlipForConditionalGeneration.from_pretrained(
-    "Salesforce/blip-image-captioning-large")
-model.to(device)
+processor = None
+model = None
 
-# Convert to half precision if using GPU for faster inference.
-if device.type == "cuda":
-    model.half()
 
-model.eval()
+def load_model():
+    """
+    Loads the BLIP processor and model once and returns them.
+    """
+    global processor, model, device
+    if model is None:
+        import torch
+        from transformers import BlipProcessor, BlipForConditionalGeneration
+
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        processor = BlipProcessor.from_pretrained(
+            "Salesforce/blip-image-captioning-large")
+        model = BlipForConditionalGeneration.from_pretrained(
+            "Salesforce/blip-image-captioning-large")
+        model.to(device)
+
+        # Convert to half precision if using GPU for faster inference.
+        if device.type == "cuda":
+            model.half()
+
+        model.eval()
+    return processor, model
 
 
-@torch.no_grad()
 def describe_image(image_path: str, prompt: str = "Describe the image in detail.") -> str:
     """
     Generates a detailed description of the image using the BLIP model.
@@ -42,6 +55,10 @@ def describe_image(image_path: str, prompt: str = "Describe the image in detail.
     Returns:
         str: A detailed description of the image.
     """
+    import torch
+
+    processor, model = load_model()
+
     # Open, convert to RGB, and resize the image to speed up processing.
     image = Image.open(image_path).convert('RGB')
     # Resize to a typical resolution for captioning.
@@ -51,7 +68,8 @@ def describe_image(image_path: str, prompt: str = "Describe the image in detail.
     inputs = processor(image, prompt, return_tensors="pt").to(device)
 
     # Generate the description using fewer beams and a shorter max_length to reduce runtime.
-    output_ids = model.generate(**inputs, max_length=80, num_beams=4)
+    with torch.no_grad():
+        output_ids = model.generate(**inputs, max_length=80, num_beams=4)
     description = processor.decode(output_ids[0], skip_special_tokens=True)
     print(description)
 
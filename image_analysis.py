@@ -6,33 +6,49 @@ Maintains the same function signature and example usage as before.
 """
 
 import os
+import threading
 import time
-from huggingface_hub import InferenceClient
-from huggingface_hub.inference._generated.types.image_to_text import ImageToTextOutput
+from typing import Union
 
 # ------------------------------------------------------------------------------
 # Global setup:
-# 1. Instantiate the HF Inference client once using your HF token.
+# 1. Instantiate the HF Inference client once using your HF token, on first
+#    use (huggingface_hub takes a noticeable part of a second to import).
+# 2. HF_MODEL is a Hub model id, or the URL of an endpoint serving the same
+#    API (e.g. provider_stubs.py for load tests).
 # ------------------------------------------------------------------------------
 HF_TOKEN = os.getenv("HF_TOKEN")
-client = InferenceClient(token=HF_TOKEN)
+HF_MODEL = os.getenv("HF_MODEL", "Salesforce/blip-image-captioning-large")
 
+_client_lock = threading.Lock()
+_client = None
 
-def describe_image(image_path: str, prompt: str = "Describe the image in detail.") -> str:
+
+def get_client():
     """
-    Sends an image to HF’s Inference API and returns a clean description string.
+    Returns the shared InferenceClient, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from huggingface_hub import InferenceClient
+                _client = InferenceClient(token=HF_TOKEN)
+    return _client
+
+
+def normalize_output(output) -> str:
+    """
+    Normalizes whatever an image-to-text backend returns into a clean string.
 
     Args:
-        image_path (str): The path to the image file.
-        prompt (str): An optional prompt to guide the captioning (currently ignored by the API).
+        output: A str, a list of str/output objects, or an ImageToTextOutput.
+            Output objects are recognised by their attributes, so this does
+            not import huggingface_hub.
 
     Returns:
-        str: A detailed description of the image.
+        str: The generated description, stripped of surrounding whitespace.
     """
-    # Call the HF image-to-text endpoint
-    output = client.image_to_text(
-        image=image_path, model="Salesforce/blip-image-captioning-large")
-
     # Normalize whatever type comes back into a single string
     if isinstance(output, str):
         text = output
@@ -48,18 +64,36 @@ def describe_image(image_path: str, prompt: str = "Describe the image in detail.
         else:
             text = str(first)
 
-    elif isinstance(output, ImageToTextOutput):
-        # Prefer .generated_text, fallback to .image_to_text_output_generated_text
+    elif hasattr(output, "generated_text"):
+        # ImageToTextOutput: prefer .generated_text, fallback to
+        # .image_to_text_output_generated_text
         text = (
             output.generated_text
             if output.generated_text is not None
-            else output.image_to_text_output_generated_text or ""
+            else getattr(output, "image_to_text_output_generated_text", None) or ""
         )
 
     else:
         text = str(output)
 
-    return text.strip()
+    return (text or "").strip()
+
+
+def describe_image(image: Union[str, bytes], prompt: str = "Describe the image in detail.") -> str:
+    """
+    Sends an image to HF’s Inference API and returns a clean description string.
+
+    Args:
+        image (str | bytes): The path to the image file, or the raw image bytes.
+        prompt (str): An optional prompt to guide the captioning (currently ignored by the API).
+
+    Returns:
+        str: A detailed description of the image.
+    """
+    # Call the HF image-to-text endpoint
+    output = get_client().image_to_text(image=image, model=HF_MODEL)
+
+    return normalize_output(output)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+"""
+image_preprocessing.py
+
+Shrinks images before they are sent to the captioning backend.
+
+BLIP only looks at roughly 384x384 pixels, so uploading a multi-megabyte
+phone photo wastes bandwidth and backend time. This stage:
+1) Decodes JPEGs in draft mode (the decoder downsamples by 1/2, 1/4 or 1/8
+   while decoding, which is much cheaper than a full decode plus resize).
+2) Applies the EXIF orientation so rotated phone photos are described upright.
+3) Resizes so the longest side is at most IMAGE_MAX_SIDE pixels.
+4) Re-encodes as JPEG at IMAGE_JPEG_QUALITY.
+If the result is not smaller than the original, the original bytes are kept.
+"""
+
+import io
+import os
+import threading
+from typing import Tuple
+
+from PIL import Image, ImageOps
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# IMAGE_PREPROCESS    - set to 0 to send original uploads untouched.
+# IMAGE_MAX_SIDE      - longest side after resizing, in pixels.
+# IMAGE_JPEG_QUALITY  - JPEG quality used for the re-encode (1-95).
+# ------------------------------------------------------------------------------
+PREPROCESS_ENABLED = os.getenv("IMAGE_PREPROCESS", "1") != "0"
+MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "768"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+# Running totals across all calls, reported by preprocessing_stats().
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "resized": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def preprocess_image(data: bytes, max_side: int = MAX_SIDE, quality: int = JPEG_QUALITY) -> Tuple[bytes, dict]:
+    """
+    Downscales and re-encodes an image for the captioning backend.
+
+    Args:
+        data (bytes): The original image bytes.
+        max_side (int): Longest side of the output image, in pixels.
+        quality (int): JPEG quality of the re-encode.
+
+    Returns:
+        Tuple[bytes, dict]: The bytes to send to the backend, and a report with
+        the original/processed byte counts and pixel sizes.
+    """
+    report = {
+        "original_bytes": len(data),
+        "processed_bytes": len(data),
+        "bytes_saved": 0,
+        "original_size": None,
+        "processed_size": None,
+    }
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        report["original_size"] = image.size
+        if image.format == "JPEG":
+            # Let the JPEG decoder do most of the downscaling.
+            image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=quality, optimize=True)
+        processed = out.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Not something Pillow can decode (or more pixels than MAX_IMAGE_PIXELS
+        # allows); let the backend deal with the original.
+        _record(report)
+        return data, report
+
+    if len(processed) < len(data):
+        report["processed_bytes"] = len(processed)
+        report["bytes_saved"] = len(data) - len(processed)
+        report["processed_size"] = image.size
+    else:
+        processed = data
+        report["processed_size"] = report["original_size"]
+
+    _record(report)
+    return processed, report
+
+
+def preprocessing_stats() -> dict:
+    """
+    Returns running totals of images processed and bytes saved.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+    return stats
+
+
+def _record(report: dict):
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["bytes_in"] += report["original_bytes"]
+        _stats["bytes_out"] += report["processed_bytes"]
+        if report["bytes_saved"]:
+            _stats["resized"] += 1
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # Example usage: python image_preprocessing.py path/to/photo.jpg
+    with open(sys.argv[1], "rb") as f:
+        original = f.read()
+    start = time.time()
+    _, result = preprocess_image(original)
+    end = time.time()
+
+    print("Report:", result)
+    print("Time taken:", end - start)
@@ -0,0 +1,254 @@
+"""
+job_queue.py
+
+Durable queue of image analysis jobs, shared by the web processes (which
+enqueue uploads) and the analysis workers (worker.py, which run them).
+
+Jobs live in a SQLite database in WAL mode, so they survive restarts and
+deploys of either tier, and any process on the host (or sharing the volume)
+can use it. A job is keyed by its upload uid and carries the image bytes.
+
+A worker leases a job for JOB_LEASE_SECONDS and extends the lease while it
+works. A job whose lease ran out (the worker crashed or was killed) goes back
+to the queue. A failed job is retried after an exponential backoff, up to
+JOB_MAX_ATTEMPTS attempts in total (expired leases count as attempts). Once
+it has used them all it is marked failed: its image is dropped and the row
+kept for a day for /queue_stats. A job that could not start because the
+provider was overloaded is deferred instead: it goes back to the queue for the
+provider's Retry-After without using up an attempt.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+from result_store import thread_connection
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# JOB_QUEUE            - set to 1 to run analyses through the queue and workers
+#                        instead of as background tasks in the web process.
+# JOB_QUEUE_PATH       - database file of the queue.
+# JOB_LEASE_SECONDS    - how long a leased job is reserved for its worker
+#                        without a heartbeat.
+# JOB_MAX_ATTEMPTS     - attempts (including expired leases) before a job fails.
+# JOB_RETRY_BACKOFF    - delay before the first retry (s); doubles each attempt.
+# JOB_QUEUE_MAX_DEPTH  - queued jobs above which new uploads are refused (503).
+# ------------------------------------------------------------------------------
+JOB_QUEUE = os.getenv("JOB_QUEUE", "0") == "1"
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "analysis_jobs.db")
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))
+JOB_QUEUE_MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "1000"))
+
+QUEUED = "queued"
+LEASED = "leased"
+FAILED = "failed"
+
+# Failed rows are kept this long (seconds) for stats, then purged.
+FAILED_TTL = 86400
+
+
+class Job:
+    """
+    A leased analysis job.
+
+    Args:
+        uid (str): The upload uid the result is stored under.
+        data (bytes): The uploaded image.
+        attempt (int): 1 for the first attempt, 2 for the first retry, ...
+        enqueued_at (float): time.time() when the upload was enqueued.
+    """
+
+    def __init__(self, uid: str, data: bytes, attempt: int, enqueued_at: float):
+        self.uid = uid
+        self.data = data
+        self.attempt = attempt
+        self.enqueued_at = enqueued_at
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue with leases and retries. Each thread (and each
+    forked process) gets its own connection.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_PATH, lease_seconds: float = JOB_LEASE_SECONDS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, retry_backoff: float = JOB_RETRY_BACKOFF):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " uid TEXT PRIMARY KEY,"
+            " data BLOB,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " available_at REAL NOT NULL,"
+            " lease_owner TEXT,"
+            " lease_until REAL,"
+            " enqueued_at REAL NOT NULL,"
+            " error TEXT)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at)")
+
+    def enqueue(self, uid: str, data: bytes):
+        """
+        Adds a job for uid (replacing any earlier job with the same uid).
+        """
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO jobs (uid, data, status, attempts, available_at, enqueued_at)"
+            " VALUES (?, ?, ?, 0, ?, ?)",
+            (uid, data, QUEUED, now, now))
+
+    def lease(self, owner: str) -> Optional[Job]:
+        """
+        Takes the oldest runnable job: a queued job whose retry delay has
+        passed, or a leased job whose lease expired.
+
+        Args:
+            owner (str): Identifies the worker; needed to extend, complete
+                or fail the job.
+
+        Returns:
+            Optional[Job]: The job, or None if nothing is runnable.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT uid, data, attempts, enqueued_at FROM jobs"
+                " WHERE (status = ? AND available_at <= ?)"
+                " OR (status = ? AND lease_until < ? AND attempts < ?)"
+                " ORDER BY available_at LIMIT 1",
+                (QUEUED, now, LEASED, now, self.max_attempts)).fetchone()
+            if row is None:
+                return None
+            uid, data, attempts, enqueued_at = row
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = ?, lease_owner = ?, lease_until = ? WHERE uid = ?",
+                (LEASED, attempts + 1, owner, now + self.lease_seconds, uid))
+        return Job(uid, data, attempts + 1, enqueued_at)
+
+    def extend(self, uid: str, owner: str) -> bool:
+        """
+        Renews owner's lease on uid. Returns False if the lease was lost.
+        """
+        cursor = self._conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE uid = ? AND status = ? AND lease_owner = ?",
+            (time.time() + self.lease_seconds, uid, LEASED, owner))
+        return cursor.rowcount == 1
+
+    def complete(self, uid: str, owner: str) -> bool:
+        """
+        Removes a finished job. Returns False if owner no longer held the lease.
+        """
+        cursor = self._conn().execute(
+            "DELETE FROM jobs WHERE uid = ? AND status = ? AND lease_owner = ?", (uid, LEASED, owner))
+        return cursor.rowcount == 1
+
+    def fail(self, uid: str, owner: str, error: str) -> Optional[str]:
+        """
+        Records a failed attempt: the job is retried after a backoff, or
+        marked failed once it has used all its attempts.
+
+        Returns:
+            Optional[str]: QUEUED if the job will be retried, FAILED if it has
+            failed for good, or None if owner no longer held the lease.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts FROM jobs WHERE uid = ? AND status = ? AND lease_owner = ?",
+                (uid, LEASED, owner)).fetchone()
+            if row is None:
+                return None
+            attempts = row[0]
+            if attempts < self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, available_at = ?, lease_owner = NULL, lease_until = NULL,"
+                    " error = ? WHERE uid = ?",
+                    (QUEUED, now + self.retry_backoff * 2 ** (attempts - 1), error, uid))
+                return QUEUED
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = NULL, available_at = ?, lease_owner = NULL,"
+                " lease_until = NULL, error = ? WHERE uid = ?",
+                (FAILED, now, error, uid))
+            return FAILED
+
+    def defer(self, uid: str, owner: str, delay: float) -> bool:
+        """
+        Puts a leased job back in the queue for delay seconds without counting
+        the attempt (e.g. admission control refused its upstream call).
+        Returns False if owner no longer held the lease.
+        """
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = ?, attempts = attempts - 1, available_at = ?, lease_owner = NULL,"
+            " lease_until = NULL WHERE uid = ? AND status = ? AND lease_owner = ?",
+            (QUEUED, time.time() + delay, uid, LEASED, owner))
+        return cursor.rowcount == 1
+
+    def reap(self) -> List[str]:
+        """
+        Fails jobs whose last attempt's lease expired, and purges old failed
+        rows.
+
+        Returns:
+            List[str]: The uids of the jobs just failed.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            uids = [row[0] for row in conn.execute(
+                "SELECT uid FROM jobs WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (LEASED, now, self.max_attempts))]
+            conn.executemany(
+                "UPDATE jobs SET status = ?, data = NULL, available_at = ?, lease_owner = NULL,"
+                " lease_until = NULL, error = 'lease expired' WHERE uid = ?",
+                [(FAILED, now, uid) for uid in uids])
+            conn.execute("DELETE FROM jobs WHERE status = ? AND available_at < ?", (FAILED, now - FAILED_TTL))
+        return uids
+
+    def depth(self) -> int:
+        """
+        Returns the number of jobs waiting to run (queued, including retries).
+        """
+        return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+    def stats(self) -> dict:
+        """
+        Returns job counts by status and the age of the oldest queued job.
+        """
+        conn = self._conn()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        oldest = conn.execute(
+            "SELECT MIN(enqueued_at) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+        return {
+            "queued": counts.get(QUEUED, 0),
+            "leased": counts.get(LEASED, 0),
+            "failed": counts.get(FAILED, 0),
+            "oldest_queued_seconds": time.time() - oldest if oldest is not None else None,
+        }
+
+    def _conn(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.path)
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers cannot
+        # select the same job before either has updated it.
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
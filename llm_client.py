@@ -0,0 +1,254 @@
+"""
+llm_client.py
+
+Async client for the OpenAI chat completions API.
+
+A single httpx.AsyncClient is shared by every request so TCP/TLS connections
+are kept alive and reused. Calls are bounded by a concurrency limit, use
+configurable timeouts, and are retried with exponential backoff on rate
+limits, server errors and connection failures. Every attempt first passes the
+shared admission limiter (requests and estimated tokens per minute, see
+admission.py); a Retry-After from the API pauses the limiter, so every queued
+call holds off, not just the one that was refused.
+stream_chat_completion yields content tokens as they arrive; it only retries
+before the first token has been yielded.
+"""
+
+import asyncio
+import json
+import os
+import random
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from admission import ProviderLimiter, llm_limiter
+from metrics import timed, timeout
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# OPENAI_BASE_URL       - API root; point it at a local stub for testing.
+# LLM_TIMEOUT           - read/write timeout per attempt, in seconds.
+# LLM_CONNECT_TIMEOUT   - connect timeout per attempt, in seconds.
+# LLM_MAX_RETRIES       - retries after the first attempt.
+# LLM_BACKOFF_BASE      - first backoff delay in seconds (doubles each retry).
+# LLM_MAX_CONCURRENCY   - in-flight requests allowed at once.
+# LLM_MAX_CONNECTIONS   - size of the keep-alive connection pool.
+# ------------------------------------------------------------------------------
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+
+# Status codes worth retrying: rate limited, or a transient upstream failure.
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Rough characters per token, to estimate a prompt's size before sending it.
+CHARS_PER_TOKEN = 4
+
+
+class LLMError(Exception):
+    """
+    Raised when a chat completion fails after all retries.
+    """
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMClient:
+    """
+    Pooled, rate-limited async client for /chat/completions.
+
+    The HTTP client and semaphore are created lazily inside the running event
+    loop, so the module can be imported before uvicorn starts its loop.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, base_url: str = OPENAI_BASE_URL,
+                 timeout: float = LLM_TIMEOUT, connect_timeout: float = LLM_CONNECT_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES, backoff_base: float = LLM_BACKOFF_BASE,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, max_connections: int = LLM_MAX_CONNECTIONS,
+                 limiter: ProviderLimiter = llm_limiter):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_concurrency = max_concurrency
+        self.limiter = limiter
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client = None
+        self._semaphore = None
+
+    def _ensure(self):
+        if self._client is None:
+            api_key = self.api_key or os.getenv("OPENAI_API_KEY")
+            headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                timeout=self.timeout,
+                limits=self.limits,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def chat_completion(self, messages: list, **params) -> dict:
+        """
+        Calls the chat completions endpoint and returns the decoded response.
+
+        Args:
+            messages (list): Chat messages in OpenAI format.
+            **params: Extra request fields (model, temperature, max_tokens, ...).
+
+        Returns:
+            dict: The JSON response body.
+
+        Raises:
+            LLMError: If every attempt failed.
+            Overloaded: If admission control refused the call.
+        """
+        self._ensure()
+        payload = dict(params, messages=messages)
+        with timed("llm"):
+            return await self._chat_completion(payload)
+
+    async def _chat_completion(self, payload: dict) -> dict:
+        tokens = estimate_tokens(payload)
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            await self.limiter.acquire_async(tokens)
+            async with self._semaphore:
+                try:
+                    response = await self._client.post("/chat/completions", json=payload)
+                except (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError) as e:
+                    if isinstance(e, httpx.TimeoutException):
+                        timeout("llm")
+                    error = LLMError(f"{type(e).__name__}: {e}")
+                else:
+                    if response.status_code < 400:
+                        body = response.json()
+                        used = (body.get("usage") or {}).get("total_tokens")
+                        if used is not None:
+                            self.limiter.settle(tokens, used)
+                        return body
+                    error = LLMError(
+                        f"HTTP {response.status_code}: {response.text[:200]}", response.status_code)
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        raise error
+                    retry_after = _retry_after(response)
+
+            if attempt == self.max_retries:
+                raise error
+            await self._wait_before_retry(attempt, retry_after)
+
+    async def stream_chat_completion(self, messages: list, **params) -> AsyncIterator[str]:
+        """
+        Calls the chat completions endpoint with stream=True and yields the
+        content deltas as they arrive.
+
+        Args:
+            messages (list): Chat messages in OpenAI format.
+            **params: Extra request fields (model, temperature, max_tokens, ...).
+
+        Yields:
+            str: Content tokens, in order.
+
+        Raises:
+            LLMError: If every attempt failed, or the stream broke after the
+                first token (which is never retried, to avoid duplicate text).
+            Overloaded: If admission control refused the call.
+        """
+        self._ensure()
+        payload = dict(params, messages=messages, stream=True)
+        tokens = self._stream_chat_completion(payload)
+        try:
+            with timed("llm"):
+                async for token in tokens:
+                    yield token
+        finally:
+            # Release the connection and concurrency slot as soon as the caller stops.
+            await tokens.aclose()
+
+    async def _stream_chat_completion(self, payload: dict) -> AsyncIterator[str]:
+        tokens = estimate_tokens(payload)
+        started = False
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            await self.limiter.acquire_async(tokens)
+            async with self._semaphore:
+                try:
+                    async with self._client.stream("POST", "/chat/completions", json=payload) as response:
+                        if response.status_code < 400:
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[len("data:"):].strip()
+                                if data == "[DONE]":
+                                    return
+                                choices = json.loads(data).get("choices") or [{}]
+                                token = (choices[0].get("delta") or {}).get("content")
+                                if token:
+                                    started = True
+                                    yield token
+                            return
+                        await response.aread()
+                        error = LLMError(
+                            f"HTTP {response.status_code}: {response.text[:200]}", response.status_code)
+                        if response.status_code not in RETRY_STATUS_CODES:
+                            raise error
+                        retry_after = _retry_after(response)
+                except (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError) as e:
+                    if isinstance(e, httpx.TimeoutException):
+                        timeout("llm")
+                    error = LLMError(f"{type(e).__name__}: {e}")
+                    if started:
+                        raise error
+
+            if attempt == self.max_retries:
+                raise error
+            await self._wait_before_retry(attempt, retry_after)
+
+    async def _wait_before_retry(self, attempt: int, retry_after: Optional[float]):
+        if retry_after is not None:
+            # The next acquire waits it out, along with every other queued call.
+            self.limiter.pause(retry_after)
+            return
+        # Full jitter keeps retries from a burst of failures from re-colliding.
+        await asyncio.sleep(random.uniform(0, self.backoff_base * (2 ** attempt)))
+
+    async def aclose(self):
+        """
+        Closes pooled connections. Safe to call more than once.
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+
+def estimate_tokens(payload: dict) -> int:
+    """
+    Estimates the tokens a request will use: its prompt at CHARS_PER_TOKEN
+    characters per token plus max_tokens for each of its n completions.
+    """
+    prompt = sum(len(str(message.get("content") or "")) for message in payload.get("messages", []))
+    return prompt // CHARS_PER_TOKEN + int(payload.get("max_tokens") or 256) * int(payload.get("n") or 1)
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+
+# Shared instance used by caption_generator.
+llm_client = LLMClient()
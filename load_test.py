@@ -0,0 +1,291 @@
+"""
+load_test.py
+
+End-to-end load test of the caption flow against local provider stubs.
+
+By default it starts provider_stubs.py in-process and the app under uvicorn
+(pointed at the stubs), then runs --flows user sessions, --concurrency at a
+time. Each session goes through the real flow:
+    /upload_image -> /analysis_status (long-poll) -> /context
+    -> /generate_caption -> /feedback
+With --api each session is a single POST /generate instead.
+It reports p50/p95/p99 per step and per session, requests/sec, sessions/sec
+and the server's peak RSS, and writes everything to a JSON file. Pass
+--baseline with an earlier result file to print the change per metric.
+
+Use --url to drive an already running server instead (pass --pid to still
+get its peak RSS).
+
+Usage:
+    python load_test.py --flows 200 --concurrency 20 --output bench_results.json
+    python load_test.py --flows 200 --concurrency 20 --baseline bench_results.json --output new.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+from provider_stubs import StubServer, add_profile_arguments, profiles_from_args
+
+STEPS = ["upload_image", "analysis_status", "context", "generate_caption", "feedback", "generate"]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    Nearest-rank percentile of values, or None if there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(latencies: List[float], errors: int) -> dict:
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies) if latencies else None,
+    }
+
+
+def make_images(count: int, size: tuple) -> List[bytes]:
+    """
+    Generates distinct JPEGs (random noise), so uploads are neither exact nor
+    near duplicates of each other unless --images is smaller than --flows.
+    """
+    images = []
+    for _ in range(count):
+        channels = [Image.effect_noise(size, 64) for _ in range(3)]
+        out = io.BytesIO()
+        Image.merge("RGB", channels).save(out, format="JPEG", quality=85)
+        images.append(out.getvalue())
+    return images
+
+
+def peak_rss_bytes(pid: int) -> Optional[int]:
+    """
+    Returns the peak RSS (VmHWM) of pid plus its child processes (uvicorn
+    workers), or None where /proc is unavailable.
+    """
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1]) * 1024
+            try:
+                with open(f"/proc/{current}/task/{current}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+    except OSError:
+        return None
+    return total
+
+
+class LoadTest:
+    """
+    Runs user sessions against a server and collects per-step latencies.
+    """
+
+    def __init__(self, base_url: str, images: List[bytes], analysis_wait: float = 25.0, api: bool = False):
+        self.base_url = base_url
+        self.api = api
+        self.images = images
+        self.analysis_wait = analysis_wait
+        self.latencies: Dict[str, List[float]] = {step: [] for step in STEPS + ["session"]}
+        self.errors: Dict[str, int] = {step: 0 for step in STEPS + ["session"]}
+        self.requests = 0
+
+    async def run(self, flows: int, concurrency: int) -> float:
+        """
+        Runs flows sessions, concurrency at a time, and returns the wall time.
+        """
+        limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+        timeout = httpx.Timeout(self.analysis_wait + 60)
+        counter = iter(range(flows))
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=timeout) as client:
+            async def worker():
+                for index in counter:
+                    await self.session(client, index)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            return time.perf_counter() - start
+
+    async def session(self, client: httpx.AsyncClient, index: int):
+        start = time.perf_counter()
+        try:
+            image = self.images[index % len(self.images)]
+            if self.api:
+                await self.step(client, "generate", "POST", "/generate",
+                                files={"image": (f"photo{index}.jpg", image, "image/jpeg")},
+                                data={"tone": random.choice(["", "playful", "chill"])})
+                self.latencies["session"].append(time.perf_counter() - start)
+                return
+            response = await self.step(client, "upload_image", "POST", "/upload_image",
+                                       files={"file": (f"photo{index}.jpg", image, "image/jpeg")})
+            uid = response.text.split('var uid = "')[1].split('"')[0]
+            await self.step(client, "analysis_status", "GET", "/analysis_status",
+                            params={"uid": uid, "wait": self.analysis_wait})
+            await self.step(client, "context", "GET", "/context", params={"uid": uid})
+            response = await self.step(client, "generate_caption", "POST", "/generate_caption",
+                                       data={"uid": uid, "tone": random.choice(["", "playful", "chill"])})
+            caption = response.text.split("<p>", 1)[-1].split("</p>", 1)[0].strip()
+            await self.step(client, "feedback", "POST", "/feedback",
+                            data={"final_caption": caption, "feedback": "Too plain.",
+                                  "direction": "Make it more energetic"})
+        except Exception:
+            self.errors["session"] += 1
+            return
+        self.latencies["session"].append(time.perf_counter() - start)
+
+    async def step(self, client: httpx.AsyncClient, name: str, method: str, path: str, **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        self.requests += 1
+        try:
+            response = await client.request(method, path, **kwargs)
+            response.raise_for_status()
+            if "Error generating" in response.text:
+                raise RuntimeError(f"{name} returned an error page")
+        except Exception:
+            self.errors[name] += 1
+            raise
+        self.latencies[name].append(time.perf_counter() - start)
+        return response
+
+
+def start_app(port: int, stubs: StubServer, workers: int, env: Dict[str, str]) -> subprocess.Popen:
+    """
+    Starts the app under uvicorn, pointed at the stubs, and waits until it
+    answers.
+    """
+    env = dict(os.environ, **env)
+    env.setdefault("HF_MODEL", f"{stubs.url}/models/blip")
+    env.setdefault("OPENAI_BASE_URL", f"{stubs.url}/v1")
+    env.setdefault("OPENAI_API_KEY", "stub")
+    env.setdefault("DESCRIPTION_BACKENDS", "hf")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The app exited during startup.")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The app did not start within 60 seconds.")
+
+
+def compare(result: dict, baseline: dict):
+    """
+    Prints the relative change of each latency percentile and throughput.
+    """
+    def change(new, old):
+        if new is None or not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    for step, stats in result["steps"].items():
+        old = baseline.get("steps", {}).get(step, {})
+        print(f"{step:>17}: " + ", ".join(
+            f"{key} {change(stats.get(key), old.get(key))}" for key in ("p50", "p95", "p99")))
+    for key in ("requests_per_sec", "sessions_per_sec", "peak_rss_bytes"):
+        print(f"{key:>17}: {change(result.get(key), baseline.get(key))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the caption flow.")
+    parser.add_argument("--flows", type=int, default=100, help="user sessions to run")
+    parser.add_argument("--concurrency", type=int, default=10, help="sessions running at once")
+    parser.add_argument("--api", action="store_true", help="use the JSON /generate endpoint")
+    parser.add_argument("--images", type=int, default=32, help="distinct images to cycle through")
+    parser.add_argument("--image-size", type=int, nargs=2, default=(1600, 1200), metavar=("W", "H"))
+    parser.add_argument("--url", help="drive this running server instead of starting one")
+    parser.add_argument("--pid", type=int, help="server pid for peak RSS when using --url")
+    parser.add_argument("--port", type=int, default=8765, help="port for the started app")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the started app")
+    parser.add_argument("--stub-port", type=int, default=0, help="port for the provider stubs (0 = any)")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra environment for the started app (repeatable)")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    hf, llm = profiles_from_args(args)
+    stubs = None
+    process = None
+    base_url = args.url
+    pid = args.pid
+    if base_url is None:
+        stubs = StubServer(hf, llm, port=args.stub_port).start()
+        app_env = dict(item.split("=", 1) for item in args.env)
+        process = start_app(args.port, stubs, args.workers, app_env)
+        base_url = f"http://127.0.0.1:{args.port}"
+        pid = process.pid
+
+    try:
+        test = LoadTest(base_url, make_images(args.images, tuple(args.image_size)), api=args.api)
+        elapsed = asyncio.run(test.run(args.flows, args.concurrency))
+        rss = peak_rss_bytes(pid) if pid else None
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if stubs is not None:
+            stubs.stop()
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "elapsed_seconds": elapsed,
+        "requests": test.requests,
+        "requests_per_sec": test.requests / elapsed,
+        "sessions_per_sec": len(test.latencies["session"]) / elapsed,
+        "peak_rss_bytes": rss,
+        "steps": {step: summarize(test.latencies[step], test.errors[step]) for step in test.latencies},
+        "upstream_calls": stubs.calls if stubs is not None else None,
+    }
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    for step, stats in result["steps"].items():
+        if stats["count"]:
+            print(f"{step:>17}: p50 {stats['p50'] * 1000:7.1f} ms  p95 {stats['p95'] * 1000:7.1f} ms  "
+                  f"p99 {stats['p99'] * 1000:7.1f} ms  errors {stats['errors']}")
+    print(f"{result['requests_per_sec']:.1f} requests/sec, {result['sessions_per_sec']:.2f} sessions/sec, "
+          + (f"peak RSS {rss / 2 ** 20:.0f} MiB" if rss else "peak RSS n/a"))
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+local_blip.py
+
+Runs the BLIP captioning model locally, behind the same describe_image
+interface as image_analysis.py.
+
+Concurrent describe_image calls are collected by a MicroBatcher into small
+batches (up to BLIP_MAX_BATCH_SIZE images, waiting at most BLIP_MAX_WAIT_MS for
+stragglers) and run through one batched model.generate call, which gives far
+more images/sec on CPU than generating one image at a time.
+
+Captioning is unconditional by default, like the Hugging Face inference
+endpoint, so the router can treat the two backends as interchangeable. With a
+text prompt BLIP continues the prompt instead; the prompt is then stripped from
+the start of the description.
+
+Requires the optional torch and transformers packages. They are imported,
+and the weights loaded, on first use or by load_model() (e.g. in the master
+process when preloading; see app.py).
+"""
+
+import io
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Union
+
+from PIL import Image
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# BLIP_MODEL           - Hugging Face model id or local path.
+# BLIP_MAX_BATCH_SIZE  - most images per model.generate call.
+# BLIP_MAX_WAIT_MS     - how long the first request in a batch waits for more.
+# BLIP_NUM_BEAMS       - beam search width.
+# BLIP_MAX_LENGTH      - longest generated description, in tokens.
+# ------------------------------------------------------------------------------
+BLIP_MODEL = os.getenv("BLIP_MODEL", "Salesforce/blip-image-captioning-large")
+BLIP_MAX_BATCH_SIZE = int(os.getenv("BLIP_MAX_BATCH_SIZE", "8"))
+BLIP_MAX_WAIT_MS = float(os.getenv("BLIP_MAX_WAIT_MS", "10"))
+BLIP_NUM_BEAMS = int(os.getenv("BLIP_NUM_BEAMS", "3"))
+BLIP_MAX_LENGTH = int(os.getenv("BLIP_MAX_LENGTH", "60"))
+
+# No prompt: unconditional captioning, matching the hosted endpoint's output.
+DEFAULT_PROMPT = None
+
+device = None
+
+_model_lock = threading.Lock()
+_processor = None
+_model = None
+
+
+def load_model():
+    """
+    Loads the BLIP processor and model once and returns them.
+    """
+    global _processor, _model, device
+    with _model_lock:
+        if _model is None:
+            import torch
+            from transformers import BlipProcessor, BlipForConditionalGeneration
+
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            _processor = BlipProcessor.from_pretrained(BLIP_MODEL)
+            model = BlipForConditionalGeneration.from_pretrained(BLIP_MODEL)
+            model.to(device)
+            if device.type == "cuda":
+                model.half()
+            model.eval()
+            _model = model
+    return _processor, _model
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads into batches and runs them
+    through process_batch on a single worker thread.
+
+    Args:
+        process_batch (Callable): Takes a list of items and returns a list of
+            results in the same order. A result that is an Exception instance
+            fails only that item's Future.
+        max_batch_size (int): Most items per batch.
+        max_wait_ms (float): How long to wait for more items after the first
+            item of a batch arrives.
+    """
+
+    def __init__(self, process_batch: Callable[[list], list], max_batch_size: int = BLIP_MAX_BATCH_SIZE,
+                 max_wait_ms: float = BLIP_MAX_WAIT_MS):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item) -> Future:
+        """
+        Queues an item and returns a Future for its result.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        """
+        Queues an item and blocks until its result is ready.
+        """
+        return self.submit(item).result()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="blip-batcher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        # Out of time, but still take anything already queued.
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            self.batches += 1
+            self.items += len(batch)
+
+    def stats(self) -> dict:
+        """
+        Returns the number of batches run and the mean batch size.
+        """
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
+
+
+def _open_image(image: Union[str, bytes]) -> Image.Image:
+    if isinstance(image, (bytes, bytearray)):
+        image = io.BytesIO(image)
+    return Image.open(image).convert("RGB")
+
+
+def describe_batch(requests: List[tuple]) -> List[str]:
+    """
+    Describes a batch of images with one model.generate call.
+
+    Args:
+        requests (List[tuple]): (image, prompt) pairs, where image is a path or
+            raw bytes and prompt is None for unconditional captioning.
+
+    Returns:
+        List[str]: One description per request, in order. Images that cannot
+        be opened get an exception in their slot instead of failing the batch.
+    """
+    results = [None] * len(requests)
+    # Unconditional and prompted images cannot share a generate call.
+    groups = {False: ([], [], []), True: ([], [], [])}
+    for i, (image, prompt) in enumerate(requests):
+        try:
+            opened = _open_image(image)
+        except (OSError, ValueError) as e:
+            results[i] = e
+            continue
+        images, prompts, slots = groups[prompt is not None]
+        images.append(opened)
+        prompts.append(prompt)
+        slots.append(i)
+    for prompted, (images, prompts, slots) in groups.items():
+        if images:
+            texts = _generate(images, prompts if prompted else None)
+            for i, prompt, text in zip(slots, prompts, texts):
+                results[i] = strip_prompt(text, prompt)
+    return results
+
+
+def _generate(images: list, prompts: Optional[List[str]]) -> List[str]:
+    import torch
+
+    processor, model = load_model()
+    inputs = processor(images=images, text=prompts,
+                       padding=True, return_tensors="pt").to(device)
+    if device.type == "cuda":
+        inputs["pixel_values"] = inputs["pixel_values"].half()
+    with torch.no_grad():
+        output_ids = model.generate(
+            **inputs, max_length=BLIP_MAX_LENGTH, num_beams=BLIP_NUM_BEAMS)
+    return processor.batch_decode(output_ids, skip_special_tokens=True)
+
+
+def strip_prompt(text: str, prompt: Optional[str]) -> str:
+    """
+    Removes the prompt BLIP echoes at the start of a conditional caption
+    (decoded in lower case, possibly with different spacing).
+    """
+    text = text.strip()
+    if prompt:
+        words, prompt_words = text.split(), prompt.lower().split()
+        if [word.lower() for word in words[:len(prompt_words)]] == prompt_words:
+            text = " ".join(words[len(prompt_words):])
+    return text
+
+
+# Shared batcher; every describe_image call in the process goes through it.
+batcher = MicroBatcher(describe_batch)
+
+
+def describe_image(image: Union[str, bytes], prompt: Optional[str] = DEFAULT_PROMPT) -> str:
+    """
+    Generates a detailed description of the image using the local BLIP model.
+    Blocks until the micro-batch containing this image has run.
+
+    Args:
+        image (str | bytes): The path to the image file, or the raw image bytes.
+        prompt (str): An optional prompt to guide the captioning (None for
+            unconditional captioning). It is not repeated in the result.
+
+    Returns:
+        str: A detailed description of the image.
+    """
+    return batcher((image, prompt))
+
+
+if __name__ == "__main__":
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Example usage: python local_blip.py img1.jpg img2.jpg ...
+    paths = sys.argv[1:]
+    load_model()
+
+    start = time.time()
+    for path in paths:
+        describe_batch([(path, DEFAULT_PROMPT)])
+    serial = time.time() - start
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=len(paths)) as pool:
+        descriptions = list(pool.map(describe_image, paths))
+    batched = time.time() - start
+
+    for path, description in zip(paths, descriptions):
+        print(path, "->", description)
+    print(f"Serial:  {len(paths) / serial:.2f} images/sec")
+    print(f"Batched: {len(paths) / batched:.2f} images/sec ({batcher.stats()})")
@@ -0,0 +1,360 @@
+"""
+metrics.py
+
+In-process metrics in the Prometheus text exposition format, without extra
+dependencies.
+
+Stages of a caption request are timed with `timed(stage)` (or `record`):
+- upload          reading the uploaded file
+- analysis_queue  from upload until the background analysis starts (in the
+                  web process; queued worker jobs are reported by gauges)
+- preprocess      downscaling the image
+- inference       the description backend call
+- analysis_wait   /generate_caption waiting for a pending analysis
+- llm             a chat completion (caption or alternative prompts)
+- render          rendering a template
+Durations go into one histogram labelled by stage, failures into an error
+counter and timeouts into a timeout counter. Gauges are read through a
+callback when /metrics is scraped.
+
+TimingMiddleware records every request's total latency and, when
+METRICS_TIMING_HEADERS=1, returns the stages timed while handling it in a
+Server-Timing header (shown in the browser dev tools' network panel).
+
+Process gauges report this worker's resident and private (not shared
+copy-on-write) memory, for comparing preload and per-worker model loading.
+
+Recording is a perf_counter call, a bisect and a few integer updates under a
+lock, so it is cheap enough for the hot path.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# METRICS_TIMING_HEADERS  - set to 1 to add a Server-Timing header to responses.
+# ------------------------------------------------------------------------------
+METRICS_TIMING_HEADERS = os.getenv("METRICS_TIMING_HEADERS", "0") == "1"
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_imported_at = time.perf_counter()
+
+# Stage timings of the request being handled: stage -> seconds.
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A monotonically increasing count, optionally split by labels.
+    """
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """
+    A value read from a callback at scrape time.
+    """
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.read()
+        except Exception:
+            # A failing callback should not break the whole scrape.
+            value = None
+        if value is not None:
+            lines.append(f"{self.name} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram of observed values, optionally split by labels.
+    """
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labelvalues -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labelvalues: str) -> int:
+        with self._lock:
+            series = self._series.get(labelvalues)
+            return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items())
+        for labelvalues, (counts, total, count) in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Collects metrics and renders them for /metrics.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def process_uptime() -> float:
+    """
+    Returns the seconds since this process started (from /proc on Linux;
+    elsewhere, since this module was imported).
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 is the start time in clock ticks after boot; the fields
+            # after the parenthesised command name start at field 3.
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.perf_counter() - _imported_at
+
+
+def resident_memory_bytes() -> int:
+    """
+    Returns this process's resident set size (Linux).
+    """
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def private_memory_bytes() -> int:
+    """
+    Returns the resident memory only this process uses, i.e. excluding pages
+    still shared copy-on-write with the parent or other workers (Linux).
+    """
+    total = 0
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                total += int(line.split()[1]) * 1024
+    return total
+
+
+# Shared registry and the app's metrics.
+registry = Registry()
+stage_seconds = registry.register(Histogram(
+    "caption_stage_seconds", "Time spent in each stage of caption generation.", ("stage",)))
+stage_errors = registry.register(Counter(
+    "caption_stage_errors_total", "Stage executions that raised an error.", ("stage",)))
+stage_timeouts = registry.register(Counter(
+    "caption_stage_timeouts_total", "Stage executions that timed out.", ("stage",)))
+request_seconds = registry.register(Histogram(
+    "caption_http_request_seconds", "HTTP request latency until the response is complete.",
+    ("method", "route", "status")))
+registry.register(Gauge(
+    "process_resident_memory_bytes", "Resident memory of this worker process.", resident_memory_bytes))
+registry.register(Gauge(
+    "caption_process_private_memory_bytes", "Resident memory not shared with other processes.",
+    private_memory_bytes))
+
+
+def record(stage: str, seconds: float):
+    """
+    Records a stage duration in the histogram and in the current request's
+    Server-Timing entries.
+    """
+    stage_seconds.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def request_timings() -> Dict[str, float]:
+    """
+    Returns the stage durations recorded so far for the current request.
+    """
+    return dict(_request_timings.get() or {})
+
+
+def timeout(stage: str):
+    """
+    Counts a timeout in stage.
+    """
+    stage_timeouts.inc(stage)
+
+
+class timed:
+    """
+    Context manager that records how long its block took as stage, and counts
+    an error if the block raises.
+
+        with timed("inference"):
+            description = describe_image(data)
+    """
+
+    __slots__ = ("stage", "_start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.stage, time.perf_counter() - self._start)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            stage_errors.inc(self.stage)
+        return False
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware that times each HTTP request and, if enabled, adds a
+    Server-Timing header listing the stages timed before the response started.
+    A request is timed until its last body chunk is sent, so background tasks
+    that Starlette runs after the response are not counted.
+
+    Args:
+        app: The ASGI app to wrap.
+        timing_headers (bool): Whether to add the Server-Timing header.
+    """
+
+    def __init__(self, app, timing_headers: bool = METRICS_TIMING_HEADERS):
+        self.app = app
+        self.timing_headers = timing_headers
+        self._routes = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings = {}
+        token = _request_timings.set(timings)
+        status = "500"
+        observed = False
+
+        def observe():
+            nonlocal observed
+            if not observed:
+                observed = True
+                request_seconds.observe(
+                    time.perf_counter() - start, scope["method"], self._route(scope), status)
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                if self.timing_headers:
+                    timings["total"] = time.perf_counter() - start
+                    header = ", ".join(
+                        f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", header.encode("latin-1"))]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                observe()
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            # Covers requests that failed or were cut off before the last chunk.
+            observe()
+
+    def _route(self, scope) -> str:
+        # Label by route template, not raw path, to keep the series bounded.
+        if self._routes is None:
+            app = scope.get("app")
+            self._routes = {getattr(route, "path", None) for route in getattr(app, "routes", [])}
+        path = scope["path"]
+        if path in self._routes:
+            return path
+        if path.startswith("/static/"):
+            return "/static"
+        return "other"
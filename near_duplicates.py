@@ -0,0 +1,266 @@
+"""
+near_duplicates.py
+
+Recognises re-uploads of a photo that are not byte-identical (re-compressed,
+resized or stripped of EXIF by a messaging app), so their description can be
+reused.
+
+Each image gets a 64-bit difference hash (dHash): the image is shrunk to 9x8
+grayscale pixels and each bit records whether a pixel is brighter than its
+right-hand neighbour. Re-encoding and resizing barely change it, so copies of
+the same photo land within a few bits of each other. Featureless images (solid
+colours, blank frames) all hash to nearly 0 or all ones, so hashes with fewer
+than NEAR_DUPLICATE_MIN_BITS bits set (or unset) are not matched at all.
+
+Hashes are kept in a multi-index hash table: the 64 bits are split into four
+16-bit chunks, each with its own bucket table. Two hashes within Hamming
+distance d agree on at least one chunk to within d // 4 bits (pigeonhole), so a
+lookup only probes the buckets near each of its four chunks instead of
+scanning every entry. The index is bounded and evicts the least recently used
+hash first. Its entries point into the description cache, so by default it
+holds as many hashes as the in-memory cache holds descriptions.
+"""
+
+import io
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from itertools import combinations
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from description_cache import CACHE_DIR, CACHE_MAX_ENTRIES
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# NEAR_DUPLICATES             - set to 0 to only reuse descriptions of identical bytes.
+# NEAR_DUPLICATE_DISTANCE     - largest Hamming distance (of 64 bits) treated as the same photo.
+# NEAR_DUPLICATE_MAX_ENTRIES  - hashes kept before the least recently used are evicted
+#                               (default: the description cache's memory size, or
+#                               100000 with its disk tier enabled).
+# NEAR_DUPLICATE_MIN_BITS     - hashes with fewer bits set (or unset) are too
+#                               featureless to match.
+# ------------------------------------------------------------------------------
+NEAR_DUPLICATES_ENABLED = os.getenv("NEAR_DUPLICATES", "1") != "0"
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "4"))
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv(
+    "NEAR_DUPLICATE_MAX_ENTRIES", str(100000 if CACHE_DIR else CACHE_MAX_ENTRIES)))
+NEAR_DUPLICATE_MIN_BITS = int(os.getenv("NEAR_DUPLICATE_MIN_BITS", "8"))
+
+HASH_SIZE = 8
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def dhash(data: bytes, hash_size: int = HASH_SIZE) -> Optional[int]:
+    """
+    Computes the difference hash of an image.
+
+    Args:
+        data (bytes): The raw image bytes.
+        hash_size (int): Rows/columns compared; the hash has hash_size**2 bits.
+
+    Returns:
+        Optional[int]: The hash, or None if Pillow cannot decode the image (or
+        it has more pixels than MAX_IMAGE_PIXELS allows).
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.format == "JPEG":
+            # Decode straight to a small grayscale image.
+            image.draft("L", (hash_size * 8, hash_size * 8))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = image.tobytes()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def informative(image_hash: int, min_bits: int = NEAR_DUPLICATE_MIN_BITS) -> bool:
+    """
+    Returns whether a hash has enough structure to be matched: near-uniform
+    images hash to (almost) all zeros or all ones and would match each other.
+    """
+    bits = bin(image_hash).count("1")
+    return min_bits <= bits <= HASH_SIZE * HASH_SIZE - min_bits
+
+
+def hamming(a: int, b: int) -> int:
+    """
+    Returns the number of differing bits between two hashes.
+    """
+    return bin(a ^ b).count("1")
+
+
+def _probe_masks(radius: int) -> List[int]:
+    # Every CHUNK_BITS-bit mask with at most radius bits set.
+    masks = []
+    for bits in range(radius + 1):
+        for positions in combinations(range(CHUNK_BITS), bits):
+            mask = 0
+            for position in positions:
+                mask |= 1 << position
+            masks.append(mask)
+    return masks
+
+
+class NearDuplicateIndex:
+    """
+    Bounded multi-index hash table from 64-bit image hashes to values (the
+    image keys of earlier uploads). Safe to use from the threadpool.
+
+    Args:
+        max_distance (int): Largest Hamming distance that counts as a match.
+        max_entries (int): Hashes kept before the least recently used is evicted.
+    """
+
+    def __init__(self, max_distance: int = NEAR_DUPLICATE_DISTANCE,
+                 max_entries: int = NEAR_DUPLICATE_MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._masks = _probe_masks(max(max_distance, 0) // CHUNKS)
+
+        self._lock = threading.Lock()
+        # hash -> value, least recently used first
+        self._entries = OrderedDict()
+        # one table per chunk: chunk value -> hashes with that chunk
+        self._buckets = [{} for _ in range(CHUNKS)]
+
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def add(self, image_hash: int, value: str):
+        """
+        Stores (or refreshes) a hash, evicting the oldest entries if needed.
+        """
+        with self._lock:
+            if image_hash in self._entries:
+                self._entries.move_to_end(image_hash)
+            else:
+                for table, chunk in zip(self._buckets, self._chunks(image_hash)):
+                    table.setdefault(chunk, []).append(image_hash)
+            self._entries[image_hash] = value
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self._unlink(oldest)
+
+    def lookup(self, image_hash: int) -> Optional[Tuple[str, int, int]]:
+        """
+        Finds the closest stored hash within max_distance.
+
+        Returns:
+            Optional[Tuple[str, int, int]]: (value, matched hash, distance), or
+            None if nothing is close enough. The matched hash is what to
+            remove() if its value turns out to be stale.
+        """
+        with self._lock:
+            value = self._entries.get(image_hash)
+            if value is not None:
+                self._entries.move_to_end(image_hash)
+                self.exact_hits += 1
+                return value, image_hash, 0
+
+            best, best_distance = None, self.max_distance + 1
+            for table, chunk in zip(self._buckets, self._chunks(image_hash)):
+                for mask in self._masks:
+                    for candidate in table.get(chunk ^ mask, ()):
+                        distance = hamming(candidate, image_hash)
+                        if distance < best_distance:
+                            best, best_distance = candidate, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.near_hits += 1
+            return self._entries[best], best, best_distance
+
+    def remove(self, image_hash: int):
+        """
+        Forgets a hash (e.g. when its description is no longer available).
+        """
+        with self._lock:
+            if self._entries.pop(image_hash, None) is not None:
+                self._unlink(image_hash)
+
+    def stats(self) -> dict:
+        """
+        Returns the index size and exact/near hit counters.
+        """
+        with self._lock:
+            lookups = self.exact_hits + self.near_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_distance": self.max_distance,
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.near_hits) / lookups if lookups else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _chunks(image_hash: int) -> List[int]:
+        return [(image_hash >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNKS)]
+
+    def _unlink(self, image_hash: int):
+        for table, chunk in zip(self._buckets, self._chunks(image_hash)):
+            bucket = table[chunk]
+            bucket.remove(image_hash)
+            if not bucket:
+                del table[chunk]
+
+
+# Shared index used by the app.
+near_duplicates = NearDuplicateIndex()
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Example usage: python near_duplicates.py [img1.jpg img2.jpg ...]
+    # Prints pairwise distances of the given images, then benchmarks lookups.
+    paths = sys.argv[1:]
+    hashes = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            hashes[path] = dhash(f.read())
+    for a, b in combinations(paths, 2):
+        print(f"{hamming(hashes[a], hashes[b]):>2} bits: {a} <-> {b}")
+
+    rng = random.Random(0)
+    for size in (10_000, 100_000, 1_000_000):
+        index = NearDuplicateIndex(max_entries=size)
+        stored = [rng.getrandbits(64) for _ in range(size)]
+        start = time.perf_counter()
+        for i, image_hash in enumerate(stored):
+            index.add(image_hash, str(i))
+        insert = time.perf_counter() - start
+
+        queries = 10_000
+        near = [stored[rng.randrange(size)] ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64))
+                for _ in range(queries)]
+        misses = [rng.getrandbits(64) for _ in range(queries)]
+        start = time.perf_counter()
+        found = sum(index.lookup(image_hash) is not None for image_hash in near)
+        near_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for image_hash in misses:
+            index.lookup(image_hash)
+        miss_time = time.perf_counter() - start
+        print(f"{size:>9} entries: insert {insert / size * 1e6:.1f} us, "
+              f"near lookup {near_time / queries * 1e6:.1f} us ({found}/{queries} found), "
+              f"miss lookup {miss_time / queries * 1e6:.1f} us")
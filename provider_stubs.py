@@ -0,0 +1,242 @@
+"""
+provider_stubs.py
+
+Local stand-ins for the two upstream APIs, for load tests and benchmarks:
+1) Hugging Face image-to-text: POST /models/<model> with the image bytes,
+   answers [{"generated_text": "..."}].
+2) OpenAI chat completions: POST /v1/chat/completions, honouring "n" and
+   "stream" (server-sent events).
+
+Each provider has its own latency distribution (log-normal around a median)
+and error rate; failed calls answer 503 (HF) or 429/500 (OpenAI) after the
+sampled latency, like an overloaded upstream would. Descriptions carry a
+counter so downstream caches see distinct inputs.
+
+Point the app at the stubs with:
+    HF_MODEL=http://127.0.0.1:9000/models/blip
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1
+
+Usage:
+    python provider_stubs.py --port 9000 --hf-latency 0.8 --llm-latency 0.4 --llm-error-rate 0.01
+"""
+
+import argparse
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ProviderProfile:
+    """
+    Latency and error behaviour of one stubbed provider.
+
+    Args:
+        latency (float): Median response time in seconds.
+        jitter (float): Sigma of the log-normal latency; 0 for a fixed latency.
+        error_rate (float): Fraction of calls that fail.
+        fail_first (int): Calls that fail before error_rate applies; OpenAI
+            answers them with 429 and Retry-After (rate limited).
+        token_interval (float): Delay between streamed tokens in seconds; the
+            latency is the time to the first token.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, fail_first: int = 0,
+                 token_interval: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fail_first = fail_first
+        self.token_interval = token_interval
+
+    def sample_latency(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        if self.jitter <= 0:
+            return self.latency
+        return random.lognormvariate(math.log(self.latency), self.jitter)
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+    def rate_limited(self, call: int) -> bool:
+        return call < self.fail_first
+
+
+SCENES = ["a group of friends sitting on a rock in a park", "a dog running on a beach at sunset",
+          "a plate of pasta on a wooden table", "a city street at night with neon signs"]
+CAPTIONS = ["Golden hour with the best crew", "Sunset chases and sandy paws", "Pasta night done right",
+            "Neon dreams on city streets", "Weekend mood, zero plans"]
+
+
+class StubServer:
+    """
+    Serves both stubbed providers from one threaded HTTP server.
+
+    Args:
+        hf (ProviderProfile): Behaviour of the image-to-text endpoint.
+        llm (ProviderProfile): Behaviour of the chat completions endpoint.
+        host (str): Interface to bind.
+        port (int): Port to bind (0 picks a free one).
+    """
+
+    def __init__(self, hf: ProviderProfile, llm: ProviderProfile, host: str = "127.0.0.1", port: int = 9000):
+        self.hf = hf
+        self.llm = llm
+        self._counter = itertools.count()
+        self.calls = {"hf": 0, "hf_errors": 0, "llm": 0, "llm_errors": 0}
+        # Chat completions being served right now, and the most at once.
+        self.llm_in_flight = 0
+        self.llm_max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.url = f"http://{host}:{self.port}"
+
+    def start(self) -> "StubServer":
+        """
+        Serves in a background thread and returns self.
+        """
+        threading.Thread(target=self._server.serve_forever, name="provider-stubs", daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, key: str) -> int:
+        # Returns the count before this call.
+        with self._lock:
+            self.calls[key] += 1
+            return self.calls[key] - 1
+
+    def _track_llm(self, delta: int):
+        with self._lock:
+            self.llm_in_flight += delta
+            self.llm_max_in_flight = max(self.llm_max_in_flight, self.llm_in_flight)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.path.startswith("/models/"):
+                    self._image_to_text()
+                elif self.path.rstrip("/").endswith("/chat/completions"):
+                    self._chat_completion(json.loads(body or b"{}"))
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def _image_to_text(self):
+                stub._count("hf")
+                time.sleep(stub.hf.sample_latency())
+                if stub.hf.fails():
+                    stub._count("hf_errors")
+                    self._send(503, {"error": "Model is overloaded"})
+                    return
+                text = f"{random.choice(SCENES)} #{next(stub._counter)}"
+                self._send(200, [{"generated_text": text}])
+
+            def _chat_completion(self, payload: dict):
+                stub._track_llm(1)
+                try:
+                    self._chat_completion_reply(payload)
+                finally:
+                    stub._track_llm(-1)
+
+            def _chat_completion_reply(self, payload: dict):
+                call = stub._count("llm")
+                time.sleep(stub.llm.sample_latency())
+                rate_limited = stub.llm.rate_limited(call)
+                if rate_limited or stub.llm.fails():
+                    stub._count("llm_errors")
+                    status = 429 if rate_limited else random.choice((429, 500))
+                    self._send(status, {"error": {"message": "stubbed failure"}},
+                               {"Retry-After": "0.1"} if status == 429 else None)
+                    return
+                choices = random.sample(CAPTIONS, min(int(payload.get("n", 1)), len(CAPTIONS)))
+                if payload.get("stream"):
+                    self._stream(choices[0])
+                    return
+                self._send(200, {
+                    "object": "chat.completion",
+                    "choices": [{"index": i, "message": {"role": "assistant", "content": text},
+                                 "finish_reason": "stop"} for i, text in enumerate(choices)],
+                })
+
+            def _stream(self, text: str):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for i, word in enumerate(text.split(" ")):
+                    if i and stub.llm.token_interval:
+                        time.sleep(stub.llm.token_interval)
+                    chunk = {"choices": [{"index": 0, "delta": {"content": word + " "}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+            def _send(self, status: int, body, headers: dict = None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the --hf-* and --llm-* latency/error options to a parser.
+    """
+    for name, latency in (("hf", 0.8), ("llm", 0.4)):
+        parser.add_argument(f"--{name}-latency", type=float, default=latency,
+                            help=f"median {name} latency in seconds")
+        parser.add_argument(f"--{name}-jitter", type=float, default=0.3,
+                            help=f"log-normal sigma of the {name} latency")
+        parser.add_argument(f"--{name}-error-rate", type=float, default=0.0,
+                            help=f"fraction of {name} calls that fail")
+
+
+def profiles_from_args(args) -> tuple:
+    """
+    Returns (hf, llm) ProviderProfiles from parsed add_profile_arguments options.
+    """
+    return (ProviderProfile(args.hf_latency, args.hf_jitter, args.hf_error_rate),
+            ProviderProfile(args.llm_latency, args.llm_jitter, args.llm_error_rate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve stubbed HF and OpenAI APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    hf, llm = profiles_from_args(args)
+    server = StubServer(hf, llm, args.host, args.port)
+    print(f"Stubs listening on {server.url} (HF_MODEL={server.url}/models/blip, "
+          f"OPENAI_BASE_URL={server.url}/v1)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,266 @@
+"""
+result_store.py
+
+Stores image analysis results keyed by upload uid.
+
+Two implementations share the ResultStore interface:
+1) MemoryResultStore - a bounded, TTL-evicting dictionary for a single process.
+2) SQLiteResultStore - a SQLite database in WAL mode that every worker process
+   on the host can read and write, so `uvicorn --workers N` works even when the
+   upload and the caption request land on different workers.
+An entry is "pending" from upload until analysis finishes, then "ready".
+"""
+
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# RESULT_STORE              - "memory" (default) or "sqlite".
+# RESULT_STORE_PATH         - database file for the sqlite store.
+# RESULT_STORE_MAX_ENTRIES  - entries kept before the oldest are evicted.
+# RESULT_STORE_TTL          - seconds an entry lives if nobody consumes it.
+# ------------------------------------------------------------------------------
+RESULT_STORE = os.getenv("RESULT_STORE", "memory")
+RESULT_STORE_PATH = os.getenv("RESULT_STORE_PATH", "analysis_results.db")
+RESULT_STORE_MAX_ENTRIES = int(os.getenv("RESULT_STORE_MAX_ENTRIES", "10000"))
+RESULT_STORE_TTL = float(os.getenv("RESULT_STORE_TTL", "3600"))
+
+PENDING = "pending"
+READY = "ready"
+
+
+def thread_connection(local: threading.local, path: str) -> sqlite3.Connection:
+    """
+    Returns this thread's connection to the SQLite database at path (in WAL
+    mode), opening it on first use. Shared by the result store and the job
+    queue (job_queue.py).
+
+    Args:
+        local (threading.local): Where the connection is kept per thread.
+        path (str): The database file.
+
+    Returns:
+        sqlite3.Connection: An autocommit connection.
+    """
+    conn = getattr(local, "conn", None)
+    # A connection opened before a fork (gunicorn --preload) must not be
+    # used by the forked worker; it opens its own.
+    if conn is None or local.pid != os.getpid():
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        local.conn = conn
+        local.pid = os.getpid()
+    return conn
+
+
+class ResultStore(ABC):
+    """
+    Interface for analysis result stores. A store that leaves any abstract
+    method unimplemented cannot be instantiated.
+    """
+
+    @abstractmethod
+    def mark_pending(self, uid: str):
+        """
+        Records that analysis for uid has started.
+        """
+
+    @abstractmethod
+    def put(self, uid: str, description: str):
+        """
+        Stores the finished description for uid.
+        """
+
+    @abstractmethod
+    def get(self, uid: str) -> Optional[str]:
+        """
+        Returns the description for uid, or None if it is missing or pending.
+        """
+
+    @abstractmethod
+    def pop(self, uid: str) -> Optional[str]:
+        """
+        Removes uid and returns its description (None if missing or pending).
+        """
+
+    @abstractmethod
+    def status(self, uid: str) -> Optional[str]:
+        """
+        Returns PENDING, READY, or None if uid is unknown or expired.
+        """
+
+    def __contains__(self, uid: str) -> bool:
+        return self.status(uid) == READY
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """
+        Returns the number of entries (pending and ready).
+        """
+
+
+class MemoryResultStore(ResultStore):
+    """
+    In-process store with a maximum size and TTL eviction.
+    """
+
+    def __init__(self, max_entries: int = RESULT_STORE_MAX_ENTRIES, ttl: float = RESULT_STORE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # uid -> (description or None while pending, created_at), oldest first
+        self._entries = OrderedDict()
+
+    def mark_pending(self, uid: str):
+        self._set(uid, None)
+
+    def put(self, uid: str, description: str):
+        self._set(uid, description)
+
+    def get(self, uid: str) -> Optional[str]:
+        with self._lock:
+            entry = self._live_entry(uid)
+            return entry[0] if entry else None
+
+    def pop(self, uid: str) -> Optional[str]:
+        with self._lock:
+            entry = self._live_entry(uid)
+            self._entries.pop(uid, None)
+            return entry[0] if entry else None
+
+    def status(self, uid: str) -> Optional[str]:
+        with self._lock:
+            entry = self._live_entry(uid)
+        if entry is None:
+            return None
+        return PENDING if entry[0] is None else READY
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._evict(time.time())
+            return len(self._entries)
+
+    def _set(self, uid: str, description: Optional[str]):
+        now = time.time()
+        with self._lock:
+            created_at = self._entries.get(uid, (None, now))[1]
+            self._entries[uid] = (description, created_at)
+            self._evict(now)
+
+    def _live_entry(self, uid: str):
+        entry = self._entries.get(uid)
+        if entry is not None and time.time() - entry[1] > self.ttl:
+            del self._entries[uid]
+            return None
+        return entry
+
+    def _evict(self, now: float):
+        # Entries are kept in creation order, so expired ones are at the front.
+        while self._entries:
+            uid, (_, created_at) = next(iter(self._entries.items()))
+            if now - created_at <= self.ttl and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[uid]
+
+
+class SQLiteResultStore(ResultStore):
+    """
+    Store shared by every worker process on the host, backed by SQLite in WAL
+    mode. Each thread gets its own connection.
+    """
+
+    # Expired/overflow rows are purged on every Nth write rather than every write.
+    PURGE_EVERY = 64
+
+    def __init__(self, path: str = RESULT_STORE_PATH, max_entries: int = RESULT_STORE_MAX_ENTRIES,
+                 ttl: float = RESULT_STORE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " uid TEXT PRIMARY KEY,"
+            " description TEXT,"
+            " created_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at)")
+
+    def mark_pending(self, uid: str):
+        self._write(
+            "INSERT OR REPLACE INTO results (uid, description, created_at) VALUES (?, NULL, ?)",
+            (uid, time.time()))
+
+    def put(self, uid: str, description: str):
+        self._write(
+            "INSERT INTO results (uid, description, created_at) VALUES (?, ?, ?)"
+            " ON CONFLICT(uid) DO UPDATE SET description = excluded.description",
+            (uid, description, time.time()))
+
+    def get(self, uid: str) -> Optional[str]:
+        row = self._row(uid)
+        return row[0] if row else None
+
+    def pop(self, uid: str) -> Optional[str]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._row(uid)
+            conn.execute("DELETE FROM results WHERE uid = ?", (uid,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row[0] if row else None
+
+    def status(self, uid: str) -> Optional[str]:
+        row = self._row(uid)
+        if row is None:
+            return None
+        return PENDING if row[0] is None else READY
+
+    def __len__(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM results WHERE created_at >= ?",
+            (time.time() - self.ttl,)).fetchone()[0]
+
+    def _conn(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.path)
+
+    def _row(self, uid: str):
+        return self._conn().execute(
+            "SELECT description FROM results WHERE uid = ? AND created_at >= ?",
+            (uid, time.time() - self.ttl)).fetchone()
+
+    def _write(self, sql: str, params: tuple):
+        conn = self._conn()
+        conn.execute(sql, params)
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM results WHERE created_at < ?",
+                         (time.time() - self.ttl,))
+            conn.execute(
+                "DELETE FROM results WHERE uid IN ("
+                " SELECT uid FROM results ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+
+
+def create_result_store() -> ResultStore:
+    """
+    Builds the store selected by the RESULT_STORE environment variable.
+    """
+    if RESULT_STORE == "sqlite":
+        return SQLiteResultStore()
+    if RESULT_STORE == "memory":
+        return MemoryResultStore()
+    raise ValueError(f"Unknown RESULT_STORE: {RESULT_STORE!r}")
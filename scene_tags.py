@@ -0,0 +1,337 @@
+"""
+scene_tags.py
+
+Tags images with scene labels ("a calm beach scene", "a lively nightclub
+scene", ...) using CLIP, as extra context for the caption prompt.
+
+Built from attempt1.py, but the text side is done once: the tag vocabulary is
+encoded with CLIP a single time and saved as a normalized float32 matrix
+(SCENE_TAG_INDEX + ".npy", with the tags and model name in a ".json" next to
+it). The matrix is memory-mapped on load, so it costs no per-request work and
+worker processes share its pages. Images are scored against the whole
+vocabulary with one matrix multiply plus a top-k, which keeps vocabularies of
+thousands of tags cheap. The app tags one image per upload (analysis.py);
+tag_images() also takes a batch in one CLIP pass, which the command line
+below uses for several images.
+
+Requires numpy, plus the optional torch and clip packages to encode images
+and build the index.
+
+Usage:
+    python scene_tags.py build [vocab.txt]   # (re)build the index
+    python scene_tags.py bench               # scoring throughput on CPU
+    python scene_tags.py img1.jpg img2.jpg   # print the top tags per image
+"""
+
+import io
+import json
+import os
+import threading
+import time
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# SCENE_TAG_VOCAB      - text file with one tag per line (default: DEFAULT_TAGS).
+# SCENE_TAG_INDEX      - path prefix of the saved index (.npy matrix + .json tags).
+# SCENE_TAG_MODEL      - CLIP model name.
+# SCENE_TAG_TOP_K      - tags kept per image.
+# SCENE_TAG_MIN_SCORE  - lowest cosine similarity for a tag to be kept.
+# ------------------------------------------------------------------------------
+SCENE_TAG_VOCAB = os.getenv("SCENE_TAG_VOCAB", "")
+SCENE_TAG_INDEX = os.getenv("SCENE_TAG_INDEX", "scene_tags")
+SCENE_TAG_MODEL = os.getenv("SCENE_TAG_MODEL", "ViT-B/32")
+SCENE_TAG_TOP_K = int(os.getenv("SCENE_TAG_TOP_K", "3"))
+SCENE_TAG_MIN_SCORE = float(os.getenv("SCENE_TAG_MIN_SCORE", "0.2"))
+
+# Tags encoded per CLIP text batch while building the index.
+BUILD_BATCH_SIZE = 256
+
+# The candidate texts from attempt1.py.
+DEFAULT_TAGS = [
+    "a vibrant sunrise",
+    "a majestic sunset",
+    "a dynamic cityscape",
+    "a bustling urban street",
+    "a serene countryside",
+    "a scenic mountain view",
+    "a calm beach scene",
+    "a lively nightclub scene",
+    "a blurred party atmosphere",
+    "a thrilling adventure sport moment",
+    "an intense action shot",
+    "a joyful family gathering",
+    "a group of close friends",
+    "an energetic festival",
+    "a sophisticated office environment",
+    "a quaint coffee shop",
+    "a modern art gallery",
+    "a mysterious, foggy scene",
+    "a colorful street market",
+    "a peaceful park setting",
+    "a dramatic natural landscape",
+    "a romantic evening ambiance",
+]
+
+
+class TagIndex:
+    """
+    A tag vocabulary and its L2-normalized CLIP text embeddings.
+
+    Args:
+        tags (List[str]): The tags, one per matrix row.
+        matrix (np.ndarray): float32 array of shape (len(tags), dim).
+        model (str): Name of the CLIP model that produced the embeddings.
+    """
+
+    def __init__(self, tags: List[str], matrix: np.ndarray, model: str = SCENE_TAG_MODEL):
+        if len(tags) != matrix.shape[0]:
+            raise ValueError("TagIndex needs exactly one matrix row per tag.")
+        self.tags = tags
+        self.matrix = matrix
+        self.model = model
+
+    @classmethod
+    def load(cls, path: str = SCENE_TAG_INDEX) -> "TagIndex":
+        """
+        Loads a saved index, memory-mapping the matrix read-only.
+        """
+        with open(path + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = np.load(path + ".npy", mmap_mode="r")
+        return cls(meta["tags"], matrix, meta["model"])
+
+    def save(self, path: str = SCENE_TAG_INDEX):
+        """
+        Writes the matrix and its metadata, replacing any previous index.
+        """
+        np.save(path + ".tmp.npy", np.ascontiguousarray(self.matrix, dtype=np.float32))
+        with open(path + ".tmp.json", "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "tags": self.tags}, f)
+        os.replace(path + ".tmp.npy", path + ".npy")
+        os.replace(path + ".tmp.json", path + ".json")
+
+    def top_k(self, image_features: np.ndarray, k: int = SCENE_TAG_TOP_K,
+              min_score: float = SCENE_TAG_MIN_SCORE) -> List[List[Tuple[str, float]]]:
+        """
+        Scores a batch of images against every tag with one matrix multiply.
+
+        Args:
+            image_features (np.ndarray): L2-normalized image embeddings of
+                shape (batch, dim).
+            k (int): Most tags returned per image.
+            min_score (float): Tags scoring below this are dropped.
+
+        Returns:
+            List[List[Tuple[str, float]]]: Per image, (tag, score) pairs, best first.
+        """
+        scores = np.asarray(image_features, dtype=np.float32) @ self.matrix.T
+        k = min(k, len(self.tags))
+        if k <= 0:
+            return [[] for _ in range(scores.shape[0])]
+        # argpartition finds the k best in O(tags); only those k get sorted.
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        return [
+            [(self.tags[i], float(score)) for i, score in zip(row, row_scores) if score >= min_score]
+            for row, row_scores in zip(best, best_scores)
+        ]
+
+
+_model_lock = threading.Lock()
+_model = None
+_preprocess = None
+_device = None
+
+_index_lock = threading.Lock()
+_index = None
+
+
+def load_model():
+    """
+    Loads the CLIP model once and returns (model, preprocess, device).
+    """
+    global _model, _preprocess, _device
+    with _model_lock:
+        if _model is None:
+            import clip
+            import torch
+            _device = "cuda" if torch.cuda.is_available() else "cpu"
+            _model, _preprocess = clip.load(SCENE_TAG_MODEL, device=_device)
+            _model.eval()
+    return _model, _preprocess, _device
+
+
+def load_vocabulary(path: str = SCENE_TAG_VOCAB) -> List[str]:
+    """
+    Reads one tag per line (blank lines and "#" comments are skipped), or
+    returns DEFAULT_TAGS when no path is given.
+    """
+    if not path:
+        return list(DEFAULT_TAGS)
+    with open(path, encoding="utf-8") as f:
+        tags = [line.strip() for line in f]
+    return list(dict.fromkeys(tag for tag in tags if tag and not tag.startswith("#")))
+
+
+def build_index(tags: List[str]) -> TagIndex:
+    """
+    Encodes every tag with CLIP and returns the normalized index.
+    """
+    import clip
+    import torch
+
+    model, _, device = load_model()
+    rows = []
+    with torch.no_grad():
+        for start in range(0, len(tags), BUILD_BATCH_SIZE):
+            tokens = clip.tokenize(tags[start:start + BUILD_BATCH_SIZE]).to(device)
+            features = model.encode_text(tokens).float()
+            features /= features.norm(dim=-1, keepdim=True)
+            rows.append(features.cpu().numpy())
+    return TagIndex(tags, np.concatenate(rows).astype(np.float32), SCENE_TAG_MODEL)
+
+
+def get_index() -> TagIndex:
+    """
+    Returns the shared index, loading it from disk, or building and saving it
+    when it is missing or was built for another vocabulary or model.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            tags = load_vocabulary()
+            try:
+                index = TagIndex.load()
+            except (OSError, ValueError, KeyError):
+                index = None
+            if index is None or index.tags != tags or index.model != SCENE_TAG_MODEL:
+                index = build_index(tags)
+                index.save()
+                index = TagIndex.load()
+            _index = index
+    return _index
+
+
+def warmup():
+    """
+    Loads CLIP and the tag index now instead of on the first image.
+    """
+    load_model()
+    get_index()
+
+
+def _open_image(image: Union[str, bytes]) -> Image.Image:
+    if isinstance(image, (bytes, bytearray)):
+        image = io.BytesIO(image)
+    img = Image.open(image)
+    # CLIP looks at 224x224; let the JPEG decoder skip most of the pixels.
+    img.draft("RGB", (448, 448))
+    return img.convert("RGB")
+
+
+def encode_images(images: List[Union[str, bytes]]) -> np.ndarray:
+    """
+    Encodes a batch of images (paths or raw bytes) into normalized CLIP
+    embeddings with one forward pass.
+    """
+    import torch
+
+    model, preprocess, device = load_model()
+    batch = torch.stack([preprocess(_open_image(image)) for image in images]).to(device)
+    with torch.no_grad():
+        features = model.encode_image(batch).float()
+    features /= features.norm(dim=-1, keepdim=True)
+    return features.cpu().numpy()
+
+
+def tag_images(images: List[Union[str, bytes]], k: int = SCENE_TAG_TOP_K,
+               min_score: float = SCENE_TAG_MIN_SCORE) -> List[List[str]]:
+    """
+    Returns the top scene tags for each image in a batch.
+
+    Args:
+        images (List[str | bytes]): Image paths or raw bytes.
+        k (int): Most tags per image.
+        min_score (float): Lowest cosine similarity kept.
+
+    Returns:
+        List[List[str]]: Tags per image, best first.
+    """
+    if not images:
+        return []
+    ranked = get_index().top_k(encode_images(images), k, min_score)
+    return [[tag for tag, _ in tags] for tags in ranked]
+
+
+def tag_image(image: Union[str, bytes], k: int = SCENE_TAG_TOP_K,
+              min_score: float = SCENE_TAG_MIN_SCORE) -> List[str]:
+    """
+    Returns the top scene tags for one image (path or raw bytes).
+    """
+    return tag_images([image], k, min_score)[0]
+
+
+def scene_context(tags: List[str]) -> Optional[str]:
+    """
+    Formats tags as a line of extra caption context, or None without tags.
+    """
+    if not tags:
+        return None
+    return "Scene: " + ", ".join(tags)
+
+
+def benchmark(vocab_sizes=(22, 1000, 10000), batch_sizes=(1, 32), dim: int = 512,
+              seconds: float = 1.0) -> List[dict]:
+    """
+    Measures top-k scoring throughput on random normalized embeddings, so it
+    runs without CLIP. "tag_scores_per_sec" counts image-tag pairs scored.
+    """
+    rng = np.random.default_rng(0)
+    results = []
+    for vocab_size in vocab_sizes:
+        matrix = rng.standard_normal((vocab_size, dim), dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        index = TagIndex([f"tag {i}" for i in range(vocab_size)], matrix)
+        for batch_size in batch_sizes:
+            features = rng.standard_normal((batch_size, dim), dtype=np.float32)
+            features /= np.linalg.norm(features, axis=1, keepdims=True)
+            runs = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                index.top_k(features, min_score=-1.0)
+                runs += 1
+            elapsed = time.perf_counter() - start
+            results.append({
+                "tags": vocab_size,
+                "batch": batch_size,
+                "images_per_sec": runs * batch_size / elapsed,
+                "tag_scores_per_sec": runs * batch_size * vocab_size / elapsed,
+            })
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    args = sys.argv[1:]
+    if args[:1] == ["build"]:
+        vocabulary = load_vocabulary(args[1] if len(args) > 1 else SCENE_TAG_VOCAB)
+        start = time.time()
+        build_index(vocabulary).save()
+        print(f"Encoded {len(vocabulary)} tags in {time.time() - start:.1f}s -> {SCENE_TAG_INDEX}.npy")
+    elif args[:1] == ["bench"]:
+        for row in benchmark():
+            print(f"{row['tags']:>6} tags, batch {row['batch']:>3}: "
+                  f"{row['images_per_sec']:>10.0f} images/sec, {row['tag_scores_per_sec']:>14,.0f} tags/sec")
+    else:
+        start = time.time()
+        for path, tags in zip(args, tag_images(args)):
+            print(path, "->", tags)
+        print(f"Tagged {len(args)} images in {time.time() - start:.2f}s")
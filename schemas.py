@@ -0,0 +1,45 @@
+"""
+schemas.py
+
+Request and response schemas of the JSON API (/generate).
+"""
+
+from typing import Dict, List
+
+from fastapi import Form
+from pydantic import BaseModel, Field
+
+
+class GenerateRequest(BaseModel):
+    """
+    Optional caption context sent alongside the image (as form fields, since
+    the image itself is a multipart file).
+    """
+    location: str = Field("", description="Where the photo was taken.")
+    tone: str = Field("", description="Desired tone, e.g. 'playful'.")
+    additional_context: str = Field("", description="Anything else the caption should reflect.")
+    fresh: bool = Field(False, description="Bypass the caption cache and ask the model for a new caption.")
+
+    @classmethod
+    def as_form(
+        cls,
+        location: str = Form(""),
+        tone: str = Form(""),
+        additional_context: str = Form(""),
+        fresh: bool = Form(False),
+    ) -> "GenerateRequest":
+        return cls(location=location, tone=tone, additional_context=additional_context, fresh=fresh)
+
+
+class GenerateResponse(BaseModel):
+    """
+    The generated caption, the image description it was based on, and how
+    long each stage took.
+    """
+    description: str = Field(..., description="The image description the caption was written from.")
+    caption: str = Field(..., description="The best caption.")
+    alternatives: List[str] = Field(
+        default_factory=list, description="Runner-up captions (only with CAPTION_CANDIDATES > 1).")
+    timings_ms: Dict[str, float] = Field(
+        ..., description="Milliseconds per stage (upload, preprocess, inference, llm, ...) and in total. "
+                         "Stages answered from a cache are absent.")
@@ -0,0 +1,185 @@
+"""
+speculation.py
+
+Speculatively drafts captions while the user is still on the context form.
+
+Most users leave the context fields blank. As soon as an image's description
+is ready, the Speculator starts a context-free caption request (plus one per
+tone in SPECULATIVE_TONES). When /generate_caption arrives with matching
+inputs, the draft is returned at once (or awaited if it is still running);
+drafts that do not match are cancelled. Finished drafts are also stored in
+the caption cache. Drafts nobody claims are dropped once the upload's analysis
+result would have expired (RESULT_STORE_TTL), as the caption request can no
+longer come.
+
+Drafts start in the web process that ran the analysis, so they are not made
+with JOB_QUEUE=1 (the workers analyse the uploads).
+
+Speculation costs LLM calls that may be thrown away, so it is off by default,
+capped at SPECULATIVE_MAX_IN_FLIGHT concurrent calls, and runs at background
+priority in the LLM admission queue.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from admission import background
+from caption_cache import caption_cache
+from caption_generator import caption_key, fetch_caption
+from result_store import RESULT_STORE_TTL
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# SPECULATIVE_CAPTIONS       - set to 1 to enable speculation.
+# SPECULATIVE_TONES          - comma-separated extra tones to draft, e.g. "funny,chill".
+# SPECULATIVE_MAX_IN_FLIGHT  - most speculative LLM calls running at once.
+# SPECULATIVE_MAX_UPLOADS    - uploads whose drafts are tracked before the oldest are dropped.
+# ------------------------------------------------------------------------------
+SPECULATIVE_CAPTIONS = os.getenv("SPECULATIVE_CAPTIONS", "0") == "1"
+SPECULATIVE_TONES = [tone.strip() for tone in os.getenv("SPECULATIVE_TONES", "").split(",") if tone.strip()]
+SPECULATIVE_MAX_IN_FLIGHT = int(os.getenv("SPECULATIVE_MAX_IN_FLIGHT", "16"))
+SPECULATIVE_MAX_UPLOADS = int(os.getenv("SPECULATIVE_MAX_UPLOADS", "1000"))
+
+
+class Speculator:
+    """
+    Tracks speculative caption drafts per upload uid. Must be used from a
+    single event loop.
+    """
+
+    def __init__(self, enabled: bool = SPECULATIVE_CAPTIONS, tones: list = SPECULATIVE_TONES,
+                 max_in_flight: int = SPECULATIVE_MAX_IN_FLIGHT, max_uploads: int = SPECULATIVE_MAX_UPLOADS,
+                 ttl: float = RESULT_STORE_TTL):
+        self.enabled = enabled
+        self.tones = [""] + [tone for tone in tones if tone]
+        self.max_in_flight = max_in_flight
+        self.max_uploads = max_uploads
+        self.ttl = ttl
+        # uid -> (time.monotonic() when started, {caption key: asyncio.Task}),
+        # oldest first
+        self._drafts = OrderedDict()
+        self._in_flight = 0
+
+        self.started = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.expired = 0
+
+    def start(self, uid: str, description: str):
+        """
+        Starts drafting captions for uid's description, within the budget.
+        """
+        if not self.enabled:
+            return
+        self._expire()
+        drafts = {}
+        for tone in self.tones:
+            if self._in_flight >= self.max_in_flight:
+                self.skipped += 1
+                continue
+            key = caption_key(description, tone=tone)
+            task = asyncio.ensure_future(self._draft(key, description, tone))
+            # Counted from scheduling (not from when the task first runs), so
+            # the check above sees the drafts started in this same call.
+            self._in_flight += 1
+            task.add_done_callback(self._finished)
+            drafts[key] = task
+            self.started += 1
+        if not drafts:
+            return
+        self._drafts[uid] = (time.monotonic(), drafts)
+        while len(self._drafts) > self.max_uploads:
+            _, (_, stale) = self._drafts.popitem(last=False)
+            self._cancel(stale.values())
+
+    async def claim(self, uid: str, description: str, location: str = "", tone: str = "",
+                    additional_context: str = "") -> Optional[str]:
+        """
+        Returns the draft matching the submitted inputs, awaiting it if it is
+        still running, and cancels uid's other drafts.
+
+        Returns:
+            Optional[str]: The draft caption, or None if there is no usable draft.
+        """
+        self._expire()
+        _, drafts = self._drafts.pop(uid, (None, None))
+        if not drafts:
+            return None
+        key = caption_key(description, location, tone, additional_context)
+        task = drafts.pop(key, None)
+        self._cancel(drafts.values())
+        if task is None:
+            self.misses += 1
+            return None
+        try:
+            caption = await task
+        except Exception:
+            # The draft failed or was cancelled; let the caller ask normally.
+            self.misses += 1
+            return None
+        self.hits += 1
+        return caption
+
+    def discard(self, uid: str):
+        """
+        Cancels every draft for uid (e.g. when the user asked for a fresh caption).
+        """
+        _, drafts = self._drafts.pop(uid, (None, None))
+        if drafts:
+            self._cancel(drafts.values())
+
+    def stats(self) -> dict:
+        """
+        Returns draft counters and the hit rate of claimed drafts.
+        """
+        claimed = self.hits + self.misses
+        return {
+            "started": self.started,
+            "skipped_over_budget": self.skipped,
+            "hits": self.hits,
+            "misses": self.misses,
+            "cancelled": self.cancelled,
+            "expired": self.expired,
+            "hit_rate": self.hits / claimed if claimed else 0.0,
+            "in_flight": self._in_flight,
+            "uploads_tracked": len(self._drafts),
+        }
+
+    async def _draft(self, key: tuple, description: str, tone: str) -> str:
+        with background():
+            caption = await fetch_caption(description, tone=tone)
+        caption_cache.put(key, caption)
+        return caption
+
+    def _finished(self, task: asyncio.Task):
+        # Runs when a draft completes, fails or is cancelled (even before it started).
+        self._in_flight -= 1
+
+    def _expire(self):
+        # Drops the drafts of uploads whose analysis result has expired.
+        deadline = time.monotonic() - self.ttl
+        while self._drafts:
+            started_at, drafts = next(iter(self._drafts.values()))
+            if started_at > deadline:
+                break
+            self._drafts.popitem(last=False)
+            self.expired += 1
+            self._cancel(drafts.values())
+
+    def _cancel(self, tasks):
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                self.cancelled += 1
+            else:
+                # Retrieve the outcome so a failed draft does not log a warning.
+                task.cancelled() or task.exception()
+
+
+# Shared instance used by the app.
+speculator = Speculator()
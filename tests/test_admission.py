@@ -0,0 +1,109 @@
+"""
+Tests for admission.py: priority ordering, early rejection when the queue is
+full, and pausing a provider after Retry-After. Also checks that feedback is
+recorded when the alternative prompts are refused.
+"""
+
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as caption_app
+from admission import BACKGROUND, INTERACTIVE, Overloaded, ProviderLimiter
+
+
+def limiter(**kwargs) -> ProviderLimiter:
+    # 20 calls per second with room for one at a time, so calls queue.
+    return ProviderLimiter("test", requests_per_minute=1200, burst_seconds=0.01, **kwargs)
+
+
+async def admit_in_order(provider: ProviderLimiter, priorities: list) -> list:
+    order = []
+
+    async def call(name: str, priority: int):
+        await provider.acquire_async(priority=priority)
+        order.append(name)
+
+    provider.acquire()  # empties the bucket
+    tasks = []
+    for name, priority in priorities:
+        tasks.append(asyncio.ensure_future(call(name, priority)))
+        await asyncio.sleep(0)  # queued in this order
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_interactive_calls_go_ahead_of_background_work():
+    order = asyncio.run(admit_in_order(limiter(), [
+        ("background-1", BACKGROUND), ("background-2", BACKGROUND),
+        ("interactive-1", INTERACTIVE), ("interactive-2", INTERACTIVE)]))
+    assert order == ["interactive-1", "interactive-2", "background-1", "background-2"]
+
+
+def test_full_queue_is_refused_up_front():
+    async def run():
+        provider = limiter(max_queue=2, background_queue=1)
+        provider.acquire()
+        waiting = [asyncio.ensure_future(provider.acquire_async(priority=BACKGROUND))]
+        await asyncio.sleep(0)
+        # The background share is used up, interactive calls still fit.
+        with pytest.raises(Overloaded):
+            provider.check(BACKGROUND)
+        provider.check(INTERACTIVE)
+        waiting.append(asyncio.ensure_future(provider.acquire_async(priority=INTERACTIVE)))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as refused:
+            await provider.acquire_async(priority=INTERACTIVE)
+        assert refused.value.retry_after >= 1.0
+        await asyncio.gather(*waiting)
+        return provider.stats()
+
+    stats = asyncio.run(run())
+    assert stats["rejected"] == 2
+    assert stats["admitted"] == 3
+
+
+def test_projected_wait_beyond_max_wait_is_refused():
+    provider = ProviderLimiter("test", requests_per_minute=6, burst_seconds=0.01, max_wait=1.0)
+    provider.acquire()
+    with pytest.raises(Overloaded) as refused:
+        provider.check()
+    assert refused.value.retry_after > 1.0
+
+
+def test_pause_holds_back_every_call():
+    provider = ProviderLimiter("test", max_wait=5.0)
+    provider.pause(0.3)
+    assert provider.stats()["paused_seconds"] > 0.2
+    start = time.monotonic()
+    provider.acquire()
+    assert time.monotonic() - start >= 0.25
+    assert provider.stats()["throttled"] == 1
+
+
+def test_pause_longer_than_max_wait_is_refused():
+    provider = ProviderLimiter("test", max_wait=1.0)
+    provider.pause(30)
+    with pytest.raises(Overloaded) as refused:
+        provider.check()
+    assert refused.value.retry_after >= 29
+
+
+@pytest.mark.parametrize("path", ["/feedback", "/feedback_stream"])
+def test_feedback_is_recorded_when_alternatives_are_refused(path, monkeypatch):
+    paused = ProviderLimiter("llm", max_wait=1.0)
+    paused.pause(30)
+    monkeypatch.setattr(caption_app, "llm_limiter", paused)
+    records = []
+    monkeypatch.setattr(caption_app.feedback_log, "append", records.append)
+
+    with TestClient(caption_app.app) as client:
+        response = client.post(path, data={"final_caption": "Golden hour", "feedback": "Too plain.",
+                                           "accepted": "true"})
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    assert len(records) == 1
+    assert records[0]["feedback"] == "Too plain." and records[0]["accepted"] is True
+    assert records[0]["alternatives"] == []
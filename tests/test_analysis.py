@@ -0,0 +1,45 @@
+"""
+Tests for analysis.py's scene tagging: tags are cached per image, reused by
+near-duplicates, and a tagging failure is logged without failing the request.
+"""
+
+import logging
+
+import pytest
+
+import analysis
+from description_cache import DescriptionCache
+
+
+@pytest.fixture
+def tagger(monkeypatch):
+    calls = []
+
+    def tag_image(image):
+        calls.append(image)
+        if image == b"broken":
+            raise RuntimeError("CLIP is not installed")
+        return ["a calm beach scene"]
+
+    monkeypatch.setattr(analysis, "scene_tag_cache", DescriptionCache(cache_dir=None), raising=False)
+    monkeypatch.setattr(analysis, "tag_image", tag_image, raising=False)
+    monkeypatch.setattr(analysis, "scene_context", lambda tags: "Scene: " + ", ".join(tags), raising=False)
+    return calls
+
+
+def test_scene_tags_are_cached_by_image(tagger):
+    description = analysis.add_scene_tags("a dog", b"image", key="a")
+    assert description == "a dog\nScene: a calm beach scene"
+    assert analysis.add_scene_tags("a dog", b"image", key="a") == description
+    # A near-duplicate reuses the tags of the upload it matched.
+    assert analysis.add_scene_tags("a dog", b"copy", key="b", match_key="a") == description
+    assert tagger == [b"image"]
+
+
+def test_scene_tagging_failure_is_logged(tagger, caplog):
+    with caplog.at_level(logging.WARNING, logger="analysis"):
+        assert analysis.add_scene_tags("a dog", b"broken", key="c") == "a dog"
+    assert "Scene tagging failed: CLIP is not installed" in caplog.text
+    # Nothing was cached, so the next upload tries again.
+    analysis.add_scene_tags("a dog", b"broken", key="c")
+    assert tagger == [b"broken", b"broken"]
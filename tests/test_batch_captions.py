@@ -0,0 +1,57 @@
+"""
+Tests for /batch_captions: per-image failures are reported in "error", and
+per-image context overrides the shared fields.
+"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as caption_app
+from admission import Overloaded
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(caption_app, "describe_bytes", lambda data: f"an image of {len(data)} bytes")
+    with TestClient(caption_app.app) as client:
+        yield client
+
+
+def post_batch(client: TestClient, count: int, **fields) -> list:
+    files = [("files", (f"{i}.png", b"x" * (i + 1), "image/png")) for i in range(count)]
+    response = client.post("/batch_captions", files=files, data=fields)
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    return sorted(results, key=lambda result: result["index"])
+
+
+def test_caption_failures_are_reported_per_image(client, monkeypatch):
+    async def caption(description, location="", tone="", additional_context="", fresh=False):
+        if description.endswith("2 bytes"):
+            raise RuntimeError("upstream returned 500")
+        if description.endswith("3 bytes"):
+            raise Overloaded("llm", 2.0)
+        return "Golden hour with the best crew"
+
+    monkeypatch.setattr(caption_app, "cached_caption", caption)
+    ok, failed, refused = post_batch(client, 3)
+    assert ok["caption"] == "Golden hour with the best crew" and ok["error"] is None
+    assert failed["caption"] is None and "upstream returned 500" in failed["error"]
+    assert refused["caption"] is None and "overloaded" in refused["error"]
+    assert failed["description"] == "an image of 2 bytes"
+
+
+def test_null_context_values_are_skipped(client, monkeypatch):
+    seen = []
+
+    async def caption(description, location="", tone="", additional_context="", fresh=False):
+        seen.append((location, tone))
+        return "Pasta night done right"
+
+    monkeypatch.setattr(caption_app, "cached_caption", caption)
+    contexts = json.dumps([{"tone": None, "location": "Rome"}])
+    result, = post_batch(client, 1, tone="playful", contexts=contexts)
+    assert result["caption"] == "Pasta night done right"
+    assert seen == [("Rome", "playful")]
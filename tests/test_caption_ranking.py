@@ -0,0 +1,90 @@
+"""
+Tests for caption_ranking.py and caption_generator.parse_alternatives:
+list-marker cleaning, preamble filtering, dedup and MMR ordering.
+"""
+
+import pytest
+
+from caption_generator import parse_alternatives
+from caption_ranking import clean_candidate, is_preamble, quality_score, rank_captions
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("1. Golden hour with the best crew", "Golden hour with the best crew"),
+    ("2) Golden hour with the best crew", "Golden hour with the best crew"),
+    ("- Golden hour with the best crew", "Golden hour with the best crew"),
+    ("* \"Golden hour with the best crew\"", "Golden hour with the best crew"),
+    ("Caption 2: Golden hour with the best crew", "Golden hour with the best crew"),
+    ("Option 1 - Golden hour with the best crew", "Golden hour with the best crew"),
+    ("  3.  “Golden hour with the best crew”  ", "Golden hour with the best crew"),
+])
+def test_list_markers_and_labels_are_removed(line, expected):
+    assert clean_candidate(line) == expected
+
+
+@pytest.mark.parametrize("caption", [
+    "2.5 miles of coastline, zero regrets",
+    "3.14 reasons to love pie night",
+    "24/7 beach mode activated",
+    "1st place vibes all weekend long",
+    "100% that golden hour glow",
+])
+def test_leading_numbers_in_captions_are_kept(caption):
+    assert clean_candidate(caption) == caption
+
+
+def test_preamble_lines_are_dropped():
+    reply = ("Here are three new prompts:\n"
+             "\n"
+             "1. Chasing light with my favorite people\n"
+             "2. Sun-kissed and carefree all day\n"
+             "3. 2.5 miles of coastline, zero regrets\n")
+    assert is_preamble("Here are three new prompts:")
+    assert not is_preamble("Chasing light with my favorite people")
+    assert parse_alternatives(reply) == [
+        "Chasing light with my favorite people",
+        "Sun-kissed and carefree all day",
+        "2.5 miles of coastline, zero regrets",
+    ]
+
+
+def test_duplicates_differing_in_case_and_punctuation_count_once():
+    ranked = rank_captions([
+        "1. Golden hour with the best crew",
+        "golden hour with the best crew!",
+        "\"Golden Hour, with the best crew.\"",
+        "Sunset chases and sandy paws today",
+    ])
+    assert len(ranked) == 2
+    assert ranked.count("Golden hour with the best crew") == 1
+
+
+def test_quality_prefers_the_target_length_without_emojis_or_hashtags():
+    assert quality_score("Golden hour with the best crew") == 1.0
+    assert quality_score("Golden hour") < quality_score("Golden hour with the best crew")
+    assert quality_score("Golden hour with the best crew #sunset") < 1.0
+    assert quality_score("Golden hour with the best crew \U0001F305") < 1.0
+    ranked = rank_captions(["Golden hour with the best crew #sunset", "Sunset chases and sandy paws today",
+                            "Sunset"])
+    assert ranked[0] == "Sunset chases and sandy paws today"
+    assert ranked[-1] == "Sunset"
+
+
+def test_mmr_puts_a_different_caption_before_a_near_copy():
+    candidates = [
+        "Golden hour with the best crew",
+        "Golden hour with the best crew ever",
+        "Sunset chases and sandy paws today",
+    ]
+    assert rank_captions(candidates) == [
+        "Golden hour with the best crew",
+        "Sunset chases and sandy paws today",
+        "Golden hour with the best crew ever",
+    ]
+    # Without the diversity penalty the near copy comes second.
+    assert rank_captions(candidates, diversity=0.0)[1] == "Golden hour with the best crew ever"
+
+
+def test_k_limits_the_result():
+    assert rank_captions(["one two three four five", "six seven eight nine ten", "a b c d e"], k=2) == [
+        "one two three four five", "six seven eight nine ten"]
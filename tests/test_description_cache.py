@@ -0,0 +1,81 @@
+"""
+Tests for description_cache.py: the memory LRU, TTL expiry, and the disk
+tier shared by several processes (modelled as several cache instances on
+one directory).
+"""
+
+import os
+
+from description_cache import DescriptionCache
+
+
+def directory_bytes(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.name.endswith(".txt"))
+
+
+def test_memory_tier_evicts_the_least_recently_used():
+    cache = DescriptionCache(max_entries=2, cache_dir=None)
+    cache.put("a", "first")
+    cache.put("b", "second")
+    assert cache.get("a") == "first"
+    cache.put("c", "third")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "first"
+    assert cache.get("c") == "third"
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"], stats["memory_entries"]) == (3, 1, 2)
+
+
+def test_entries_expire_after_the_ttl(tmp_path):
+    cache = DescriptionCache(cache_dir=str(tmp_path), ttl=60)
+    cache.put("a", "first")
+    os.utime(tmp_path / "a.txt", (0, 0))
+    cache._memory["a"] = ("first", 0.0)
+    assert cache.get("a") is None
+    assert not (tmp_path / "a.txt").exists()
+
+
+def test_disk_tier_outlives_the_memory_tier(tmp_path):
+    cache = DescriptionCache(max_entries=1, cache_dir=str(tmp_path))
+    cache.put("a", "first")
+    cache.put("b", "second")
+    assert cache.get("a") == "first"
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_entries_written_by_another_process_are_found(tmp_path):
+    writer = DescriptionCache(cache_dir=str(tmp_path))
+    reader = DescriptionCache(cache_dir=str(tmp_path))
+    writer.put("a", "first")
+
+    assert reader.get("a") == "first"
+    assert reader.stats()["disk_hits"] == 1
+    assert reader.stats()["disk_entries"] == 1
+
+
+def test_size_bound_covers_every_process(tmp_path):
+    budget = 1000
+    workers = [DescriptionCache(cache_dir=str(tmp_path), disk_max_bytes=budget, disk_scan_interval=0)
+               for _ in range(4)]
+    for i in range(40):
+        workers[i % len(workers)].put(f"key{i}", "x" * 100)
+        assert directory_bytes(str(tmp_path)) <= budget
+
+    # The newest entries survive on disk, whoever wrote them.
+    reader = DescriptionCache(cache_dir=str(tmp_path))
+    assert reader.get("key39") == "x" * 100
+    assert reader.get("key0") is None
+
+
+def test_near_duplicate_hits_are_counted_separately():
+    cache = DescriptionCache(cache_dir=None)
+    cache.put("original", "a dog on a beach")
+    assert cache.get("copy", count_miss=False) is None
+    assert cache.get_near_duplicate("original") == "a dog on a beach"
+    assert cache.get_near_duplicate("unknown") is None
+
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["near_duplicate_hits"], stats["misses"]) == (0, 1, 0)
+    cache.count_miss()
+    assert cache.stats()["misses"] == 1
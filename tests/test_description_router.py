@@ -0,0 +1,132 @@
+"""
+Tests for description_router.py: the circuit breaker and its half-open
+trial, backend ranking, hedging and failover.
+"""
+
+import threading
+import time
+
+import pytest
+
+from description_router import Backend, DescriptionRouter, NoBackendAvailable
+
+
+def fixed(text: str, seconds: float = 0.0):
+    def describe(image):
+        time.sleep(seconds)
+        return text
+    return describe
+
+
+def broken(image):
+    raise RuntimeError("backend down")
+
+
+def test_breaker_opens_after_consecutive_failures():
+    backend = Backend("b", broken, breaker_failures=3, breaker_cooldown=60)
+    for _ in range(2):
+        backend.record_failure()
+    assert backend.available()
+    backend.record_success(0.1)
+    # A success resets the count.
+    for _ in range(2):
+        backend.record_failure()
+    assert backend.available()
+    backend.record_failure()
+    assert not backend.available()
+    assert backend.stats()["breaker_open"]
+
+
+def test_half_open_lets_exactly_one_trial_through():
+    backend = Backend("b", broken, breaker_failures=1, breaker_cooldown=0.05)
+    backend.record_failure()
+    assert not backend.available()
+    time.sleep(0.06)
+    assert backend.available()
+    # Only one trial at a time while it runs.
+    assert not backend.available()
+
+    # A failed trial reopens the breaker for another cooldown.
+    backend.record_failure()
+    assert not backend.available()
+    time.sleep(0.06)
+    assert backend.available()
+    backend.record_success(0.1)
+    assert backend.available() and backend.available()
+    assert not backend.stats()["breaker_open"]
+
+
+def test_trial_refused_by_the_limiter_is_released():
+    backend = Backend("b", broken, breaker_failures=1, breaker_cooldown=0.0)
+    backend.record_failure()
+    assert backend.available()
+    assert not backend.available()
+    backend.release_trial()
+    assert backend.available()
+
+
+def test_ranking_puts_measured_backends_first():
+    new = Backend("new", fixed("new"))
+    slow = Backend("slow", fixed("slow"))
+    fast = Backend("fast", fixed("fast"))
+    other_new = Backend("other-new", fixed("other"))
+    slow.record_success(2.0)
+    fast.record_success(0.5)
+    router = DescriptionRouter([new, slow, fast, other_new])
+    assert [b.name for b in router._ranked()] == ["fast", "slow", "new", "other-new"]
+
+
+def test_unmeasured_backends_keep_their_configured_order():
+    router = DescriptionRouter([Backend("a", fixed("a")), Backend("b", fixed("b"))])
+    assert router.describe(b"image") == "a"
+
+
+def test_fails_over_to_the_next_backend():
+    down = Backend("down", broken)
+    up = Backend("up", fixed("a photo"))
+    router = DescriptionRouter([down, up], hedge_default_delay=5)
+    for _ in range(3):
+        assert router.describe(b"image") == "a photo"
+    # After the first failover "up" has samples and "down" none, so it leads.
+    assert (down.stats()["calls"], up.stats()["calls"]) == (1, 3)
+    assert router.stats()["hedges"] == 0
+
+
+def test_open_breaker_is_skipped_even_when_fastest():
+    down = Backend("down", broken, breaker_failures=2, breaker_cooldown=60)
+    down.record_success(0.01)
+    down.record_failure()
+    down.record_failure()
+    up = Backend("up", fixed("a photo"))
+    up.record_success(1.0)
+    router = DescriptionRouter([down, up], hedge_default_delay=5)
+    assert router.describe(b"image") == "a photo"
+    assert down.stats()["calls"] == 3
+
+
+def test_raises_when_every_backend_fails():
+    router = DescriptionRouter([Backend("a", broken), Backend("b", broken)])
+    with pytest.raises(NoBackendAvailable):
+        router.describe(b"image")
+
+
+def test_slow_primary_is_hedged_and_the_winner_counted():
+    slow = Backend("slow", fixed("slow", 1.0))
+    fast = Backend("fast", fixed("fast", 0.01))
+    router = DescriptionRouter([slow, fast], hedge_default_delay=0.05)
+    start = time.perf_counter()
+    assert router.describe(b"image") == "fast"
+    assert time.perf_counter() - start < 0.5
+    assert router.stats()["hedges"] == 1
+    assert fast.stats()["hedges_won"] == 1
+
+
+def test_hedge_wins_are_counted_under_concurrency():
+    backend = Backend("b", fixed("b"))
+    threads = [threading.Thread(target=lambda: [backend.record_hedge_won() for _ in range(10_000)])
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.stats()["hedges_won"] == 80_000
@@ -0,0 +1,71 @@
+"""
+Tests for feedback_log.py: records are written in groups, drops are counted
+exactly under concurrent appends, and writer failures are logged and retried.
+"""
+
+import json
+import logging
+import threading
+
+from feedback_log import FeedbackLog, records_dropped, segment_paths
+
+
+def read_records(directory: str) -> list:
+    records = []
+    for path in segment_paths(directory):
+        with open(path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f)
+    return records
+
+
+def test_records_are_written_on_close(tmp_path):
+    log = FeedbackLog(str(tmp_path), flush_interval=3600, enabled=True)
+    for i in range(10):
+        log.append({"n": i})
+    log.close()
+    assert [record["n"] for record in read_records(str(tmp_path))] == list(range(10))
+    assert log.stats()["written"] == 10 and log.stats()["flushes"] == 1
+
+
+def test_drops_are_counted_exactly_under_concurrent_appends(tmp_path):
+    # The writer is held back, so everything beyond max_pending is dropped.
+    log = FeedbackLog(str(tmp_path), flush_records=10**9, flush_interval=3600, max_pending=100, enabled=True)
+    threads, per_thread = 8, 5000
+    before = records_dropped.value()
+
+    def append_many():
+        for i in range(per_thread):
+            log.append({"n": i})
+
+    workers = [threading.Thread(target=append_many) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    log.close()
+    dropped = records_dropped.value() - before
+    written = len(read_records(str(tmp_path)))
+    # Every record is either written or counted as dropped.
+    assert written + dropped == threads * per_thread
+    assert written >= 100
+    assert log.stats()["dropped"] == records_dropped.value()
+
+
+def test_writer_failures_are_logged_and_retried(tmp_path, caplog):
+    blocked = tmp_path / "not-a-directory"
+    blocked.write_text("")
+    log = FeedbackLog(str(blocked), flush_interval=0.01, enabled=True)
+    with caplog.at_level(logging.WARNING, logger="feedback_log"):
+        log.append({"n": 1})
+        for _ in range(200):
+            if "Feedback log write failed" in caplog.text:
+                break
+            threading.Event().wait(0.01)
+    assert "Feedback log write failed" in caplog.text
+    assert log.stats()["pending"] == 1
+
+    # Once the directory can be created the queued record is written.
+    blocked.unlink()
+    log.close()
+    assert [record["n"] for record in read_records(str(blocked))] == [1]
@@ -0,0 +1,41 @@
+"""
+Tests for feedback_stats.py: splitting segments into byte ranges must count
+every record exactly once.
+"""
+
+import json
+
+import pytest
+
+from feedback_stats import aggregate_chunk, chunks
+
+
+@pytest.fixture
+def segment(tmp_path):
+    # 100 fixed-width records, so range starts can land exactly on line starts.
+    path = tmp_path / "feedback-20260101T000000-1-0001.jsonl"
+    lines = [json.dumps({"tone": "chill", "accepted": int(i % 2 == 0), "n": f"{i:03d}"}) + "\n" for i in range(100)]
+    path.write_text("".join(lines))
+    return str(path), len(lines[0])
+
+
+@pytest.mark.parametrize("ranges", [1, 7, 10, 33, 100])
+def test_split_segment_counts_every_record_once(segment, ranges):
+    path, line_bytes = segment
+    chunk_bytes = -(-100 * line_bytes // ranges)
+    total = accepted = 0
+    for start, end in [(start, end) for _, start, end in chunks([path], chunk_bytes)]:
+        groups, malformed = aggregate_chunk((path, start, end, ("tone",), None))
+        assert malformed == 0
+        for counts in groups.values():
+            total += counts[0]
+            accepted += counts[1]
+    assert total == 100
+    assert accepted == 50
+
+
+def test_line_aligned_ranges(segment):
+    path, line_bytes = segment
+    counts = [sum(c[0] for c in aggregate_chunk((path, start, end, ("tone",), None))[0].values())
+              for _, start, end in chunks([path], 10 * line_bytes)]
+    assert counts == [10] * 10
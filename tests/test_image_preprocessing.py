@@ -0,0 +1,41 @@
+"""
+Tests for image_preprocessing.py: images are shrunk for the backend, and
+images Pillow refuses to decode are passed through untouched.
+"""
+
+import io
+
+from PIL import Image
+
+from image_preprocessing import preprocess_image
+
+
+def png(width: int, height: int) -> bytes:
+    out = io.BytesIO()
+    # Noise, so the PNG is larger than the downscaled JPEG.
+    Image.effect_noise((width, height), 64).convert("RGB").save(out, format="PNG")
+    return out.getvalue()
+
+
+def test_large_images_are_downscaled():
+    data = png(2000, 1000)
+    processed, report = preprocess_image(data, max_side=256)
+    assert report["original_size"] == (2000, 1000)
+    assert report["processed_size"] == (256, 128)
+    assert Image.open(io.BytesIO(processed)).size == (256, 128)
+
+
+def test_decompression_bombs_fall_back_to_the_original(monkeypatch):
+    # A small file that decodes to more pixels than Pillow allows.
+    data = png(400, 400)
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100 * 100 // 2)
+    processed, report = preprocess_image(data)
+    assert processed == data
+    assert report["bytes_saved"] == 0
+
+
+def test_undecodable_bytes_fall_back_to_the_original():
+    data = b"not an image"
+    processed, report = preprocess_image(data)
+    assert processed == data
+    assert report["original_size"] is None
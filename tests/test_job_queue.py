@@ -0,0 +1,155 @@
+"""
+Tests for job_queue.py and worker.py: leases, extension, expiry and reaping,
+retries with backoff, and deferral of jobs refused by admission control.
+"""
+
+import time
+
+import pytest
+
+import worker as worker_module
+from admission import Overloaded
+from job_queue import FAILED, LEASED, QUEUED, JobQueue
+from result_store import MemoryResultStore
+from worker import Worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"), lease_seconds=60, max_attempts=2, retry_backoff=10)
+
+
+def job_row(queue: JobQueue, uid: str) -> tuple:
+    return queue._conn().execute(
+        "SELECT status, attempts, available_at FROM jobs WHERE uid = ?", (uid,)).fetchone()
+
+
+def expire(queue: JobQueue, uid: str):
+    # Makes the job's lease (or retry delay) run out now.
+    queue._conn().execute(
+        "UPDATE jobs SET lease_until = ?, available_at = ? WHERE uid = ?", (time.time() - 1, 0, uid))
+
+
+def test_lease_takes_the_oldest_runnable_job_once(queue):
+    queue.enqueue("a", b"first")
+    queue.enqueue("b", b"second")
+    job = queue.lease("w1")
+    assert (job.uid, job.data, job.attempt) == ("a", b"first", 1)
+    assert queue.lease("w2").uid == "b"
+    assert queue.lease("w3") is None
+    assert queue.stats()["leased"] == 2 and queue.depth() == 0
+
+
+def test_extend_and_complete_need_the_lease(queue):
+    queue.enqueue("a", b"image")
+    queue.lease("w1")
+    assert queue.extend("a", "w1")
+    assert not queue.extend("a", "w2")
+    assert not queue.complete("a", "w2")
+    assert queue.complete("a", "w1")
+    assert queue.stats() == {"queued": 0, "leased": 0, "failed": 0, "oldest_queued_seconds": None}
+
+
+def test_expired_lease_is_leased_again_as_the_next_attempt(queue):
+    queue.enqueue("a", b"image")
+    queue.lease("w1")
+    expire(queue, "a")
+    job = queue.lease("w2")
+    assert (job.uid, job.attempt) == ("a", 2)
+    # The first worker lost its lease.
+    assert not queue.extend("a", "w1")
+    assert not queue.complete("a", "w1")
+
+
+def test_fail_retries_with_backoff_then_fails_for_good(queue):
+    queue.enqueue("a", b"image")
+    queue.lease("w1")
+    before = time.time()
+    assert queue.fail("a", "w1", "boom") == QUEUED
+    status, attempts, available_at = job_row(queue, "a")
+    assert (status, attempts) == (QUEUED, 1)
+    assert available_at >= before + queue.retry_backoff
+    # Not runnable until the backoff has passed.
+    assert queue.lease("w1") is None
+
+    expire(queue, "a")
+    job = queue.lease("w1")
+    assert job.attempt == 2
+    assert queue.fail("a", "w1", "boom again") == FAILED
+    assert job_row(queue, "a")[0] == FAILED
+    assert queue.lease("w1") is None
+    assert queue.fail("a", "w1", "late") is None
+
+
+def test_reap_fails_jobs_whose_last_lease_expired(queue):
+    queue.enqueue("a", b"image")
+    queue.enqueue("b", b"image")
+    queue.lease("w1")
+    expire(queue, "a")
+    queue.lease("w2")  # a's second and last attempt
+    queue.lease("w3")  # b, first attempt
+    expire(queue, "a")
+    expire(queue, "b")
+
+    assert queue.reap() == ["a"]
+    assert job_row(queue, "a")[0] == FAILED
+    # b still has an attempt left, so it is leased again rather than failed.
+    assert queue.lease("w4").uid == "b"
+
+
+def test_worker_retries_then_fails_and_drops_the_pending_marker(queue, monkeypatch):
+    def broken(data):
+        raise RuntimeError("backend down")
+
+    monkeypatch.setattr(worker_module, "describe_bytes", broken)
+    results = MemoryResultStore()
+    worker = Worker(queue, results)
+    queue.enqueue("a", b"image")
+    results.mark_pending("a")
+
+    worker._run(queue.lease("w1"), "w1")
+    assert (worker.retried, worker.failed) == (1, 0)
+    expire(queue, "a")
+    worker._run(queue.lease("w1"), "w1")
+    assert (worker.retried, worker.failed) == (1, 1)
+    assert results.status("a") is None
+
+
+def test_worker_stores_the_description(queue, monkeypatch):
+    monkeypatch.setattr(worker_module, "describe_bytes", lambda data: "a dog on a beach")
+    results = MemoryResultStore()
+    worker = Worker(queue, results)
+    queue.enqueue("a", b"image")
+    worker._run(queue.lease("w1"), "w1")
+    assert results.get("a") == "a dog on a beach"
+    assert worker.completed == 1 and job_row(queue, "a") is None
+
+
+def test_overloaded_jobs_are_deferred_without_using_an_attempt(queue, monkeypatch):
+    def overloaded(data):
+        raise Overloaded("hf", 30.0)
+
+    monkeypatch.setattr(worker_module, "describe_bytes", overloaded)
+    results = MemoryResultStore()
+    worker = Worker(queue, results)
+    queue.enqueue("a", b"image")
+    results.mark_pending("a")
+
+    for _ in range(3):
+        job = queue.lease("w1")
+        assert job is not None and job.attempt == 1
+        worker._run(job, "w1")
+        status, attempts, available_at = job_row(queue, "a")
+        assert (status, attempts) == (QUEUED, 0)
+        # Deferred for the Retry-After; make it runnable again for the next round.
+        expire(queue, "a")
+
+    assert worker.deferred == 3 and worker.retried == 0 and worker.failed == 0
+    assert results.status("a") is not None
+
+
+def test_defer_needs_the_lease(queue):
+    queue.enqueue("a", b"image")
+    queue.lease("w1")
+    assert not queue.defer("a", "w2", 5.0)
+    assert job_row(queue, "a")[0] == LEASED
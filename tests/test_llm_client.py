@@ -0,0 +1,64 @@
+"""
+Tests for llm_client.py against the local provider stubs: retries on 429,
+and the in-flight concurrency limit.
+"""
+
+import asyncio
+
+import pytest
+
+from admission import ProviderLimiter
+from llm_client import LLMClient, LLMError
+from provider_stubs import ProviderProfile, StubServer
+
+MESSAGES = [{"role": "user", "content": "Write a caption."}]
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(llm: ProviderProfile) -> StubServer:
+        server = StubServer(ProviderProfile(), llm, port=0).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def make_client(server: StubServer, **kwargs) -> LLMClient:
+    # An unlimited limiter of its own, so the shared admission state is untouched.
+    return LLMClient(api_key="test", base_url=f"{server.url}/v1", backoff_base=0.01,
+                     limiter=ProviderLimiter("test"), **kwargs)
+
+
+async def call(client: LLMClient, count: int = 1) -> list:
+    try:
+        return await asyncio.gather(*(client.chat_completion(MESSAGES, model="stub") for _ in range(count)))
+    finally:
+        await client.aclose()
+
+
+def test_retries_rate_limited_calls(stub_server):
+    server = stub_server(ProviderProfile(fail_first=2))
+    body, = asyncio.run(call(make_client(server, max_retries=3)))
+    assert body["choices"][0]["message"]["content"]
+    assert server.calls["llm"] == 3
+    assert server.calls["llm_errors"] == 2
+
+
+def test_gives_up_after_max_retries(stub_server):
+    server = stub_server(ProviderProfile(fail_first=10))
+    with pytest.raises(LLMError) as error:
+        asyncio.run(call(make_client(server, max_retries=2)))
+    assert error.value.status_code == 429
+    assert server.calls["llm"] == 3
+
+
+def test_concurrency_limit(stub_server):
+    server = stub_server(ProviderProfile(latency=0.1))
+    bodies = asyncio.run(call(make_client(server, max_concurrency=3), count=12))
+    assert len(bodies) == 12
+    assert server.llm_max_in_flight == 3
@@ -0,0 +1,112 @@
+"""
+Tests for near_duplicates.py: the multi-index hash table, its LRU bound,
+the featureless-hash filter, and dhash on images Pillow refuses to decode.
+"""
+
+import io
+import random
+
+from PIL import Image
+
+from near_duplicates import NearDuplicateIndex, dhash, hamming, informative
+
+
+def flip(image_hash: int, *bits: int) -> int:
+    for bit in bits:
+        image_hash ^= 1 << bit
+    return image_hash
+
+
+def test_lookup_within_max_distance():
+    index = NearDuplicateIndex(max_distance=4, max_entries=100)
+    stored = 0x0123456789ABCDEF
+    index.add(stored, "a")
+
+    assert index.lookup(stored) == ("a", stored, 0)
+    # Four flipped bits, all in the same 16-bit chunk or spread across chunks.
+    for bits in [(0, 1, 2, 3), (0, 16, 32, 48), (5, 21, 22, 63)]:
+        query = flip(stored, *bits)
+        assert index.lookup(query) == ("a", stored, 4)
+
+
+def test_lookup_beyond_max_distance_misses():
+    index = NearDuplicateIndex(max_distance=4, max_entries=100)
+    stored = 0x0123456789ABCDEF
+    index.add(stored, "a")
+    assert index.lookup(flip(stored, 0, 1, 16, 17, 32)) is None
+    assert index.stats()["misses"] == 1
+
+
+def test_lookup_returns_the_closest_match():
+    index = NearDuplicateIndex(max_distance=8, max_entries=100)
+    stored = 0x0F0F0F0F0F0F0F0F
+    index.add(flip(stored, 0, 1, 2), "far")
+    index.add(flip(stored, 40), "near")
+    value, matched, distance = index.lookup(stored)
+    assert (value, distance) == ("near", 1)
+    assert hamming(matched, stored) == 1
+
+
+def test_lookup_matches_a_brute_force_scan():
+    rng = random.Random(0)
+    index = NearDuplicateIndex(max_distance=4, max_entries=10_000)
+    stored = [rng.getrandbits(64) for _ in range(2000)]
+    for i, image_hash in enumerate(stored):
+        index.add(image_hash, str(i))
+    for _ in range(200):
+        query = flip(rng.choice(stored), *rng.sample(range(64), rng.randrange(7)))
+        expected = min((hamming(query, image_hash) for image_hash in stored))
+        match = index.lookup(query)
+        if expected <= 4:
+            assert match is not None and match[2] == expected
+        else:
+            assert match is None
+
+
+def test_evicts_the_least_recently_used_hash():
+    index = NearDuplicateIndex(max_distance=4, max_entries=3)
+    hashes = [0x1111 << 48, 0x2222 << 32, 0x3333 << 16, 0x4444]
+    for i, image_hash in enumerate(hashes[:3]):
+        index.add(image_hash, str(i))
+    # Using the oldest entry makes the second one the least recently used.
+    assert index.lookup(hashes[0])[0] == "0"
+    index.add(hashes[3], "3")
+
+    assert len(index) == 3
+    assert index.lookup(hashes[1]) is None
+    assert [index.lookup(h)[0] for h in (hashes[0], hashes[2], hashes[3])] == ["0", "2", "3"]
+    # Evicted hashes are gone from the chunk tables as well.
+    assert all(hashes[1] not in bucket for table in index._buckets for bucket in table.values())
+
+
+def test_remove_forgets_a_hash():
+    index = NearDuplicateIndex(max_distance=4, max_entries=10)
+    index.add(0xABCDEF, "a")
+    index.remove(0xABCDEF)
+    assert index.lookup(flip(0xABCDEF, 3)) is None
+    assert len(index) == 0
+
+
+def test_featureless_hashes_are_not_informative():
+    assert not informative(0, min_bits=8)
+    assert not informative((1 << 64) - 1, min_bits=8)
+    assert not informative(0b1111111, min_bits=8)
+    assert informative(0xFF, min_bits=8)
+    assert informative(0x0123456789ABCDEF, min_bits=8)
+
+
+def test_dhash_of_a_solid_colour_is_featureless():
+    out = io.BytesIO()
+    Image.new("RGB", (64, 64), (255, 0, 0)).save(out, format="PNG")
+    assert not informative(dhash(out.getvalue()))
+
+
+def test_dhash_returns_none_for_decompression_bombs(monkeypatch):
+    out = io.BytesIO()
+    Image.effect_noise((400, 400), 64).save(out, format="PNG")
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100 * 100 // 2)
+    assert dhash(out.getvalue()) is None
+
+
+def test_dhash_returns_none_for_undecodable_bytes():
+    assert dhash(b"not an image") is None
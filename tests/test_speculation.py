@@ -0,0 +1,64 @@
+"""
+Tests for speculation.py: the in-flight budget holds while drafts are still
+queued, and unclaimed drafts are dropped after the result TTL.
+"""
+
+import asyncio
+
+import pytest
+
+import speculation
+from speculation import Speculator
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    calls = []
+
+    async def fetch_caption(description, tone=""):
+        calls.append(tone)
+        await asyncio.sleep(0.05)
+        return f"caption ({tone or 'no tone'})"
+
+    monkeypatch.setattr(speculation, "fetch_caption", fetch_caption)
+    return calls
+
+
+def test_budget_counts_drafts_that_have_not_started_yet(fetches):
+    async def run():
+        speculator = Speculator(enabled=True, tones=["funny", "chill"], max_in_flight=2)
+        # Three uploads in a row, before any draft task has had a chance to run.
+        for uid in ("a", "b", "c"):
+            speculator.start(uid, f"description {uid}")
+        queued = speculator.stats()
+        assert fetches == []
+        # Cancel one upload's drafts before they ever run: their slots come back.
+        speculator.discard("a")
+        await asyncio.sleep(0.01)
+        freed = speculator.stats()["in_flight"]
+        speculator.start("d", "description d")
+        await asyncio.sleep(0.1)
+        return queued, freed, speculator.stats()
+
+    queued, freed, done = asyncio.run(run())
+    assert (queued["started"], queued["skipped_over_budget"], queued["in_flight"]) == (2, 7, 2)
+    assert freed == 0
+    assert done["started"] == 4 and done["in_flight"] == 0
+    assert len(fetches) == 2
+
+
+def test_unclaimed_drafts_expire_with_the_result(fetches):
+    async def run():
+        speculator = Speculator(enabled=True, tones=[], ttl=0.3)
+        speculator.start("a", "description a")
+        await asyncio.sleep(0.2)
+        speculator.start("b", "description b")
+        await asyncio.sleep(0.15)
+        # a is 0.35s old and dropped; b (0.15s) is kept and can still be claimed.
+        assert await speculator.claim("a", "description a") is None
+        caption = await speculator.claim("b", "description b")
+        return caption, speculator.stats()
+
+    caption, stats = asyncio.run(run())
+    assert caption == "caption (no tone)"
+    assert stats["expired"] == 1 and stats["uploads_tracked"] == 0
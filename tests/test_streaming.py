@@ -0,0 +1,68 @@
+"""
+Tests for the streaming caption page: the first caption token must reach
+the client long before the model has finished the caption.
+"""
+
+import socket
+import threading
+import time
+import uuid
+
+import httpx
+import pytest
+import uvicorn
+
+import app as caption_app
+from llm_client import llm_client
+from provider_stubs import CAPTIONS, ProviderProfile, StubServer
+
+# The stub waits FIRST_TOKEN seconds, then sends a word every TOKEN_INTERVAL.
+FIRST_TOKEN = 0.05
+TOKEN_INTERVAL = 0.3
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    stub = StubServer(ProviderProfile(), ProviderProfile(FIRST_TOKEN, token_interval=TOKEN_INTERVAL), port=0).start()
+    monkeypatch.setattr(llm_client, "base_url", f"{stub.url}/v1")
+    monkeypatch.setattr(llm_client, "api_key", "test")
+    port = free_port()
+    app_server = uvicorn.Server(uvicorn.Config(caption_app.app, port=port, log_level="warning"))
+    thread = threading.Thread(target=app_server.run, daemon=True)
+    thread.start()
+    while not app_server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}"
+    app_server.should_exit = True
+    thread.join()
+    stub.stop()
+
+
+def test_first_caption_token_arrives_before_the_caption_is_done(server):
+    uid = str(uuid.uuid4())
+    caption_app.analysis_results.put(uid, "a dog running on a beach at sunset")
+    first_words = {caption.split(" ")[0] for caption in CAPTIONS}
+
+    start = time.perf_counter()
+    first_token = None
+    body = ""
+    with httpx.stream("POST", f"{server}/generate_caption_stream", data={"uid": uid, "fresh": "true"},
+                      timeout=30) as response:
+        assert response.status_code == 200
+        for chunk in response.iter_text():
+            body += chunk
+            caption = body.partition('<div class="box">')[2]
+            if first_token is None and any(word in caption for word in first_words):
+                first_token = time.perf_counter() - start
+    total = time.perf_counter() - start
+
+    # Every caption has at least four words, so the whole reply takes 3+ intervals.
+    assert total >= FIRST_TOKEN + 3 * TOKEN_INTERVAL
+    assert first_token is not None
+    assert first_token < FIRST_TOKEN + TOKEN_INTERVAL
@@ -0,0 +1,98 @@
+"""
+Tests for upload handling in app.py: oversized bodies are refused before the
+form is spooled, and read_upload's peak memory stays near the image size.
+"""
+
+import asyncio
+import os
+import tempfile
+import tracemalloc
+
+from starlette.datastructures import Headers, UploadFile
+
+import app as caption_app
+
+LIMIT = caption_app.MAX_UPLOAD_BYTES + caption_app.FORM_OVERHEAD_BYTES
+BOUNDARY = "testboundary"
+
+
+def call(path: str, headers: list, chunks):
+    """
+    Sends a POST through the whole ASGI app, feeding the body from chunks.
+
+    Returns:
+        tuple: (status, body chunks received by the app)
+    """
+    received = []
+    sent = []
+
+    async def receive():
+        chunk = next(chunks, None)
+        if chunk is None:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        received.append(len(chunk))
+        return {"type": "http.request", "body": chunk, "more_body": True}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "root_path": "", "scheme": "http", "server": ("test", 80), "client": ("test", 1), "asgi": {"version": "3.0"},
+             "http_version": "1.1", "headers": [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+             + headers}
+    asyncio.run(caption_app.app(scope, receive, send))
+    return sent[0]["status"], received
+
+
+def endless_body(chunk_size: int = 1024 * 1024):
+    yield (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.jpg\"\r\n"
+           f"Content-Type: image/jpeg\r\n\r\n").encode()
+    while True:
+        yield b"\xff" * chunk_size
+
+
+def test_content_length_over_the_limit_is_refused_unread():
+    status, received = call("/upload_image", [(b"content-length", str(5 * 1024 ** 3).encode())], endless_body())
+    assert status == 413
+    assert received == []
+
+
+def test_chunked_body_is_cut_off_at_the_limit():
+    status, received = call("/generate", [(b"transfer-encoding", b"chunked")], endless_body())
+    assert status == 413
+    assert sum(received) <= LIMIT + 1024 * 1024
+
+
+def test_batch_body_limit():
+    headers = [(b"content-length", str(caption_app.BATCH_MAX_BYTES + 1).encode())]
+    status, received = call("/batch_captions", headers, endless_body())
+    assert status == 413
+    assert received == []
+
+
+def peak_read_ratio(size: int, known_size: bool) -> float:
+    # Peak Python allocations while reading one upload, relative to its size.
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spool.write(os.urandom(size))
+    spool.seek(0)
+    upload = UploadFile(spool, filename="a.jpg", size=size if known_size else None,
+                        headers=Headers({"content-type": "image/jpeg"}))
+
+    async def read():
+        # Traced inside the running loop, so only the read itself counts.
+        tracemalloc.start()
+        try:
+            data = await caption_app.read_upload(upload)
+            return data, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    data, peak = asyncio.run(read())
+    assert len(data) == size
+    return peak / size
+
+
+def test_read_upload_peak_memory():
+    size = 16 * 1024 * 1024
+    assert peak_read_ratio(size, known_size=True) < 1.1
+    assert peak_read_ratio(size, known_size=False) < 2.1
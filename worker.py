@@ -0,0 +1,186 @@
+"""
+worker.py
+
+Runs image analysis jobs from the durable job queue (job_queue.py) in
+processes of their own, next to the web processes. Analysis capacity then
+scales separately from request handling, and CPU-heavy work (local BLIP,
+preprocessing, scene tags) does not compete with it.
+
+Each worker process runs WORKER_CONCURRENCY threads. Each thread leases one
+job at a time, describes the image and writes the description to the shared
+result store, where /analysis_status and /generate_caption pick it up. A
+heartbeat thread keeps the leases of running jobs alive. It also fails jobs
+whose last attempt was lost with a crashed worker.
+
+On SIGTERM or SIGINT (a deploy or scale-down) the worker stops leasing and
+finishes the jobs it holds before exiting. A job interrupted by a hard kill is
+leased again by another worker once its lease expires.
+
+Workers have no /metrics endpoint of their own; the web processes export the
+queue depth and the age of the oldest queued job.
+
+Usage:
+    JOB_QUEUE=1 RESULT_STORE=sqlite python worker.py --concurrency 4
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+from admission import Overloaded, background
+from analysis import describe_bytes, warmup
+from job_queue import FAILED, JOB_QUEUE, Job, JobQueue
+from result_store import RESULT_STORE, ResultStore, create_result_store
+
+# ------------------------------------------------------------------------------
+# Configuration (environment variables):
+# WORKER_CONCURRENCY    - jobs each worker process runs at once.
+# WORKER_POLL_INTERVAL  - seconds an idle thread waits before checking for jobs.
+# ------------------------------------------------------------------------------
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "0.2"))
+
+logger = logging.getLogger("worker")
+
+
+class Worker:
+    """
+    Leases analysis jobs and runs them until stopped.
+
+    Args:
+        queue (JobQueue): The job queue.
+        results (ResultStore): Where descriptions are stored for the web tier.
+        concurrency (int): Jobs run at once (one thread each).
+        poll_interval (float): Idle wait between checks for new jobs (s).
+    """
+
+    def __init__(self, queue: JobQueue, results: ResultStore, concurrency: int = WORKER_CONCURRENCY,
+                 poll_interval: float = WORKER_POLL_INTERVAL):
+        self.queue = queue
+        self.results = results
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        # uid -> lease owner, for the jobs being run right now
+        self._running = {}
+
+        self.completed = 0
+        self.retried = 0
+        self.deferred = 0
+        self.failed = 0
+
+    def run(self):
+        """
+        Runs jobs until stop() is called, then waits for the jobs in hand.
+        """
+        threads = [threading.Thread(target=self._loop, args=(f"{self.name}:{i}",), name=f"worker-{i}")
+                   for i in range(self.concurrency)]
+        heartbeat = threading.Thread(target=self._heartbeat, name="worker-heartbeat", daemon=True)
+        for thread in threads:
+            thread.start()
+        heartbeat.start()
+        for thread in threads:
+            thread.join()
+
+    def stop(self):
+        """
+        Stops leasing new jobs; run() returns once the running ones finish.
+        """
+        self._stopping.set()
+
+    def _loop(self, owner: str):
+        # Nobody is waiting on a queued job's response; let interactive calls go first.
+        with background():
+            while not self._stopping.is_set():
+                job = self.queue.lease(owner)
+                if job is None:
+                    self._stopping.wait(self.poll_interval)
+                    continue
+                with self._lock:
+                    self._running[job.uid] = owner
+                try:
+                    self._run(job, owner)
+                except Exception as e:
+                    # The lease expires and another attempt picks the job up.
+                    logger.exception("Job %s could not be recorded: %s", job.uid, e)
+                finally:
+                    with self._lock:
+                        self._running.pop(job.uid, None)
+
+    def _run(self, job: Job, owner: str):
+        start = time.perf_counter()
+        try:
+            description = describe_bytes(job.data)
+        except Overloaded as e:
+            # Not the job's fault: try again once the provider has room,
+            # without using up one of its attempts.
+            if self.queue.defer(job.uid, owner, e.retry_after):
+                self._count("deferred")
+                logger.info("Job %s deferred for %.0fs: %s", job.uid, e.retry_after, e)
+            return
+        except Exception as e:
+            status = self.queue.fail(job.uid, owner, f"{type(e).__name__}: {e}")
+            if status == FAILED:
+                # Drop the pending marker so waiters fall back to the default description.
+                self.results.pop(job.uid)
+                self._count("failed")
+                logger.error("Job %s failed after %d attempts: %s", job.uid, job.attempt, e)
+            elif status is not None:
+                self._count("retried")
+                logger.warning("Job %s attempt %d failed, will retry: %s", job.uid, job.attempt, e)
+            return
+        self.results.put(job.uid, description)
+        if self.queue.complete(job.uid, owner):
+            self._count("completed")
+        logger.info("Job %s done in %.2fs (attempt %d)", job.uid, time.perf_counter() - start, job.attempt)
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _heartbeat(self):
+        # A daemon thread: it keeps the leases alive until the process exits.
+        interval = max(self.queue.lease_seconds / 3, 0.1)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                running = list(self._running.items())
+            for uid, owner in running:
+                if not self.queue.extend(uid, owner):
+                    logger.warning("Lost the lease on job %s; another worker may run it again.", uid)
+            for uid in self.queue.reap():
+                self.results.pop(uid)
+                logger.error("Job %s failed: its last attempt's lease expired.", uid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run image analysis jobs from the job queue.")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="jobs run at once")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if not JOB_QUEUE:
+        logger.warning("JOB_QUEUE is not set to 1, so the web app is not enqueueing jobs.")
+    if RESULT_STORE != "sqlite":
+        parser.error("set RESULT_STORE=sqlite so the web processes can read the results.")
+
+    worker = Worker(JobQueue(), create_result_store(), concurrency=args.concurrency)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: worker.stop())
+    start = time.perf_counter()
+    warmup()
+    logger.info("Worker %s ready in %.2fs with %d threads.", worker.name, time.perf_counter() - start,
+                args.concurrency)
+    worker.run()
+    logger.info("Worker %s stopped: %d done, %d retried, %d deferred, %d failed.", worker.name,
+                worker.completed, worker.retried, worker.deferred, worker.failed)
+
+
+if __name__ == "__main__":
+    main()